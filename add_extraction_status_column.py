@@ -0,0 +1,29 @@
+import os
+import sys
+
+# Ajouter le répertoire parent au chemin Python pour pouvoir importer les modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import db, app
+
+def add_extraction_status_column():
+    """Ajoute la colonne extraction_status à la table documents"""
+    with app.app_context():
+        # Vérifier si la colonne existe déjà
+        inspector = db.inspect(db.engine)
+        columns = [column['name'] for column in inspector.get_columns('documents')]
+        if 'extraction_status' in columns:
+            print("La colonne extraction_status existe déjà dans la table documents.")
+            return
+
+        try:
+            with db.engine.connect() as conn:
+                conn.execute(db.text("ALTER TABLE documents ADD COLUMN extraction_status VARCHAR(20);"))
+                conn.commit()
+
+            print("La colonne extraction_status a été ajoutée avec succès à la table documents.")
+        except Exception as e:
+            print(f"Erreur lors de l'ajout de la colonne: {str(e)}")
+
+if __name__ == "__main__":
+    add_extraction_status_column()
@@ -0,0 +1,23 @@
+import os
+import sys
+
+# Ajouter le répertoire parent au chemin Python pour pouvoir importer les modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import db, app
+from models import MonthlyLedger
+from ledger import rebuild_ledger
+
+def add_monthly_ledger_table():
+    """Crée la table monthly_ledger et la remplit à partir des paiements et charges existants"""
+    with app.app_context():
+        MonthlyLedger.__table__.create(db.engine, checkfirst=True)
+
+        try:
+            count = rebuild_ledger()
+            print(f"Grand livre mensuel rempli: {count} lignes.")
+        except Exception as e:
+            print(f"Erreur lors du remplissage du grand livre mensuel: {str(e)}")
+
+if __name__ == "__main__":
+    add_monthly_ledger_table()
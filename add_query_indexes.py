@@ -0,0 +1,100 @@
+"""
+Ajoute les index des filtres fréquents sur une base existante.
+
+- Index composites déclarés dans models.py (statut + date des paiements et des
+  charges, bien + date des paiements, documents par bien / société, biens par
+  immeuble, contacts par catégorie) : SQLite et PostgreSQL.
+- PostgreSQL uniquement : index trigrammes (extension pg_trgm) pour les
+  recherches ilike('%...%') sur l'adresse des biens et le nom des contacts.
+  SQLite ne peut pas indexer une recherche par sous-chaîne ; ces filtres
+  restent des parcours de table.
+
+Sous PostgreSQL les index sont créés avec CONCURRENTLY (sans bloquer les
+écritures). Les statistiques du planificateur sont ensuite mises à jour.
+
+    python add_query_indexes.py           # créer les index manquants
+    python add_query_indexes.py --drop    # supprimer les index (comparaison avant/après)
+"""
+import os
+import sys
+
+# Ajouter le répertoire parent au chemin Python pour pouvoir importer les modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import db, app
+from models import Property, Document, Payment, Expense, Contact
+
+# Tables dont les index déclarés dans les modèles sont créés par ce script
+INDEXED_MODELS = (Property, Document, Payment, Expense, Contact)
+
+# Index trigrammes PostgreSQL : nom -> (table, colonne)
+TRIGRAM_INDEXES = {
+    'ix_properties_address_trgm': ('properties', 'address'),
+    'ix_contacts_first_name_trgm': ('contacts', 'first_name'),
+    'ix_contacts_last_name_trgm': ('contacts', 'last_name'),
+    'ix_contacts_company_name_trgm': ('contacts', 'company_name'),
+}
+
+
+def get_index_statements(dialect_name):
+    """Retourne {nom: instruction CREATE INDEX} pour le dialecte donné"""
+    concurrently = 'CONCURRENTLY ' if dialect_name == 'postgresql' else ''
+    statements = {}
+    for model in INDEXED_MODELS:
+        table = model.__table__
+        for index in table.indexes:
+            columns = ', '.join(column.name for column in index.columns)
+            statements[index.name] = (
+                f"CREATE INDEX {concurrently}IF NOT EXISTS {index.name} ON {table.name} ({columns})"
+            )
+    if dialect_name == 'postgresql':
+        for name, (table_name, column) in TRIGRAM_INDEXES.items():
+            statements[name] = (
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table_name} USING gin ({column} gin_trgm_ops)"
+            )
+    return statements
+
+
+def add_query_indexes():
+    """Crée les index manquants puis met à jour les statistiques"""
+    with app.app_context():
+        dialect_name = db.engine.dialect.name
+        statements = get_index_statements(dialect_name)
+
+        # CREATE INDEX CONCURRENTLY ne peut pas s'exécuter dans une transaction
+        with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            if dialect_name == 'postgresql':
+                try:
+                    conn.execute(db.text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                except Exception as e:
+                    print(f"Extension pg_trgm indisponible, index trigrammes ignorés: {str(e)}")
+                    statements = {name: sql for name, sql in statements.items() if name not in TRIGRAM_INDEXES}
+
+            for name, sql in statements.items():
+                try:
+                    conn.execute(db.text(sql))
+                    print(f"Index {name} présent.")
+                except Exception as e:
+                    print(f"Erreur lors de la création de l'index {name}: {str(e)}")
+
+            conn.execute(db.text("ANALYZE"))
+        print("Statistiques du planificateur mises à jour.")
+
+
+def drop_query_indexes():
+    """Supprime les index ajoutés par ce script (pour mesurer l'avant/après)"""
+    with app.app_context():
+        dialect_name = db.engine.dialect.name
+        concurrently = 'CONCURRENTLY ' if dialect_name == 'postgresql' else ''
+        with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            for name in get_index_statements(dialect_name):
+                conn.execute(db.text(f"DROP INDEX {concurrently}IF EXISTS {name}"))
+                print(f"Index {name} supprimé.")
+            conn.execute(db.text("ANALYZE"))
+
+
+if __name__ == "__main__":
+    if '--drop' in sys.argv:
+        drop_query_indexes()
+    else:
+        add_query_indexes()
@@ -4,33 +4,38 @@ import calendar
 
 # Message de démarrage de l'application
 print(f"===== DÉMARRAGE DE L'APPLICATION =====")
-from flask import Flask, render_template, request, redirect, url_for, flash, send_from_directory, session, g, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, send_from_directory, session, g, jsonify, abort
 from werkzeug.utils import secure_filename
 from werkzeug.security import check_password_hash
 from functools import wraps
-from flask_session import Session
 from flask_wtf.csrf import CSRFProtect
 from sqlalchemy import or_, func
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 import shutil
 import json
+import mimetypes
+import threading
+from collections import OrderedDict
 
 # Import de la base de données depuis database.py
 from database import db, init_db
 
-# Set up logging with more detailed format
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
-)
+# Journalisation : niveaux, format (texte ou JSON), écriture asynchrone et
+# échantillonnage réglés par variables d'environnement (voir logging_setup.py)
+from logging_setup import configure_logging, SAMPLED
+configure_logging()
+
+# Messages d'authentification émis à chaque requête (niveau réglable via LOG_LEVELS=app.auth=...)
+auth_logger = logging.getLogger('app.auth')
 
 # Create Flask app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "default_secret_key_for_development")
 
-# Configuration des sessions
-app.config['SESSION_TYPE'] = 'filesystem'
+# Configuration des sessions (côté serveur, voir session_store.py) :
+# 'sqlalchemy' (base de l'application), 'sqlite' (magasin local) ou 'filesystem' (Flask-Session)
+app.config['SESSION_TYPE'] = os.environ.get('SESSION_TYPE', 'sqlalchemy')
 app.config['SESSION_PERMANENT'] = True
 app.config['SESSION_USE_SIGNER'] = True
 app.config['SESSION_FILE_DIR'] = os.path.join(app.root_path, 'flask_session')
@@ -39,7 +44,6 @@ app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=31)
 app.config['SESSION_COOKIE_SECURE'] = False  # Pour permettre HTTP en développement
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
-Session(app)
 
 # Configuration pour Flask-Mail
 from flask_mail import Mail
@@ -70,6 +74,10 @@ def csrf_exempt():
 # Initialize database with Flask app
 init_db(app)
 
+# Sessions côté serveur (la table http_sessions est créée avec les autres par db.create_all)
+from session_store import init_session
+init_session(app)
+
 # Empêcher la double initialisation de la base de données
 app.config['SQLALCHEMY_ALREADY_INITIALIZED'] = True
 
@@ -114,10 +122,24 @@ app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max upload size (pou
 # Ensure the upload directory exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Service des fichiers téléversés : les noms sont uniques et jamais réécrits, on peut donc
+# les mettre en cache longtemps. UPLOAD_SENDFILE délègue le transfert au proxy frontal :
+# "x-accel" (nginx, X-Accel-Redirect vers UPLOAD_ACCEL_PREFIX) ou "x-sendfile" (Apache, lighttpd)
+app.config['UPLOAD_CACHE_MAX_AGE'] = 365 * 24 * 60 * 60
+# Nombre d'ETag de fichiers téléversés gardés en mémoire par processus
+app.config['UPLOAD_ETAG_CACHE_SIZE'] = int(os.environ.get('UPLOAD_ETAG_CACHE_SIZE', '4096'))
+app.config['UPLOAD_SENDFILE'] = os.environ.get('UPLOAD_SENDFILE', '').lower()
+app.config['UPLOAD_ACCEL_PREFIX'] = os.environ.get('UPLOAD_ACCEL_PREFIX', '/protected-uploads/')
+app.config['USE_X_SENDFILE'] = app.config['UPLOAD_SENDFILE'] == 'x-sendfile'
+
+# Tableau de bord : afficher la page immédiatement et diffuser les widgets au fur et à mesure
+# (/dashboard/widget_stream) au lieu de les calculer avant le rendu. Aussi activable par ?stream=1
+app.config['DASHBOARD_STREAM_WIDGETS'] = os.environ.get('DASHBOARD_STREAM_WIDGETS', '0') == '1'
+
 # Fonction pour vérifier automatiquement les paiements en retard
 @app.before_request
 def check_late_payments():
-    """Vérifier automatiquement les paiements en retard à chaque requête"""
+    """Mettre à jour les statuts en retard au plus une fois par jour et par processus"""
     # Ne pas exécuter pour les requêtes statiques ou les endpoints non critiques
     if request.endpoint and (
         request.endpoint.startswith('static') or 
@@ -125,57 +147,51 @@ def check_late_payments():
     ):
         return
 
-    # Importer Payment ici pour éviter les erreurs d'importation circulaire
-    from models import Payment
-
-    # Vérifier et mettre à jour le statut des paiements en retard
-    today = datetime.now().date()
-    payments = Payment.query.filter_by(status='En attente').all()
-    updated = False
-
-    for payment in payments:
-        if payment.check_late_status():
-            payment.status = 'En retard'
-            updated = True
+    # Import ici pour éviter les erreurs d'importation circulaire
+    from status_engine import maybe_run_status_update
+    maybe_run_status_update()
 
-    if updated:
-        try:
-            db.session.commit()
-            logging.info(f"Mise à jour automatique des paiements en retard - {datetime.now()}")
-        except Exception as e:
-            db.session.rollback()
-            logging.error(f"Erreur lors de la mise à jour des paiements en retard: {str(e)}")
+    # Créer les échéances à venir des séries sans fin (si RECURRING_MATERIALIZE_ON_REQUEST=1, sinon par cron)
+    recurring_schedule.maybe_materialize_series()
 
 # Import models after db is defined
 from models import Property, Document, Building, User, Payment, Company, Contact
 
+# Tenue incrémentale du grand livre mensuel (écouteur before_flush)
+import ledger
+import recurring_schedule
+import user_cache
+import reference_data
+from property_documents import get_property_with_relations, load_property_documents, REQUIRED_DOCUMENT_TYPES
+from pagination import keyset_page, count_rows, encode_cursor, decode_cursor, InvalidCursor, COUNT_MODES
+
 # Décorateur personnalisé pour remplacer @login_required avec plus de logging
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        logging.info(f"Vérification login_required - Session: {session}")
+        auth_logger.info("Vérification login_required - Session: %s", session, extra=SAMPLED)
 
         if 'user_id' not in session:
-            logging.warning(f"Accès refusé: user_id non trouvé dans la session")
+            auth_logger.warning("Accès refusé: user_id non trouvé dans la session")
             flash('Veuillez vous connecter pour accéder à cette page.', 'info')
             return redirect(url_for('login', next=request.url))
 
-        # Vérifier que l'utilisateur existe toujours en base
-        user = User.query.get(session['user_id'])
+        # Vérifier que l'utilisateur existe toujours en base (chargé une fois par requête)
+        user = user_cache.get_request_user()
         if not user:
-            logging.warning(f"Accès refusé: user_id {session['user_id']} non trouvé en base de données")
+            auth_logger.warning("Accès refusé: user_id %s non trouvé en base de données", session['user_id'])
             session.clear()
             flash('Session invalide. Veuillez vous reconnecter.', 'warning')
             return redirect(url_for('login', next=request.url))
 
-        logging.info(f"Accès autorisé pour l'utilisateur {user.username} (ID: {user.id})")
+        auth_logger.info("Accès autorisé pour l'utilisateur %s (ID: %s)", user.username, user.id, extra=SAMPLED)
         return f(*args, **kwargs)
     return decorated_function
 
 # Fonction pour récupérer l'utilisateur actuel
 def get_current_user():
     if 'user_id' in session:
-        user = User.query.get(session['user_id'])
+        user = user_cache.get_request_user()
         if user:
             return user
         else:
@@ -195,7 +211,7 @@ def inject_user():
         'is_authenticated': current_user is not None,
     }
 
-    logging.info(f"Context processor - Session info: {session_info}")
+    auth_logger.debug("Context processor - Session info: %s", session_info, extra=SAMPLED)
 
     # Retourner les variables pour les templates
     return {
@@ -206,11 +222,8 @@ def inject_user():
 # Middleware pour vérifier l'utilisateur à chaque requête
 @app.before_request
 def load_logged_in_user():
-    user_id = session.get('user_id')
-    if user_id:
-        g.user = User.query.get(user_id)
-    else:
-        g.user = None
+    # Renseigne g.user, réutilisé ensuite par login_required et get_current_user
+    user_cache.get_request_user()
 
 
 def allowed_file(filename):
@@ -236,23 +249,40 @@ def index():
     """Rediriger vers le tableau de bord"""
     return redirect(url_for('dashboard.dashboard'))
 
-@app.route('/properties')
-@login_required
-def properties_list():
-    """Display all properties with multiple filtering options"""
-    # Récupérer tous les paramètres de filtre
-    owner_company = request.args.get('owner_company', '')
-    address = request.args.get('address', '')
-    min_rent = request.args.get('min_rent', '')
-    max_rent = request.args.get('max_rent', '')
-    min_surface = request.args.get('min_surface', '')
-    max_surface = request.args.get('max_surface', '')
-    floor = request.args.get('floor', '')
-    occupied = request.args.get('occupied', '')
-    building_id = request.args.get('building_id', '')
-    is_furnished = request.args.get('is_furnished', '')
-    has_property_manager = request.args.get('has_property_manager', '')
-    has_syndic = request.args.get('has_syndic', '')
+# Filtres de la liste des biens (paramètres de requête)
+PROPERTY_FILTERS = (
+    'owner_company', 'address', 'min_rent', 'max_rent', 'min_surface', 'max_surface',
+    'floor', 'occupied', 'building_id', 'is_furnished', 'has_property_manager', 'has_syndic'
+)
+
+# Colonnes de tri de la liste des biens (pagination par clé, départagée par l'id)
+PROPERTY_SORTS = {
+    'id': Property.id,
+    'address': Property.address,
+    'rent': Property.rent,
+    'surface': Property.surface,
+    'entry_date': Property.entry_date,
+    'created_at': Property.created_at,
+}
+
+PROPERTIES_PER_PAGE = 50
+PROPERTIES_MAX_PER_PAGE = 200
+
+
+def filter_properties_query(filters):
+    """Construit la requête des biens correspondant aux filtres (dictionnaire de chaînes)"""
+    owner_company = filters.get('owner_company', '')
+    address = filters.get('address', '')
+    min_rent = filters.get('min_rent', '')
+    max_rent = filters.get('max_rent', '')
+    min_surface = filters.get('min_surface', '')
+    max_surface = filters.get('max_surface', '')
+    floor = filters.get('floor', '')
+    occupied = filters.get('occupied', '')
+    building_id = filters.get('building_id', '')
+    is_furnished = filters.get('is_furnished', '')
+    has_property_manager = filters.get('has_property_manager', '')
+    has_syndic = filters.get('has_syndic', '')
 
     # Construire la requête avec les filtres
     query = Property.query
@@ -314,20 +344,111 @@ def properties_list():
     elif has_syndic == 'no':
         query = query.filter(Property.has_syndic == False)
 
-    # Appliquer le tri par ID
-    query = query.order_by(Property.id)
+    return query
 
-    # Exécuter la requête
-    properties = query.all()
 
-    # Récupérer tous les immeubles pour le filtre
-    buildings = Building.query.all()
-    
+def get_properties_page(args):
+    """
+    Retourne (biens, pagination) pour une page de la liste des biens.
+
+    Première page : filtres, tri (sort, order=asc|desc), taille (per_page) et mode de
+    comptage (count=exact|estimate|none) sont lus dans `args`. Pages suivantes : seul
+    le curseur (cursor) est transmis ; il contient les filtres, le tri et la dernière
+    clé affichée, et le comptage n'est pas refait.
+    Lève InvalidCursor si le curseur est invalide.
+    """
+    cursor = args.get('cursor')
+    if cursor:
+        state = decode_cursor(cursor)
+        try:
+            filters, sort, descending, per_page, after = state['f'], state['s'], state['d'], state['n'], state['k']
+        except (KeyError, TypeError):
+            raise InvalidCursor("Curseur incomplet")
+        if sort not in PROPERTY_SORTS:
+            raise InvalidCursor(f"Tri inconnu: {sort}")
+    else:
+        filters = {key: args.get(key) for key in PROPERTY_FILTERS if args.get(key)}
+        sort = args.get('sort', 'id')
+        if sort not in PROPERTY_SORTS:
+            sort = 'id'
+        descending = args.get('order') == 'desc'
+        per_page = min(max(args.get('per_page', PROPERTIES_PER_PAGE, type=int) or PROPERTIES_PER_PAGE, 1),
+                       PROPERTIES_MAX_PER_PAGE)
+        after = None
+
+    query = filter_properties_query(filters)
+    properties, last_key = keyset_page(query, PROPERTY_SORTS[sort], Property.id, per_page, after, descending)
+
+    # Le nombre total n'est calculé qu'à la première page
+    count, count_exact = None, False
+    if not cursor:
+        count_mode = args.get('count', 'estimate')
+        count, count_exact = count_rows(query, count_mode if count_mode in COUNT_MODES else 'estimate')
+
+    next_cursor = None
+    if last_key:
+        next_cursor = encode_cursor({'f': filters, 's': sort, 'd': descending, 'n': per_page, 'k': last_key})
+
+    return properties, {
+        'filters': filters,
+        'sort': sort,
+        'order': 'desc' if descending else 'asc',
+        'per_page': per_page,
+        'count': count,
+        'count_exact': count_exact,
+        'next_cursor': next_cursor,
+    }
+
+
+@app.route('/properties')
+@login_required
+def properties_list():
+    """Display properties page by page with multiple filtering options"""
+    try:
+        properties, pagination = get_properties_page(request.args)
+    except InvalidCursor:
+        flash('Lien de pagination invalide, retour à la première page', 'warning')
+        return redirect(url_for('properties_list'))
+
+    # Immeubles pour le filtre (id et nom, depuis le cache des listes de référence)
+    buildings = reference_data.get_buildings()
+
     # Afficher la vue standard des propriétés (dashboard supprimé comme demandé)
-    return render_template('property_list.html', 
-                          properties=properties, 
+    return render_template('property_list.html',
+                          properties=properties,
                           buildings=buildings,
-                          filters=request.args)
+                          filters=pagination['filters'],
+                          pagination=pagination)
+
+
+@app.route('/api/properties')
+@login_required
+def properties_list_json():
+    """Liste paginée des biens au format JSON (défilement infini), mêmes paramètres que /properties"""
+    try:
+        properties, pagination = get_properties_page(request.args)
+    except InvalidCursor:
+        return jsonify({'error': 'Curseur de pagination invalide'}), 400
+
+    return jsonify({
+        'properties': [{
+            'id': prop.id,
+            'address': prop.address,
+            'owner_company': prop.owner_company,
+            'rent': prop.rent,
+            'charges': prop.charges,
+            'surface': prop.surface,
+            'floor': prop.floor,
+            'tenant': prop.tenant,
+            'building_id': prop.building_id,
+            'is_furnished': prop.is_furnished,
+            'has_property_manager': prop.has_property_manager,
+            'has_syndic': prop.has_syndic,
+            'entry_date': prop.entry_date.isoformat() if prop.entry_date else None,
+            'url': url_for('property_detail', property_id=prop.id),
+        } for prop in properties],
+        **pagination
+    })
 
 
 # La route dashboard a été supprimée et remplacée par les pages dédiées :
@@ -435,45 +556,24 @@ def add_property():
 @login_required
 def property_detail(property_id):
     """Display property details and associated documents"""
-    property = Property.query.get_or_404(property_id)
-    
-    # Récupérer les documents directement associés à la propriété
-    direct_documents = Document.query.filter_by(property_id=property_id).all()
-    
-    # Récupérer les documents associés via la société propriétaire
-    company_documents = []
-    if property.company_id:
-        # Documents associés à la société avec property_id=None (pas associés à un bien spécifique)
-        company_documents_general = Document.query.filter_by(company_id=property.company_id, property_id=None).all()
-        
-        # Documents associés à la société ET à cette propriété spécifique
-        company_documents_specific = Document.query.filter_by(company_id=property.company_id, property_id=property_id).all()
-        
-        company_documents = company_documents_general + company_documents_specific
+    property = get_property_with_relations(property_id)
+    if property is None:
+        abort(404)
     
-    # Combiner tous les documents
-    all_documents = direct_documents + company_documents
+    # Documents du bien et documents généraux de la société, en une requête
+    property_documents = load_property_documents(property)
     
     # Récupérer la liste de tous les immeubles pour la sélection
-    buildings = Building.query.all()
-    
-    # Assurez-vous que tous les types de documents essentiels sont définis
-    document_types = ['Bail', 'DPE', 'VISALE', 'Assurance locataire', 'État des lieux', 'Caution']
-    
-    # Créer un dictionnaire des documents existants par type
-    documents_by_type = {}
-    for doc_type in document_types:
-        doc = next((d for d in all_documents if d.document_type == doc_type), None)
-        documents_by_type[doc_type] = doc
+    buildings = reference_data.get_buildings()
     
     return render_template('detail.html', 
                           property=property, 
-                          documents=all_documents,
-                          direct_documents=direct_documents,
-                          company_documents=company_documents,
+                          documents=property_documents['documents'],
+                          direct_documents=property_documents['direct_documents'],
+                          company_documents=property_documents['company_documents'],
                           buildings=buildings,
-                          document_types=document_types,
-                          documents_by_type=documents_by_type)
+                          document_types=REQUIRED_DOCUMENT_TYPES,
+                          documents_by_type=property_documents['documents_by_type'])
 
 
 @app.route('/property/<int:property_id>/edit', methods=['GET', 'POST'])
@@ -598,14 +698,14 @@ def upload_document(property_id):
         db.session.add(document)
         db.session.commit()
 
-        # Traiter le document pour extraire son contenu si possible
+        # Extraire le contenu en arrière-plan pour ne pas bloquer la requête
         try:
             # Import ici pour éviter les problèmes d'importation circulaire
-            from document_processor import process_document
-            process_document(document.id)
-            flash('Document uploaded and processed successfully!', 'success')
+            from extraction_queue import enqueue_document
+            enqueue_document(document.id)
+            flash('Document uploaded successfully! Its content is being extracted in the background.', 'success')
         except Exception as e:
-            app.logger.error(f"Error processing document: {str(e)}")
+            app.logger.error(f"Error queuing document extraction: {str(e)}")
             flash('Document uploaded but could not be processed. It will be available for viewing.', 'warning')
     else:
         flash('File type not allowed', 'danger')
@@ -613,11 +713,90 @@ def upload_document(property_id):
     return redirect(url_for('property_detail', property_id=property_id))
 
 
+# ETag des fichiers téléversés (LRU) : {nom: (mtime, taille, sha256)}
+_upload_etags = OrderedDict()
+_upload_etags_lock = threading.Lock()
+
+
+def _upload_etag(filename, file_path):
+    """
+    Return the ETag of an uploaded file: its SHA-256 from the content store. The
+    file is never hashed on the request path; until its content has been
+    extracted, a tag built from its size and modification time is used (stored
+    files are never rewritten).
+    """
+    stat = os.stat(file_path)
+    with _upload_etags_lock:
+        cached = _upload_etags.get(filename)
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            _upload_etags.move_to_end(filename)
+            return cached[2]
+
+    document = Document.query.with_entities(Document.id).filter_by(filepath=filename).first()
+    if document:
+        from content_cache import get_record_metadata
+        record = get_record_metadata(document.id)
+        if record and record.get('file_hash'):
+            with _upload_etags_lock:
+                _upload_etags[filename] = (stat.st_mtime_ns, stat.st_size, record['file_hash'])
+                _upload_etags.move_to_end(filename)
+                while len(_upload_etags) > app.config['UPLOAD_ETAG_CACHE_SIZE']:
+                    _upload_etags.popitem(last=False)
+            return record['file_hash']
+
+    # Pas encore d'empreinte : étiquette provisoire, non conservée (l'empreinte la remplacera)
+    return f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+
 @app.route('/uploads/<filename>')
 @login_required
 def uploaded_file(filename):
-    """Serve uploaded files"""
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    """Serve uploaded files (Range, ETag/If-None-Match, optional proxy offload)"""
+    filename = secure_filename(filename)
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    if not filename or not os.path.isfile(file_path):
+        return 'Not found', 404
+
+    etag = _upload_etag(filename, file_path)
+    max_age = app.config['UPLOAD_CACHE_MAX_AGE']
+
+    if app.config['UPLOAD_SENDFILE'] == 'x-accel':
+        # Python ne vérifie que l'authentification et les métadonnées ; nginx envoie le fichier
+        # (et gère lui-même les requêtes Range)
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+        else:
+            response = app.response_class()
+            response.headers['X-Accel-Redirect'] = app.config['UPLOAD_ACCEL_PREFIX'] + filename
+            response.headers['Content-Type'] = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response.set_etag(etag)
+    else:
+        # Avec USE_X_SENDFILE, Flask ajoute l'en-tête X-Sendfile au lieu d'envoyer le contenu
+        response = send_from_directory(app.config['UPLOAD_FOLDER'], filename, etag=etag, max_age=max_age)
+
+    response.cache_control.private = True
+    response.cache_control.max_age = max_age
+    response.cache_control.immutable = True
+    return response
+
+
+@app.route('/document/<int:document_id>/extraction-status')
+@login_required
+def document_extraction_status(document_id):
+    """Retourner l'avancement de l'extraction du contenu d'un document (JSON)"""
+    from extraction_queue import get_job
+
+    document = Document.query.get_or_404(document_id)
+    job = get_job(document_id) or {}
+    return jsonify({
+        'document_id': document.id,
+        'status': document.extraction_status,
+        'attempts': job.get('attempts', 0),
+        'max_attempts': job.get('max_attempts'),
+        'next_attempt_at': job.get('next_attempt_at'),
+        'last_error': job.get('last_error'),
+        'updated_at': job.get('updated_at'),
+    })
 
 
 @app.route('/document/<int:document_id>/delete', methods=['POST'])
@@ -637,6 +816,14 @@ def delete_document(document_id):
         db.session.delete(document)
         db.session.commit()
 
+        # Retirer le document de l'index de recherche, de la file d'extraction et du cache des contenus
+        from search_index import remove_document
+        from extraction_queue import remove_job
+        from content_cache import delete_record
+        remove_document(document_id)
+        remove_job(document_id)
+        delete_record(document_id)
+
         flash('Document deleted successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -1486,8 +1673,8 @@ def test_auth():
             logging.error(f"Erreur lors de la mise à jour du contact : {str(e)}")
 
     # Pour le formulaire GET
-    properties = Property.query.all()
-    buildings = Building.query.all()
+    properties = reference_data.get_properties()
+    buildings = reference_data.get_buildings()
 
     # Propriétés et bâtimentsdéjà associés
     selected_property_ids = [prop.id for prop in contact.properties]
@@ -1734,6 +1921,20 @@ def change_payment_status(payment_id):
     return redirect(url_for('property_payments', property_id=payment.property_id))
 
 
+@app.route('/status-engine', methods=['GET', 'POST'])
+@login_required
+def status_engine_stats():
+    """Afficher (GET) ou forcer (POST, administrateurs uniquement) la mise à jour des statuts en retard"""
+    from status_engine import run_status_update, get_status_engine_stats
+
+    if request.method == 'POST':
+        if not get_current_user().is_admin:
+            auth_logger.warning(f"Mise à jour forcée des statuts refusée à l'utilisateur {session.get('user_id')}")
+            return jsonify({'error': 'Réservé aux administrateurs'}), 403
+        return jsonify(run_status_update())
+    return jsonify(get_status_engine_stats())
+
+
 @app.route('/property/<int:property_id>/payment/recurring', methods=['GET', 'POST'])
 @login_required
 def add_recurring_payment(property_id):
@@ -1751,18 +1952,13 @@ def add_recurring_payment(property_id):
         # Récupérer les paramètres de récurrence
         start_month = int(request.form.get('start_month'))
         start_year = int(request.form.get('start_year'))
-        num_months = int(request.form.get('num_months'))
         payment_day = int(request.form.get('payment_day'))
+        frequency = request.form.get('recurring_frequency') or 'mensuel'
+        # Série sans fin seulement sur demande explicite ; sinon le nombre d'échéances est obligatoire
+        open_ended = 'open_ended' in request.form
+        num_months = None if open_ended else int(request.form.get('num_months') or 0)
         adjust_first_month = 'adjust_first_month' in request.form
 
-        # Limiter le nombre de mois à 24 pour éviter les abus
-        if num_months > 24:
-            num_months = 24
-
-        # Limiter le jour de paiement à 28 pour éviter les problèmes avec février
-        if payment_day > 28:
-            payment_day = 28
-
         # Conversion des données
         try:
             amount = float(amount) if amount else None
@@ -1775,52 +1971,48 @@ def add_recurring_payment(property_id):
             flash('Montant et type de paiement sont obligatoires', 'danger')
             return redirect(url_for('add_recurring_payment', property_id=property_id))
 
-        payments_created = 0
+        if (not (1 <= payment_day <= 31) or not (1 <= start_month <= 12)
+                or frequency not in recurring_schedule.FREQUENCY_MONTHS
+                or (not open_ended and num_months < 1)):
+            flash('Paramètres de récurrence invalides', 'danger')
+            return redirect(url_for('add_recurring_payment', property_id=property_id))
 
         try:
             # Créer un identifiant unique pour ce groupe de paiements récurrents
             recurring_group_id = f"recurring_{property_id}_{payment_type}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
 
-            # Créer les paiements récurrents
-            for i in range(num_months):
-                month = (start_month + i - 1) % 12 + 1  # Assurer que month est entre 1 et 12
-                year = start_year + (start_month + i - 1) // 12  # Incrémenter l'année si nécessaire
-
-                # Créer la date de paiement
-                payment_date = datetime(year, month, payment_day).date()
-
-                # Ajuster le montant du premier mois si demandé
-                current_amount = amount
-                if i == 0 and adjust_first_month and start_month == datetime.now().month and start_year == datetime.now().year:
-                    # Nombre de jours dans le mois
-                    days_in_month = calendar.monthrange(year, month)[1]
-                    # Nombre de jours restants dans le mois depuis aujourd'hui
-                    days_remaining = days_in_month - datetime.now().day + 1
-                    # Calcul du montant ajusté au prorata
-                    current_amount = round(amount * days_remaining / days_in_month, 2)
-                    # Mise à jour de la description
-                    payment_description = f"{description}\nMontant ajusté pour {days_remaining} jours sur {days_in_month}"
-                else:
-                    payment_description = description
-
-                # Créer un nouveau paiement avec les marqueurs de récurrence
-                payment = Payment(
-                    property_id=property_id,
-                    amount=current_amount,
-                    payment_date=payment_date,
-                    payment_type=payment_type,
-                    payment_method=payment_method,
-                    status=status,
-                    description=payment_description,
-                    is_recurring=True,
-                    recurring_group_id=recurring_group_id
-                )
-
-                db.session.add(payment)
-                payments_created += 1
+            # Premier mois au prorata des jours restants si la série démarre ce mois-ci
+            today = datetime.now().date()
+            prorata_from = None
+            if adjust_first_month and start_month == today.month and start_year == today.year:
+                prorata_from = today
+
+            # Échéancier calculé d'un bloc (jour 29 à 31 ramené à la fin des mois courts), insertion en masse ;
+            # une série sans fin n'est créée que sur l'horizon glissant
+            payments_created = recurring_schedule.create_series(
+                'payment',
+                {
+                    'property_id': property_id,
+                    'payment_type': payment_type,
+                    'payment_method': payment_method,
+                    'status': status,
+                    'description': description,
+                    'is_recurring': True,
+                    'recurring_group_id': recurring_group_id,
+                },
+                start=date(start_year, start_month, 1),
+                amount=amount,
+                frequency=frequency,
+                day=payment_day,
+                count=num_months,
+                prorata_from=prorata_from
+            )
 
             db.session.commit()
-            flash(f'{payments_created} paiements récurrents créés avec succès!', 'success')
+            if open_ended:
+                flash(f'Série de paiements sans fin créée : {payments_created} paiements générés à l\'avance.', 'success')
+            else:
+                flash(f'{payments_created} paiements récurrents créés avec succès!', 'success')
             return redirect(url_for('property_payments', property_id=property_id))
 
         except Exception as e:
@@ -1856,24 +2048,15 @@ def delete_recurring_payments(property_id):
         delete_future_only = 'delete_future_only' in request.form
 
         try:
-            # Construire la requête de base
-            query = Payment.query.filter_by(
-                property_id=property_id,
-                recurring_group_id=recurring_group_id,
-                is_recurring=True
+            # Un seul DELETE sur la série (les paiements futurs uniquement si demandé) ;
+            # une série sans fin ne crée plus de nouvelles échéances
+            count_to_delete = recurring_schedule.delete_series(
+                'payment',
+                recurring_group_id,
+                after=datetime.now().date() if delete_future_only else None,
+                property_id=property_id
             )
 
-            # Si on ne supprime que les paiements futurs
-            if delete_future_only:
-                today = datetime.now().date()
-                query = query.filter(Payment.payment_date > today)
-
-            # Compter les paiements à supprimer
-            count_to_delete = query.count()
-
-            # Supprimer les paiements
-            query.delete(synchronize_session=False)
-
             db.session.commit()
 
             flash(f'{count_to_delete} paiements récurrents supprimés avec succès !', 'success')
@@ -1887,12 +2070,65 @@ def delete_recurring_payments(property_id):
     return render_template('payments/delete_recurring.html', property=property, recurring_groups=recurring_groups)
 
 
+@app.route('/recurring/<target>/<recurring_group_id>/<operation>', methods=['POST'])
+@login_required
+def recurring_series_operation(target, recurring_group_id, operation):
+    """
+    Opérations sur une série récurrente (paiements : target=payment, charges : target=expense),
+    chacune en une seule instruction SQL à partir de from_date (AAAA-MM-JJ) :
+    shift (days, months), amount (amount), split, delete. Retourne le nombre de lignes touchées.
+    """
+    if target not in recurring_schedule.TARGETS:
+        return jsonify({'error': 'Type de série inconnu'}), 404
+
+    try:
+        from_date_str = request.form.get('from_date')
+        from_date = datetime.strptime(from_date_str, '%Y-%m-%d').date() if from_date_str else None
+
+        result = {'recurring_group_id': recurring_group_id}
+        if operation == 'shift':
+            result['count'] = recurring_schedule.shift_series(
+                target, recurring_group_id, days=request.form.get('days', 0, type=int),
+                months=request.form.get('months', 0, type=int), from_date=from_date
+            )
+        elif operation == 'amount':
+            result['count'] = recurring_schedule.change_series_amount(
+                target, recurring_group_id, float(request.form['amount']), from_date=from_date
+            )
+        elif operation == 'split':
+            if not from_date:
+                return jsonify({'error': 'from_date est obligatoire pour scinder une série'}), 400
+            result['new_group_id'], result['count'] = recurring_schedule.split_series(
+                target, recurring_group_id, from_date
+            )
+        elif operation == 'delete':
+            result['count'] = recurring_schedule.delete_series(target, recurring_group_id, from_date=from_date)
+        else:
+            return jsonify({'error': 'Opération inconnue'}), 404
+
+        db.session.commit()
+        return jsonify(result)
+
+    except (ValueError, KeyError) as e:
+        db.session.rollback()
+        return jsonify({'error': f'Paramètres invalides: {str(e)}'}), 400
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Erreur lors de l'opération {operation} sur la série {recurring_group_id}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
 # Initialize the database
 with app.app_context():
     # Import models
     from models import Property, Document, Building, User, Payment
     # Create tables
     db.create_all()
+    # Premier démarrage avec le grand livre mensuel : le remplir à partir de l'existant
+    try:
+        ledger.backfill_if_empty()
+    except Exception as e:
+        logging.error(f"Remplissage initial du grand livre mensuel impossible: {str(e)}")
 # Intégration du gestionnaire de fichiers pour les téléversements volumineux
 from file_handler import file_handler
 app.register_blueprint(file_handler)
@@ -1904,7 +2140,7 @@ app.register_blueprint(file_handler)
 def assign_property_to_company(property_id):
     """Assigner un bien à une société existante ou en créer une nouvelle"""
     property = Property.query.get_or_404(property_id)
-    companies = Company.query.order_by(Company.name).all()
+    companies = reference_data.get_companies()
     
     if request.method == 'POST':
         company_action = request.form.get('company_action')
@@ -6,6 +6,8 @@ import os
 from datetime import datetime, timedelta, date
 import uuid
 from app import login_required, allowed_file, generate_unique_filename
+import recurring_schedule
+import reference_data
 import logging
 
 
@@ -73,7 +75,7 @@ def charges_list():
     overdue_count = len(overdue_charges)
     
     # Récupérer toutes les propriétés pour le filtre
-    properties = Property.query.all()
+    properties = reference_data.get_properties()
     
     return render_template(
         'charges/list.html',
@@ -109,6 +111,7 @@ def add_charge():
             is_recurring = 'is_recurring' in request.form
             recurring_frequency = request.form.get('recurring_frequency')
             recurring_count = request.form.get('recurring_count')
+            open_ended = is_recurring and 'open_ended' in request.form
             
             # Convertir les dates
             due_date = datetime.strptime(due_date_str, '%d/%m/%Y').date() if due_date_str else None
@@ -181,71 +184,43 @@ def add_charge():
             
             db.session.add(charge)
             
-            # Si récurrente, créer les charges supplémentaires
-            if is_recurring and recurring_count and int(recurring_count) > 1:
-                count = int(recurring_count)
-                frequency = recurring_frequency
+            # Si récurrente, créer les charges suivantes (nombre donné, ou sans fin sur demande explicite) ;
+            # sans nombre ni demande de série sans fin, une seule charge est créée
+            count = None if open_ended else (int(recurring_count) if recurring_count else 1)
+            created_count = 0
+            if is_recurring and (open_ended or count > 1):
+                frequency = recurring_frequency if recurring_frequency in recurring_schedule.FREQUENCY_MONTHS else 'mensuel'
                 
-                # Déterminer l'intervalle pour les dates suivantes
-                if frequency == 'mensuel':
-                    delta_months = 1
-                elif frequency == 'trimestriel':
-                    delta_months = 3
-                elif frequency == 'semestriel':
-                    delta_months = 6
-                elif frequency == 'annuel':
-                    delta_months = 12
-                else:
-                    delta_months = 1  # Par défaut
-                
-                next_due_date = due_date
-                for i in range(1, count):
-                    # Calculer la prochaine date d'échéance
-                    month = next_due_date.month + delta_months
-                    year = next_due_date.year + (month - 1) // 12
-                    month = ((month - 1) % 12) + 1
-                    try:
-                        next_due_date = date(year, month, next_due_date.day)
-                    except ValueError:  # Si le jour est invalide (ex: 31 février)
-                        # Obtenir le dernier jour du mois
-                        if month == 12:
-                            last_day = date(year + 1, 1, 1) - timedelta(days=1)
-                        else:
-                            last_day = date(year, month + 1, 1) - timedelta(days=1)
-                        next_due_date = last_day
-                    
-                    # Calculer les nouvelles dates de période si nécessaire
-                    next_period_start = None
-                    next_period_end = None
-                    if period_start and period_end:
-                        period_length = (period_end - period_start).days
-                        next_period_start = next_due_date - timedelta(days=period_length)
-                        next_period_end = next_due_date
-                    
-                    # Créer la charge récurrente
-                    recurring_charge = Expense(
-                        charge_type=charge_type,
-                        property_id=property_id,
-                        building_id=building_id,
-                        company_id=company_id,
-                        amount=float(amount),
-                        due_date=next_due_date,
-                        status='à_payer',  # Toujours "à payer" pour les futures charges
-                        reference=reference,
-                        period_start=next_period_start,
-                        period_end=next_period_end,
-                        description=description,
-                        is_recurring=is_recurring,
-                        recurring_frequency=recurring_frequency,
-                        recurring_group_id=recurring_group_id
-                    )
-                    db.session.add(recurring_charge)
+                # Échéances calculées depuis la première (fin de mois conservée), insertion en masse
+                created_count = recurring_schedule.create_series(
+                    'expense',
+                    {
+                        'charge_type': charge_type,
+                        'property_id': property_id,
+                        'building_id': building_id,
+                        'company_id': company_id,
+                        'status': 'à_payer',  # Toujours "à payer" pour les futures charges
+                        'reference': reference,
+                        'description': description,
+                        'is_recurring': is_recurring,
+                        'recurring_frequency': frequency,
+                        'recurring_group_id': recurring_group_id,
+                    },
+                    start=due_date,
+                    amount=float(amount),
+                    frequency=frequency,
+                    count=count,
+                    first_index=1,
+                    period_days=(period_end - period_start).days if period_start and period_end else None
+                )
             
             db.session.commit()
             flash('Charge ajoutée avec succès !', 'success')
             
-            if is_recurring and int(recurring_count) > 1:
-                flash(f'{recurring_count} charges récurrentes ont été créées.', 'info')
+            if is_recurring and count and count > 1:
+                flash(f'{count} charges récurrentes ont été créées.', 'info')
+            elif open_ended:
+                flash(f'Série de charges sans fin créée : {created_count + 1} échéances générées à l\'avance.', 'info')
                 
             return redirect(url_for('charges_list'))
             
@@ -255,9 +230,9 @@ def add_charge():
             logging.error(f"Erreur lors de l'ajout de la charge: {str(e)}")
     
     # Récupérer les données pour les listes déroulantes
-    properties = Property.query.all()
-    buildings = Building.query.all()
-    companies = Company.query.all()
+    properties = reference_data.get_properties()
+    buildings = reference_data.get_buildings()
+    companies = reference_data.get_companies()
     
     return render_template(
         'charges/add.html',
@@ -340,22 +315,24 @@ def edit_charge(charge_id):
             charge.period_end = period_end
             charge.description = description
             
-            # Si demandé, mettre à jour toutes les charges récurrentes futures
+            # Si demandé, mettre à jour toutes les charges récurrentes futures (un seul UPDATE)
             if update_all_recurring and charge.is_recurring and charge.recurring_group_id:
-                future_charges = Expense.query.filter(
-                    Expense.recurring_group_id == charge.recurring_group_id,
-                    Expense.due_date > datetime.now().date(),
-                    Expense.id != charge.id
-                ).all()
-                
-                for future_charge in future_charges:
-                    future_charge.charge_type = charge_type
-                    future_charge.property_id = property_id
-                    future_charge.building_id = building_id
-                    future_charge.company_id = company_id
-                    future_charge.amount = float(amount)
-                    future_charge.reference = reference
-                    future_charge.description = description
+                updated_count = recurring_schedule.update_series(
+                    'expense',
+                    charge.recurring_group_id,
+                    {
+                        'charge_type': charge_type,
+                        'property_id': property_id,
+                        'building_id': building_id,
+                        'company_id': company_id,
+                        'amount': float(amount),
+                        'reference': reference,
+                        'description': description,
+                    },
+                    after=datetime.now().date(),
+                    exclude_id=charge.id
+                )
+                logging.info(f"{updated_count} charges futures de la série {charge.recurring_group_id} mises à jour")
             
             db.session.commit()
             flash('Charge modifiée avec succès !', 'success')
@@ -377,9 +354,9 @@ def edit_charge(charge_id):
         association_type = 'property'  # Par défaut
     
     # Récupérer les données pour les listes déroulantes
-    properties = Property.query.all()
-    buildings = Building.query.all()
-    companies = Company.query.all()
+    properties = reference_data.get_properties()
+    buildings = reference_data.get_buildings()
+    companies = reference_data.get_companies()
     
     return render_template(
         'charges/edit.html',
@@ -399,17 +376,10 @@ def delete_charge(charge_id):
     delete_all_recurring = request.form.get('delete_all_recurring') == 'true'
     
     try:
-        # Si demandé, supprimer toutes les charges récurrentes
+        # Si demandé, supprimer toutes les charges récurrentes (un seul DELETE, série sans fin arrêtée)
         if delete_all_recurring and charge.is_recurring and charge.recurring_group_id:
-            related_charges = Expense.query.filter(
-                Expense.recurring_group_id == charge.recurring_group_id,
-                Expense.id != charge.id
-            ).all()
-            
-            for related_charge in related_charges:
-                db.session.delete(related_charge)
-            
-            flash(f'{len(related_charges) + 1} charges récurrentes supprimées avec succès !', 'success')
+            deleted_count = recurring_schedule.delete_series('expense', charge.recurring_group_id)
+            flash(f'{deleted_count} charges récurrentes supprimées avec succès !', 'success')
         else:
             db.session.delete(charge)
             flash('Charge supprimée avec succès !', 'success')
@@ -586,20 +556,13 @@ def replace_charge_document(charge_id):
 
 def update_expenses_status():
     """Mettre à jour le statut des charges en fonction de la date d'échéance"""
-    today = date.today()
+    from status_engine import update_late_expenses
     
     try:
-        # Mettre à jour les charges en retard
-        overdue_charges = Expense.query.filter(
-            Expense.status == 'à_payer',
-            Expense.due_date < today
-        ).all()
-        
-        for charge in overdue_charges:
-            charge.status = 'en_retard'
-        
+        # Un seul UPDATE ensembliste au lieu de charger chaque charge en Python
+        update_late_expenses()
         db.session.commit()
         
     except Exception as e:
         db.session.rollback()
-        logging.error(f"Erreur lors de la mise à jour des statuts de charges: {str(e)}")
\ No newline at end of file
+        logging.error(f"Erreur lors de la mise à jour des statuts de charges: {str(e)}")
@@ -7,6 +7,7 @@ from datetime import datetime
 import uuid
 from functools import wraps
 import logging
+import reference_data
 
 # Récupérer la fonction login_required depuis app.py
 from app import login_required, allowed_file, generate_unique_filename
@@ -308,8 +309,8 @@ def edit_document(document_id):
     is_company_document = document.company_id is not None
     
     # Récupérer les listes pour les menus déroulants
-    companies = Company.query.all() if document.property_id else []
-    properties = Property.query.all() if document.company_id else []
+    companies = reference_data.get_companies() if document.property_id else []
+    properties = reference_data.get_properties() if document.company_id else []
     
     if request.method == 'POST':
         try:
@@ -7,9 +7,30 @@ from werkzeug.utils import secure_filename
 from models import Contact, Property, Building
 from database import db
 from app import app, login_required
+import contact_search
+import reference_data
 
-# Configuration du logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def _database_search_query(search, category=None, favorites_only=False):
+    """
+    Recherche « %texte% » directement dans la base (nom, prénom, société, email,
+    téléphone), triée par nom : utilisée tant que l'index de recherche n'est pas à jour
+    """
+    query = Contact.query.filter(
+        or_(
+            Contact.first_name.ilike(f'%{search}%'),
+            Contact.last_name.ilike(f'%{search}%'),
+            Contact.company_name.ilike(f'%{search}%'),
+            Contact.email.ilike(f'%{search}%'),
+            Contact.phone.ilike(f'%{search}%'),
+            Contact.mobile_phone.ilike(f'%{search}%')
+        )
+    )
+    if category:
+        query = query.filter(Contact.category == category)
+    if favorites_only:
+        query = query.filter(Contact.is_favorite == True)
+    return query.order_by(Contact.last_name, Contact.first_name)
 
 
 @app.route('/contacts')
@@ -21,35 +42,34 @@ def contacts_list():
     category = request.args.get('category', '')
     is_favorite = request.args.get('is_favorite', '')
     
-    # Construire la requête
-    query = Contact.query
-    
-    # Filtre de recherche (nom, prénom, société, email, téléphone)
-    if search:
-        query = query.filter(
-            or_(
-                Contact.first_name.ilike(f'%{search}%'),
-                Contact.last_name.ilike(f'%{search}%'),
-                Contact.company_name.ilike(f'%{search}%'),
-                Contact.email.ilike(f'%{search}%'),
-                Contact.phone.ilike(f'%{search}%'),
-                Contact.mobile_phone.ilike(f'%{search}%')
-            )
-        )
-    
-    # Filtre par catégorie
-    if category:
-        query = query.filter(Contact.category == category)
-    
-    # Filtre par favoris
-    if is_favorite == 'yes':
-        query = query.filter(Contact.is_favorite == True)
-    
-    # Trier par nom
-    query = query.order_by(Contact.last_name, Contact.first_name)
-    
-    # Récupérer les contacts
-    contacts = query.all()
+    # Recherche (nom, prénom, société, email, téléphone) : index trigrammes, classé par pertinence ;
+    # directement dans la base tant que l'index est en cours de (re)construction
+    if search and not contact_search.ensure_index():
+        contacts = _database_search_query(search, category, is_favorite == 'yes').all()
+    elif search:
+        results = contact_search.search(search, category=category or None,
+                                        favorites_only=is_favorite == 'yes',
+                                        limit=contact_search.MAX_RESULTS)
+        ranks = {contact_id: rank for rank, (contact_id, score, values) in enumerate(results)}
+        contacts = Contact.query.filter(Contact.id.in_(list(ranks))).all() if ranks else []
+        contacts.sort(key=lambda contact: ranks[contact.id])
+    else:
+        # Construire la requête
+        query = Contact.query
+        
+        # Filtre par catégorie
+        if category:
+            query = query.filter(Contact.category == category)
+        
+        # Filtre par favoris
+        if is_favorite == 'yes':
+            query = query.filter(Contact.is_favorite == True)
+        
+        # Trier par nom
+        query = query.order_by(Contact.last_name, Contact.first_name)
+        
+        # Récupérer les contacts
+        contacts = query.all()
     
     # Récupérer la liste des catégories pour le filtre
     categories = db.session.query(Contact.category).distinct().all()
@@ -64,6 +84,39 @@ def contacts_list():
     )
 
 
+@app.route('/api/contacts/search')
+@login_required
+def contacts_search_api():
+    """Recherche à la frappe des contacts (JSON), servie par l'index sans requête sur la base"""
+    search = request.args.get('q', '').strip()
+    limit = min(max(request.args.get('limit', 10, type=int) or 10, 1), 50)
+    category = request.args.get('category') or None
+    favorites_only = request.args.get('is_favorite') == 'yes'
+    if not search:
+        results = []
+    elif contact_search.ensure_index():
+        results = contact_search.search(search, category=category, favorites_only=favorites_only, limit=limit)
+    else:
+        # Index en cours de (re)construction : recherche directe dans la base
+        results = [
+            (contact.id, 1.0, {field: getattr(contact, field) for field in contact_search.DISPLAY_FIELDS})
+            for contact in _database_search_query(search, category, favorites_only).limit(limit)
+        ]
+    return jsonify([
+        {
+            'id': contact_id,
+            'name': f"{values.get('first_name') or ''} {values.get('last_name') or ''}".strip(),
+            'company_name': values.get('company_name'),
+            'category': values.get('category'),
+            'email': values.get('email'),
+            'phone': values.get('phone') or values.get('mobile_phone'),
+            'score': round(score, 3),
+            'url': url_for('contact_detail', contact_id=contact_id)
+        }
+        for contact_id, score, values in results
+    ])
+
+
 @app.route('/contact/add', methods=['GET', 'POST'])
 @login_required
 def add_contact():
@@ -128,8 +181,8 @@ def add_contact():
             logging.error(f"Erreur lors de l'ajout du contact : {str(e)}")
     
     # Pour le formulaire GET
-    properties = Property.query.all()
-    buildings = Building.query.all()
+    properties = reference_data.get_properties()
+    buildings = reference_data.get_buildings()
     
     # Catégories prédéfinies
     categories = [
@@ -219,8 +272,8 @@ def edit_contact(contact_id):
             logging.error(f"Erreur lors de la mise à jour du contact : {str(e)}")
     
     # Pour le formulaire GET
-    properties = Property.query.all()
-    buildings = Building.query.all()
+    properties = reference_data.get_properties()
+    buildings = reference_data.get_buildings()
     
     # Propriétés et bâtiments déjà associés
     selected_property_ids = [prop.id for prop in contact.properties]
@@ -1,4 +1,4 @@
-from flask import Blueprint, render_template, request, redirect, url_for, jsonify, session, flash
+from flask import Blueprint, render_template, request, redirect, url_for, jsonify, session, flash, current_app, Response, stream_with_context
 from flask_wtf.csrf import validate_csrf
 import json
 from database import db
@@ -7,7 +7,11 @@ from models import User, Property, Payment, Expense, UserDashboardPreference
 import calendar
 from datetime import datetime, timedelta
 import logging
-from sqlalchemy import func, and_, or_, desc
+from sqlalchemy import func, and_, or_, desc, case
+from sqlalchemy.orm import joinedload
+from ledger import get_ledger_rows, get_monthly_totals, get_category_totals, INCOME, EXPENSE
+import widget_cache
+from widget_executor import iter_widgets
 
 dashboard_bp = Blueprint('dashboard', __name__)
 
@@ -17,55 +21,18 @@ def dashboard():
     """Afficher le tableau de bord personnalisé de l'utilisateur"""
     user_id = session.get('user_id')
     
-    # Récupérer les préférences de l'utilisateur ou utiliser les widgets par défaut
-    user_preference = UserDashboardPreference.query.filter_by(user_id=user_id).first()
+    # Configuration des widgets (en cache jusqu'à modification des préférences)
+    widgets_config = widget_cache.get_or_compute(
+        user_id, widget_cache.LAYOUT, lambda: load_widgets_config(user_id)
+    )
     
-    # Si aucune préférence n'existe, créer une configuration par défaut
-    if not user_preference:
-        logging.info(f"Création d'une configuration de tableau de bord par défaut pour l'utilisateur {user_id}")
-        default_config = get_default_widgets_config()
-        user_preference = UserDashboardPreference(
-            user_id=user_id,
-            widgets_config=json.dumps(default_config)
-        )
-        db.session.add(user_preference)
-        db.session.commit()
-        widgets_config = default_config
-    elif not user_preference.widgets_config:
-        logging.info(f"Configuration vide trouvée pour l'utilisateur {user_id}, initialisation avec la configuration par défaut")
-        default_config = get_default_widgets_config()
-        user_preference.widgets_config = json.dumps(default_config)
-        db.session.commit()
-        widgets_config = default_config
-    else:
-        try:
-            widgets_config = json.loads(user_preference.widgets_config)
-        except json.JSONDecodeError:
-            logging.warning(f"Configuration JSON invalide pour l'utilisateur {user_id}, réinitialisation avec la configuration par défaut")
-            widgets_config = get_default_widgets_config()
-            user_preference.widgets_config = json.dumps(widgets_config)
-            db.session.commit()
+    # Mode flux : la page est rendue tout de suite, les widgets arrivent par /dashboard/widget_stream
+    stream = request.args.get('stream', '1' if current_app.config.get('DASHBOARD_STREAM_WIDGETS') else '0') == '1'
     
-    # Récupérer les données pour chaque widget actif
+    # Récupérer les données des widgets actifs (sources partagées, calcul en parallèle)
     widget_data = {}
-    
-    for widget in widgets_config:
-        if widget.get('active', True):
-            widget_type = widget.get('type')
-            widget_id = widget.get('id')
-            
-            if widget_type == 'late_payments':
-                widget_data[widget_id] = get_late_payments_data(user_id)
-            elif widget_type == 'upcoming_expenses':
-                widget_data[widget_id] = get_upcoming_expenses_data(user_id)
-            elif widget_type == 'monthly_income':
-                widget_data[widget_id] = get_monthly_income_data(user_id)
-            elif widget_type == 'yearly_summary':
-                widget_data[widget_id] = get_yearly_summary_data(user_id)
-            elif widget_type == 'late_expenses':
-                widget_data[widget_id] = get_late_expenses_data(user_id)
-            elif widget_type == 'property_status':
-                widget_data[widget_id] = get_property_status_data(user_id)
+    if not stream:
+        widget_data = dict(iter_widget_data(user_id, widgets_config))
     
     # Données pour la liste des widgets disponibles à ajouter
     available_widgets = [
@@ -81,7 +48,8 @@ def dashboard():
         'dashboard/dashboard.html',
         widgets_config=widgets_config,
         widget_data=widget_data,
-        available_widgets=available_widgets
+        available_widgets=available_widgets,
+        widget_stream_url=url_for('dashboard.widget_stream') if stream else None
     )
 
 @dashboard_bp.route('/dashboard/save_layout', methods=['POST'])
@@ -254,24 +222,95 @@ def get_widget_data(widget_type):
     """API pour récupérer les données d'un widget spécifique"""
     user_id = session.get('user_id')
     
-    data = {}
-    if widget_type == 'late_payments':
-        data = get_late_payments_data(user_id)
-    elif widget_type == 'upcoming_expenses':
-        data = get_upcoming_expenses_data(user_id)
-    elif widget_type == 'monthly_income':
-        data = get_monthly_income_data(user_id)
-    elif widget_type == 'yearly_summary':
-        data = get_yearly_summary_data(user_id)
-    elif widget_type == 'late_expenses':
-        data = get_late_expenses_data(user_id)
-    elif widget_type == 'property_status':
-        data = get_property_status_data(user_id)
+    if widget_type not in WIDGET_DATA_FUNCTIONS:
+        return jsonify({})
+    
+    params = {}
+    if widget_type == 'property_status':
+        params = {
+            'page': request.args.get('page', 1, type=int),
+            'per_page': request.args.get('per_page', 10, type=int),
+            'sort': request.args.get('sort', 'late_payments')
+        }
+    data = get_cached_widget_data(user_id, widget_type, **params)
     
     return jsonify(data)
 
+@dashboard_bp.route('/dashboard/widget_stream')
+@login_required
+def widget_stream():
+    """Diffuse les données des widgets actifs (une ligne JSON par widget) dès qu'elles sont prêtes"""
+    user_id = session.get('user_id')
+    widgets_config = widget_cache.get_or_compute(
+        user_id, widget_cache.LAYOUT, lambda: load_widgets_config(user_id)
+    )
+    
+    def generate():
+        for widget_id, data in iter_widget_data(user_id, widgets_config):
+            yield json.dumps({'id': widget_id, 'data': data}, default=str) + '\n'
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'}
+    )
+
+@dashboard_bp.route('/dashboard/cache_stats')
+@login_required
+def widget_cache_stats():
+    """API exposant les compteurs du cache des widgets (succès, échecs, invalidations)"""
+    return jsonify(widget_cache.get_stats())
+
 # Fonctions auxiliaires pour récupérer les données des widgets
 
+def iter_widget_data(user_id, widgets_config):
+    """Produit (widget_id, données) pour chaque widget actif, dans l'ordre où ils sont prêts"""
+    widgets = [
+        (widget.get('id'), widget.get('type'), {})
+        for widget in widgets_config
+        if widget.get('active', True) and widget.get('type') in WIDGET_DATA_FUNCTIONS
+    ]
+    return iter_widgets(user_id, widgets, WIDGET_DATA_FUNCTIONS, WIDGET_SOURCES, WIDGET_SOURCE_LOADERS)
+
+def get_cached_widget_data(user_id, widget_type, **params):
+    """Retourne les données d'un widget depuis le cache, ou les calcule"""
+    compute = WIDGET_DATA_FUNCTIONS[widget_type]
+    return widget_cache.get_or_compute(
+        user_id, widget_type, lambda: compute(user_id, **params), params
+    )
+
+def load_widgets_config(user_id):
+    """Charge la configuration des widgets de l'utilisateur (créée par défaut si absente ou invalide)"""
+    user_preference = UserDashboardPreference.query.filter_by(user_id=user_id).first()
+    
+    # Si aucune préférence n'existe, créer une configuration par défaut
+    if not user_preference:
+        logging.info(f"Création d'une configuration de tableau de bord par défaut pour l'utilisateur {user_id}")
+        default_config = get_default_widgets_config()
+        user_preference = UserDashboardPreference(
+            user_id=user_id,
+            widgets_config=json.dumps(default_config)
+        )
+        db.session.add(user_preference)
+        db.session.commit()
+        widgets_config = default_config
+    elif not user_preference.widgets_config:
+        logging.info(f"Configuration vide trouvée pour l'utilisateur {user_id}, initialisation avec la configuration par défaut")
+        default_config = get_default_widgets_config()
+        user_preference.widgets_config = json.dumps(default_config)
+        db.session.commit()
+        widgets_config = default_config
+    else:
+        try:
+            widgets_config = json.loads(user_preference.widgets_config)
+        except json.JSONDecodeError:
+            logging.warning(f"Configuration JSON invalide pour l'utilisateur {user_id}, réinitialisation avec la configuration par défaut")
+            widgets_config = get_default_widgets_config()
+            user_preference.widgets_config = json.dumps(widgets_config)
+            db.session.commit()
+    
+    return widgets_config
+
 def get_default_widgets_config():
     """Retourne la configuration par défaut des widgets"""
     return [
@@ -312,7 +351,9 @@ def get_late_payments_data(user_id):
     # Dans une version future, nous ajouterons une colonne user_id au modèle Property.
     try:
         # Récupérer tous les paiements en retard (status='En retard')
-        late_payments = Payment.query.filter(
+        late_payments = Payment.query.options(
+            joinedload(Payment.property)
+        ).filter(
             Payment.status == 'En retard'
         ).order_by(
             Payment.payment_date  # utiliser payment_date au lieu de due_date
@@ -352,36 +393,12 @@ def get_late_payments_data(user_id):
         'total_amount': sum(payment.get('amount', 0) for payment in payments_data)
     }
 
-def get_upcoming_expenses_data(user_id):
+def get_upcoming_expenses_data(user_id, due_expenses=None):
     """Récupère les charges à venir dans les 30 prochains jours"""
-    today = datetime.now().date()
-    thirty_days_later = today + timedelta(days=30)
-    
     try:
-        # Récupérer les charges à venir
-        upcoming_expenses = Expense.query.filter(
-            Expense.status == 'à_payer',
-            Expense.due_date >= today,
-            Expense.due_date <= thirty_days_later
-        ).order_by(
-            Expense.due_date
-        ).limit(10).all()
-        
-        # Formater les données pour l'affichage
-        expenses_data = []
-        for expense in upcoming_expenses:
-            property_info = f"{expense.property.address}" if expense.property else "Bien inconnu"
-            company_info = f"{expense.company.name}" if expense.company else ""
-            
-            expenses_data.append({
-                'id': expense.id,
-                'property': property_info,
-                'company': company_info,
-                'type': expense.get_charge_type_display(),
-                'amount': expense.amount,
-                'due_date': expense.due_date.strftime('%d/%m/%Y') if expense.due_date else "Date inconnue",
-                'days_remaining': (expense.due_date - today).days if expense.due_date else 0
-            })
+        if due_expenses is None:
+            due_expenses = load_due_expenses()
+        expenses_data = due_expenses['upcoming']
     except Exception as e:
         logging.error(f"Erreur lors de la récupération des charges à venir: {str(e)}")
         expenses_data = []
@@ -392,60 +409,18 @@ def get_upcoming_expenses_data(user_id):
         'total_amount': sum(expense.get('amount', 0) for expense in expenses_data)
     }
 
-def get_monthly_income_data(user_id):
-    """Récupère les revenus mensuels des 12 derniers mois"""
-    today = datetime.now().date()
-    
+def get_monthly_income_data(user_id, ledger=None):
+    """Récupère les revenus mensuels des 12 derniers mois (depuis le grand livre mensuel)"""
     try:
-        # Calculer la date de début (12 mois en arrière)
-        start_date = datetime(today.year - 1, today.month, 1).date()
-        
-        # Préparer les données mensuelles pour les 12 derniers mois
-        monthly_data = {}
-        for i in range(12):
-            # Calculer le mois (à partir de 11 mois en arrière jusqu'au mois actuel)
-            month_date = (today.replace(day=1) - timedelta(days=1)) - timedelta(days=30 * i)
-            month_key = month_date.strftime('%Y-%m')
-            month_name = month_date.strftime('%b %Y')
-            
-            monthly_data[month_key] = {
-                'month': month_name,
-                'income': 0,
-                'expenses': 0
-            }
-        
-        # Récupérer tous les paiements payés dans cette période
-        payments = Payment.query.filter(
-            Payment.status == 'Payé',
-            Payment.payment_date >= start_date
-        ).all()
-        
-        # Ajouter les revenus par mois
-        for payment in payments:
-            if payment.payment_date:
-                month_key = payment.payment_date.strftime('%Y-%m')
-                if month_key in monthly_data:
-                    monthly_data[month_key]['income'] += payment.amount
-        
-        # Récupérer toutes les charges payées dans cette période
-        expenses = Expense.query.filter(
-            Expense.status == 'Payé',
-            Expense.payment_date >= start_date
-        ).all()
-        
-        # Ajouter les dépenses par mois
-        for expense in expenses:
-            if expense.payment_date:
-                month_key = expense.payment_date.strftime('%Y-%m')
-                if month_key in monthly_data:
-                    monthly_data[month_key]['expenses'] += expense.amount
+        months = _last_twelve_months()
+        (start_year, start_month), (end_year, end_month) = months[0], months[-1]
+        totals = get_monthly_totals(start_year, start_month, end_year, end_month, rows=ledger)
         
-        # Convertir en liste triée par mois
         chart_data = []
-        for month_key in sorted(monthly_data.keys()):
-            data = monthly_data[month_key]
+        for year, month in months:
+            data = totals.get((year, month), {'income': 0, 'expenses': 0})
             chart_data.append({
-                'month': data['month'],
+                'month': datetime(year, month, 1).strftime('%b %Y'),
                 'income': data['income'],
                 'expenses': data['expenses'],
                 'profit': data['income'] - data['expenses']
@@ -465,38 +440,19 @@ def get_monthly_income_data(user_id):
         'total_profit': total_income - total_expenses
     }
 
-def get_yearly_summary_data(user_id):
-    """Récupère un résumé des revenus et dépenses de l'année en cours"""
+def get_yearly_summary_data(user_id, ledger=None):
+    """Récupère un résumé des revenus et dépenses de l'année en cours (depuis le grand livre mensuel)"""
     try:
         current_year = datetime.now().year
-        start_date = datetime(current_year, 1, 1).date()
-        end_date = datetime(current_year, 12, 31).date()
         
-        # Récupérer les paiements de l'année en cours
-        payments = Payment.query.filter(
-            Payment.status == 'Payé',
-            Payment.payment_date >= start_date,
-            Payment.payment_date <= end_date
-        ).all()
-        
-        # Récupérer les charges de l'année en cours
-        expenses = Expense.query.filter(
-            Expense.status == 'Payé',
-            Expense.payment_date >= start_date,
-            Expense.payment_date <= end_date
-        ).all()
-        
-        # Calculer les totaux
-        total_income = sum(payment.amount for payment in payments)
-        total_expenses = sum(expense.amount for expense in expenses)
+        total_income = sum(total or 0 for _, total in get_category_totals(current_year, INCOME, rows=ledger))
         
         # Regrouper les dépenses par type
         expense_by_type = {}
-        for expense in expenses:
-            expense_type = expense.get_charge_type_display()
-            if expense_type not in expense_by_type:
-                expense_by_type[expense_type] = 0
-            expense_by_type[expense_type] += expense.amount
+        for charge_type, amount in get_category_totals(current_year, EXPENSE, rows=ledger):
+            expense_type = Expense.CHARGE_TYPE_LABELS.get(charge_type, charge_type)
+            expense_by_type[expense_type] = expense_by_type.get(expense_type, 0) + (amount or 0)
+        total_expenses = sum(expense_by_type.values())
         
         # Convertir en format pour graphique en camembert
         expense_pie_data = [
@@ -524,86 +480,103 @@ def get_yearly_summary_data(user_id):
         'expense_breakdown': expense_pie_data
     }
 
-def get_property_status_data(user_id):
-    """Récupère un aperçu de l'état de tous les biens"""
+# Tris possibles du widget « État des biens »
+PROPERTY_STATUS_SORTS = ('late_payments', 'pending_expenses', 'last_payment', 'address')
+PROPERTY_STATUS_MAX_PER_PAGE = 100
+
+def get_property_status_data(user_id, page=1, per_page=10, sort='late_payments'):
+    """
+    Récupère un aperçu paginé de l'état de tous les biens.
+    
+    Les compteurs de chaque bien (paiements en retard, charges à payer, dernier
+    paiement reçu) sont calculés par deux sous-requêtes groupées jointes aux biens :
+    le nombre de requêtes reste le même quelle que soit la taille du parc.
+    """
+    page = max(int(page or 1), 1)
+    per_page = min(max(int(per_page or 10), 1), PROPERTY_STATUS_MAX_PER_PAGE)
+    if sort not in PROPERTY_STATUS_SORTS:
+        sort = 'late_payments'
+    
     try:
-        # Récupérer tous les biens (comme nous n'avons pas de colonne user_id,
-        # nous récupérons tous les biens pour l'instant)
-        properties = Property.query.limit(10).all()
+        # Agrégats des paiements par bien
+        payment_stats = db.session.query(
+            Payment.property_id.label('property_id'),
+            func.sum(case((Payment.status == 'En retard', 1), else_=0)).label('late_payments'),
+            func.max(case((Payment.status == 'Payé', Payment.payment_date), else_=None)).label('last_payment_date')
+        ).group_by(Payment.property_id).subquery()
+        
+        # Charges à payer par bien
+        expense_stats = db.session.query(
+            Expense.property_id.label('property_id'),
+            func.count(Expense.id).label('pending_expenses')
+        ).filter(
+            Expense.status == 'à_payer'
+        ).group_by(Expense.property_id).subquery()
+        
+        late_payments = func.coalesce(payment_stats.c.late_payments, 0)
+        pending_expenses = func.coalesce(expense_stats.c.pending_expenses, 0)
+        last_payment_date = payment_stats.c.last_payment_date
+        
+        order_by = {
+            'late_payments': [desc(late_payments), desc(pending_expenses)],
+            'pending_expenses': [desc(pending_expenses), desc(late_payments)],
+            'last_payment': [last_payment_date.is_(None), last_payment_date],
+            'address': [Property.address],
+        }[sort]
+        
+        rows = db.session.query(
+            Property.id, Property.address, Property.tenant,
+            late_payments, pending_expenses, last_payment_date
+        ).outerjoin(
+            payment_stats, payment_stats.c.property_id == Property.id
+        ).outerjoin(
+            expense_stats, expense_stats.c.property_id == Property.id
+        ).order_by(
+            *order_by, Property.id
+        ).limit(per_page).offset((page - 1) * per_page).all()
+        
+        # Totaux du parc (occupation) en une seule requête
+        total_count, occupied_count = db.session.query(
+            func.count(Property.id),
+            func.sum(case((and_(Property.tenant.isnot(None), Property.tenant != ''), 1), else_=0))
+        ).one()
+        total_count = total_count or 0
+        occupied_count = occupied_count or 0
         
         property_stats = []
-        for prop in properties:
-            # Récupérer les paiements en retard pour ce bien
-            late_payments = Payment.query.filter_by(
-                property_id=prop.id,
-                status='En retard'
-            ).count()
-            
-            # Récupérer les charges à payer pour ce bien
-            pending_expenses = Expense.query.filter_by(
-                property_id=prop.id,
-                status='à_payer'
-            ).count()
-            
-            # Calculer l'état d'occupation (utiliser le nom du locataire ou l'état vacant)
-            # Dans notre modèle, l'attribut s'appelle 'tenant'
-            if prop.tenant:
-                tenant_name = prop.tenant
-                occupancy_status = "Occupé"
-            else:
-                tenant_name = "Aucun"
-                occupancy_status = "Vacant"
-                
+        for prop_id, address, tenant, late_count, pending_count, last_date in rows:
+            # Dans notre modèle, le locataire est l'attribut 'tenant'
             property_stats.append({
-                'id': prop.id,
-                'address': prop.address,
-                'tenant': tenant_name,
-                'occupancy': occupancy_status,
-                'late_payments': late_payments,
-                'pending_expenses': pending_expenses,
-                'last_payment_date': get_last_payment_date(prop.id)
+                'id': prop_id,
+                'address': address,
+                'tenant': tenant if tenant else "Aucun",
+                'occupancy': "Occupé" if tenant else "Vacant",
+                'late_payments': late_count,
+                'pending_expenses': pending_count,
+                'last_payment_date': _format_date(last_date)
             })
     except Exception as e:
         logging.error(f"Erreur lors de la récupération des données des propriétés: {str(e)}")
         property_stats = []
+        total_count = occupied_count = 0
     
     return {
         'properties': property_stats,
-        'total_count': len(property_stats),
-        'occupied_count': sum(1 for p in property_stats if p.get('occupancy') == "Occupé"),
-        'vacant_count': sum(1 for p in property_stats if p.get('occupancy') == "Vacant")
+        'total_count': total_count,
+        'occupied_count': occupied_count,
+        'vacant_count': total_count - occupied_count,
+        'page': page,
+        'per_page': per_page,
+        'total_pages': (total_count + per_page - 1) // per_page,
+        'sort': sort
     }
 
-def get_late_expenses_data(user_id):
+def get_late_expenses_data(user_id, due_expenses=None):
     """Récupère les charges en retard"""
-    today = datetime.now().date()
-    
     try:
-        # Récupérer les charges en retard 
-        late_expenses = Expense.query.filter(
-            (Expense.status == 'en_retard') | (Expense.status == 'En retard')
-        ).order_by(
-            Expense.due_date
-        ).limit(10).all()
-        
-        # Formater les données pour l'affichage
-        expenses_data = []
-        for expense in late_expenses:
-            property_info = f"{expense.property.address}" if expense.property else "Bien inconnu"
-            company_info = f"{expense.company.name}" if expense.company else ""
-            
-            # Calculer le retard en jours
-            days_late = (today - expense.due_date).days if expense.due_date else 0
-            
-            expenses_data.append({
-                'id': expense.id,
-                'property': property_info,
-                'company': company_info,
-                'type': expense.get_charge_type_display(),
-                'amount': expense.amount,
-                'due_date': expense.due_date.strftime('%d/%m/%Y') if expense.due_date else "Date inconnue",
-                'days_late': days_late
-            })
+        if due_expenses is None:
+            due_expenses = load_due_expenses()
+        expenses_data = due_expenses['late']
     except Exception as e:
         logging.error(f"Erreur lors de la récupération des charges en retard: {str(e)}")
         expenses_data = []
@@ -614,15 +587,104 @@ def get_late_expenses_data(user_id):
         'total_amount': sum(expense.get('amount', 0) for expense in expenses_data)
     }
 
-def get_last_payment_date(property_id):
-    """Récupère la date du dernier paiement reçu pour un bien"""
-    last_payment = Payment.query.filter_by(
-        property_id=property_id,
-        status='Payé'
-    ).order_by(
-        desc(Payment.payment_date)
-    ).first()
-    
-    if last_payment and last_payment.payment_date:
-        return last_payment.payment_date.strftime('%d/%m/%Y')
-    return "Aucun"
\ No newline at end of file
+# Sources de données partagées entre plusieurs widgets
+
+def _last_twelve_months():
+    """Les 12 derniers mois [(année, mois)], du plus ancien au mois en cours"""
+    today = datetime.now().date()
+    months = []
+    year, month = today.year, today.month
+    for i in range(12):
+        months.append((year, month))
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    months.reverse()
+    return months
+
+def load_ledger_rows():
+    """Cumuls du grand livre couvrant les 12 derniers mois et l'année en cours (revenus mensuels, résumé annuel)"""
+    today = datetime.now().date()
+    start_year, start_month = min(_last_twelve_months()[0], (today.year, 1))
+    return get_ledger_rows(start_year, start_month, today.year, today.month)
+
+def load_due_expenses(limit=10):
+    """
+    Charge en une requête les charges à venir (30 prochains jours) et les charges en
+    retard, les `limit` premières de chaque groupe par échéance, avec leur bien et
+    leur société (charges à venir et charges en retard).
+    """
+    today = datetime.now().date()
+    thirty_days_later = today + timedelta(days=30)
+    
+    is_upcoming = and_(
+        Expense.status == 'à_payer',
+        Expense.due_date >= today,
+        Expense.due_date <= thirty_days_later
+    )
+    is_late = Expense.status.in_(('en_retard', 'En retard'))
+    group = case((is_upcoming, 'upcoming'), else_='late')
+    
+    ranked = db.session.query(
+        Expense.id.label('id'),
+        group.label('group'),
+        func.row_number().over(partition_by=group, order_by=(Expense.due_date, Expense.id)).label('rank')
+    ).filter(or_(is_upcoming, is_late)).subquery()
+    
+    rows = db.session.query(Expense, ranked.c.group).join(
+        ranked, ranked.c.id == Expense.id
+    ).options(
+        joinedload(Expense.property), joinedload(Expense.company)
+    ).filter(
+        ranked.c.rank <= limit
+    ).order_by(Expense.due_date, Expense.id).all()
+    
+    due_expenses = {'upcoming': [], 'late': []}
+    for expense, group_name in rows:
+        days = (expense.due_date - today).days if expense.due_date else 0
+        expense_data = {
+            'id': expense.id,
+            'property': f"{expense.property.address}" if expense.property else "Bien inconnu",
+            'company': f"{expense.company.name}" if expense.company else "",
+            'type': expense.get_charge_type_display(),
+            'amount': expense.amount,
+            'due_date': expense.due_date.strftime('%d/%m/%Y') if expense.due_date else "Date inconnue"
+        }
+        if group_name == 'upcoming':
+            expense_data['days_remaining'] = days
+        else:
+            expense_data['days_late'] = -days
+        due_expenses[group_name].append(expense_data)
+    return due_expenses
+
+def _format_date(value):
+    """Formate une date (objet date ou chaîne ISO renvoyée par SQLite) en JJ/MM/AAAA"""
+    if not value:
+        return "Aucun"
+    if isinstance(value, str):
+        try:
+            value = datetime.strptime(value[:10], '%Y-%m-%d')
+        except ValueError:
+            return value
+    return value.strftime('%d/%m/%Y')
+
+# Fonction de calcul de chaque type de widget
+WIDGET_DATA_FUNCTIONS = {
+    'late_payments': get_late_payments_data,
+    'upcoming_expenses': get_upcoming_expenses_data,
+    'monthly_income': get_monthly_income_data,
+    'yearly_summary': get_yearly_summary_data,
+    'late_expenses': get_late_expenses_data,
+    'property_status': get_property_status_data,
+}
+
+# Sources partagées dont dépend chaque type de widget (chargées une seule fois par affichage)
+WIDGET_SOURCES = {
+    'upcoming_expenses': ('due_expenses',),
+    'late_expenses': ('due_expenses',),
+    'monthly_income': ('ledger',),
+    'yearly_summary': ('ledger',),
+}
+
+WIDGET_SOURCE_LOADERS = {
+    'due_expenses': load_due_expenses,
+    'ledger': load_ledger_rows,
+}
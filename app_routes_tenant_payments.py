@@ -5,10 +5,10 @@ from werkzeug.utils import secure_filename
 import os
 from datetime import datetime, timedelta, date
 import calendar
-import uuid
 from app import login_required, allowed_file, generate_unique_filename
+from rent_calls import generate_rent_calls, month_range, MAX_MONTHS
+import reference_data
 import logging
-logging.basicConfig(level=logging.DEBUG)
 
 
 @app.route('/tenant-payments')
@@ -121,7 +121,7 @@ def tenant_payments_standalone():
     current_year = datetime.now().year
     
     # Récupérer toutes les propriétés pour le filtre
-    properties = Property.query.all()
+    properties = reference_data.get_properties()
     
     return render_template(
         'tenant_payments/standalone_list.html',
@@ -234,103 +234,28 @@ def generate_tenant_payments():
                 flash('Veuillez fournir des dates valides.', 'danger')
                 return redirect(url_for('tenant_payments_standalone'))
             
-            # Calculer la date d'échéance
-            # S'assurer que le jour est valide pour le mois donné
-            try:
-                due_date = date(year, month, day)
-            except ValueError:
-                # Si le jour est invalide (ex: 31 février), utiliser le dernier jour du mois
-                last_day = calendar.monthrange(year, month)[1]
-                due_date = date(year, month, last_day)
-            
-            # Récupérer toutes les propriétés ayant un locataire
-            properties = Property.query.filter(Property.tenant != '').all()
-            
-            if not properties:
-                flash('Aucune propriété avec locataire trouvée.', 'warning')
+            # Période : un mois, ou plusieurs jusqu'au mois de fin facultatif
+            end_month = int(request.form.get('end_month') or month)
+            end_year = int(request.form.get('end_year') or year)
+            months = month_range(year, month, end_year, end_month)
+            if not months or len(months) > MAX_MONTHS:
+                flash(f'Veuillez choisir une période de 1 à {MAX_MONTHS} mois.', 'danger')
                 return redirect(url_for('tenant_payments_standalone'))
             
-            # Pour compter combien de paiements ont été créés
-            created_count = 0
-            
-            # Créer un identifiant de groupe pour les paiements générés
-            group_id = f"gen_{year}_{month}_{uuid.uuid4().hex[:8]}"
+            # Calcul des appels manquants en une requête, insertion en masse
+            dry_run = 'dry_run' in request.form
+            report = generate_rent_calls(months, day=day, include_rent=include_rent,
+                                         include_charges=include_charges, dry_run=dry_run)
             
-            for prop in properties:
-                # Vérifier si un paiement de loyer existe déjà pour ce mois/année/propriété
-                existing_rent = Payment.query.filter(
-                    Payment.property_id == prop.id,
-                    Payment.payment_type == 'Loyer',
-                    Payment.payment_date.between(
-                        date(year, month, 1),
-                        date(year, month, calendar.monthrange(year, month)[1])
-                    )
-                ).first()
-                
-                # Vérifier si un paiement de charges existe déjà pour ce mois/année/propriété
-                existing_charges = Payment.query.filter(
-                    Payment.property_id == prop.id,
-                    Payment.payment_type == 'Charges',
-                    Payment.payment_date.between(
-                        date(year, month, 1),
-                        date(year, month, calendar.monthrange(year, month)[1])
-                    )
-                ).first()
-                
-                # Déterminer le montant total et créer un paiement combiné
-                total_amount = 0
-                payment_types = []
-                
-                if include_rent and prop.rent > 0:
-                    total_amount += prop.rent
-                    payment_types.append('Loyer')
-                
-                if include_charges and prop.charges > 0:
-                    total_amount += prop.charges
-                    payment_types.append('Charges')
-                
-                # Vérifier s'il existe déjà un paiement combiné pour ce mois
-                existing_combined = Payment.query.filter(
-                    Payment.property_id == prop.id,
-                    Payment.payment_type.in_(['Loyer+Charges', 'Loyer', 'Charges']),
-                    Payment.payment_date.between(
-                        date(year, month, 1),
-                        date(year, month, calendar.monthrange(year, month)[1])
-                    )
-                ).first()
-                
-                # Créer le paiement combiné s'il n'existe pas déjà et si au moins un type est demandé
-                if not existing_combined and total_amount > 0:
-                    # Déterminer le type de paiement
-                    if 'Loyer' in payment_types and 'Charges' in payment_types:
-                        payment_type = 'Loyer+Charges'
-                        description = f"Loyer et charges de {calendar.month_name[month]} {year} pour {prop.tenant}"
-                    elif 'Loyer' in payment_types:
-                        payment_type = 'Loyer'
-                        description = f"Loyer de {calendar.month_name[month]} {year} pour {prop.tenant}"
-                    else:
-                        payment_type = 'Charges'
-                        description = f"Charges de {calendar.month_name[month]} {year} pour {prop.tenant}"
-                    
-                    # Créer le paiement
-                    combined_payment = Payment(
-                        property_id=prop.id,
-                        amount=total_amount,
-                        payment_date=due_date,
-                        payment_type=payment_type,
-                        payment_method='',
-                        status='En attente',
-                        description=description,
-                        recurring_group_id=group_id,
-                        is_recurring=True
-                    )
-                    db.session.add(combined_payment)
-                    created_count += 1
-            
-            db.session.commit()
-            
-            if created_count > 0:
-                flash(f'{created_count} paiements générés avec succès pour {calendar.month_name[month]} {year} !', 'success')
+            period_label = ', '.join(
+                f"{calendar.month_name[entry['month']]} {entry['year']} ({entry['count']})"
+                for entry in report['months']
+            )
+            if dry_run:
+                flash(f"Essai à blanc : {report['count']} paiements seraient générés "
+                      f"pour {report['amount']:.2f} € - {period_label}", 'info')
+            elif report['count'] > 0:
+                flash(f"{report['count']} paiements générés avec succès pour {period_label} !", 'success')
             else:
                 flash('Aucun nouveau paiement généré. Les paiements existent peut-être déjà pour ce mois.', 'info')
             
@@ -458,7 +383,7 @@ def edit_tenant_payment(payment_id):
             logging.error(f"Erreur lors de la modification du paiement: {str(e)}")
     
     # Récupérer les propriétés pour le formulaire
-    properties = Property.query.all()
+    properties = reference_data.get_properties()
     
     return render_template(
         'tenant_payments/edit.html',
@@ -529,23 +454,16 @@ def change_tenant_payment_status(payment_id, status):
 
 def check_late_payments():
     """Vérifier si des paiements sont en retard et mettre à jour leur statut"""
-    today = date.today()
+    from status_engine import update_late_payments
     
     try:
-        # Récupérer les paiements en attente dont la date est passée
-        late_payments = Payment.query.filter(
-            Payment.status == 'En attente',
-            Payment.payment_date < today
-        ).all()
-        
-        # Mettre à jour leur statut
-        for payment in late_payments:
-            payment.status = 'En retard'
+        # Un seul UPDATE ensembliste au lieu de charger chaque paiement en Python
+        updated_count = update_late_payments()
         
         # Sauvegarder les modifications
-        if late_payments:
+        if updated_count:
             db.session.commit()
-            logging.info(f"{len(late_payments)} paiements mis à jour en 'En retard'")
+            logging.info(f"{updated_count} paiements mis à jour en 'En retard'")
     
     except Exception as e:
         db.session.rollback()
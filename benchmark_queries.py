@@ -0,0 +1,186 @@
+"""
+Plans d'exécution et temps des requêtes principales de chaque page.
+
+Pour chaque requête : plan du planificateur (EXPLAIN QUERY PLAN sous SQLite,
+EXPLAIN sous PostgreSQL) et temps médian sur plusieurs exécutions.
+
+    python benchmark_queries.py                  # état actuel
+    python benchmark_queries.py --compare        # sans puis avec les index de add_query_indexes.py
+    python benchmark_queries.py --seed 20000     # ajoute d'abord des données de test
+
+--compare supprime puis recrée les index, et --seed écrit des données fictives :
+à utiliser sur une copie de la base (DATABASE_URL), pas en production.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event, func, insert, or_
+
+from app import app, db, filter_properties_query
+from models import Property, Building, Company, Document, Payment, Expense, Contact
+from add_query_indexes import add_query_indexes, drop_query_indexes
+
+
+def get_benchmark_queries():
+    """Retourne [(page, description, requête)] avec des valeurs présentes en base"""
+    property_id = db.session.query(func.min(Property.id)).scalar() or 0
+    company_id = db.session.query(func.min(Company.id)).scalar() or 0
+    building_id = db.session.query(func.min(Building.id)).scalar() or 0
+    category = db.session.query(Contact.category).limit(1).scalar() or 'Plombier'
+    today = date.today()
+
+    return [
+        ('/properties', "recherche par adresse",
+         filter_properties_query({'address': 'rue'}).order_by(Property.id).limit(51)),
+        ('/properties', "filtre par immeuble",
+         filter_properties_query({'building_id': str(building_id)}).order_by(Property.id).limit(51)),
+        ('/dashboard', "paiements en retard",
+         Payment.query.filter(Payment.status == 'En retard').order_by(Payment.payment_date).limit(10)),
+        ('/dashboard', "charges à venir",
+         Expense.query.filter(Expense.status == 'à_payer', Expense.due_date >= today,
+                              Expense.due_date <= today + timedelta(days=30)).order_by(Expense.due_date).limit(10)),
+        ('/dashboard', "charges à payer par bien",
+         db.session.query(Expense.property_id, func.count(Expense.id)).filter(
+             Expense.status == 'à_payer').group_by(Expense.property_id)),
+        ('/property/<id>', "documents du bien",
+         Document.query.filter_by(property_id=property_id)),
+        ('/property/<id>', "documents généraux de la société",
+         Document.query.filter_by(company_id=company_id, property_id=None)),
+        ('/property/<id>/payments', "paiements du bien",
+         Payment.query.filter_by(property_id=property_id).order_by(Payment.payment_date.desc())),
+        ('/contacts', "contacts par catégorie",
+         Contact.query.filter(Contact.category == category).order_by(Contact.last_name, Contact.first_name)),
+        ('/contacts', "recherche par nom",
+         Contact.query.filter(or_(Contact.first_name.ilike('%mar%'), Contact.last_name.ilike('%mar%'),
+                                  Contact.company_name.ilike('%mar%'))).order_by(Contact.last_name)),
+    ]
+
+
+@contextmanager
+def explain_mode():
+    """Préfixe les requêtes exécutées par EXPLAIN (avec leurs vrais paramètres)"""
+    prefix = "EXPLAIN QUERY PLAN " if db.engine.dialect.name == 'sqlite' else "EXPLAIN "
+
+    def add_explain(conn, cursor, statement, parameters, context, executemany):
+        return prefix + statement, parameters
+
+    event.listen(db.engine, 'before_cursor_execute', add_explain, retval=True)
+    try:
+        yield
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', add_explain)
+
+
+def get_plan(query):
+    with explain_mode():
+        # Sans cache de compilation : le résultat d'EXPLAIN n'a pas les colonnes de la requête
+        connection = db.session.connection().execution_options(compiled_cache=None)
+        rows = connection.execute(query.statement).fetchall()
+    # SQLite : (id, parent, notused, detail) ; PostgreSQL : une ligne de texte par nœud
+    return [row[-1] for row in rows]
+
+
+def time_query(query, runs):
+    """Temps médian d'exécution SQL (ms) de la requête, sans construction des objets"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        db.session.connection().execute(query.statement).fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def run_benchmark(runs):
+    """Retourne {(page, description): (plan, temps en ms)}"""
+    results = {}
+    for page, description, query in get_benchmark_queries():
+        results[(page, description)] = (get_plan(query), time_query(query, runs))
+    db.session.rollback()
+    return results
+
+
+def print_results(title, results, reference=None):
+    print(f"\n===== {title} =====")
+    for (page, description), (plan, elapsed) in results.items():
+        line = f"{page:<26} {description:<34} {elapsed:8.2f} ms"
+        if reference and (page, description) in reference:
+            before = reference[(page, description)][1]
+            line += f"   (avant: {before:.2f} ms, x{before / elapsed:.1f})" if elapsed else ""
+        print(line)
+        for step in plan:
+            print(f"    {step}")
+
+
+def seed_data(count):
+    """Ajoute des données fictives en masse (biens, paiements, charges, documents, contacts)"""
+    print(f"Ajout de {count} biens et des données associées...")
+    company = Company(name="Société de test (benchmark)")
+    building = Building(name="Immeuble de test (benchmark)", address="1 rue du Test")
+    db.session.add_all([company, building])
+    db.session.flush()
+
+    first_id = (db.session.query(func.max(Property.id)).scalar() or 0) + 1
+    today = date.today()
+    db.session.execute(insert(Property), [
+        {'address': f"{i} rue {random.choice(['de la Paix', 'Victor Hugo', 'des Lilas', 'du Port'])}",
+         'rent': random.randint(400, 2000), 'charges': 50, 'company_id': company.id,
+         'building_id': building.id if i % 10 == 0 else None, 'tenant': f"Locataire {i}" if i % 3 else None}
+        for i in range(count)
+    ])
+    property_ids = range(first_id, first_id + count)
+    db.session.execute(insert(Payment), [
+        {'property_id': property_id, 'amount': 800, 'payment_type': 'Loyer',
+         'payment_date': today - timedelta(days=30 * month),
+         'status': random.choice(['Payé', 'Payé', 'Payé', 'En attente', 'En retard'])}
+        for property_id in property_ids for month in range(12)
+    ])
+    db.session.execute(insert(Expense), [
+        {'property_id': property_id, 'company_id': company.id, 'charge_type': 'eau', 'amount': 60,
+         'due_date': today + timedelta(days=random.randint(-90, 90)),
+         'status': random.choice(['payé', 'à_payer', 'en_retard'])}
+        for property_id in property_ids for _ in range(4)
+    ])
+    db.session.execute(insert(Document), [
+        {'property_id': property_id if i % 5 else None, 'company_id': company.id,
+         'filename': f"doc_{property_id}_{i}.pdf", 'filepath': f"benchmark_{property_id}_{i}.pdf"}
+        for property_id in property_ids for i in range(3)
+    ])
+    db.session.execute(insert(Contact), [
+        {'first_name': random.choice(['Marie', 'Jean', 'Paul', 'Sophie']), 'last_name': f"Nom{i}",
+         'company_name': f"Entreprise {i % 50}", 'category': random.choice(['Plombier', 'Électricien', 'Syndic'])}
+        for i in range(max(count // 10, 1))
+    ])
+    db.session.commit()
+
+    # Les insertions en masse ne passent pas par le grand livre mensuel
+    from ledger import rebuild_ledger
+    rebuild_ledger()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plans et temps des requêtes principales")
+    parser.add_argument('--runs', type=int, default=20, help="Nombre d'exécutions par requête")
+    parser.add_argument('--compare', action='store_true', help="Mesurer sans puis avec les index")
+    parser.add_argument('--seed', type=int, default=0, help="Ajouter N biens fictifs avant la mesure")
+    args = parser.parse_args()
+
+    with app.app_context():
+        if args.seed:
+            seed_data(args.seed)
+
+        if args.compare:
+            drop_query_indexes()
+            before = run_benchmark(args.runs)
+            print_results("Sans les index", before)
+            add_query_indexes()
+            print_results("Avec les index", run_benchmark(args.runs), reference=before)
+        else:
+            print_results("Requêtes principales", run_benchmark(args.runs))
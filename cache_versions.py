@@ -0,0 +1,90 @@
+"""
+Versions partagées des caches en mémoire, entre tous les processus.
+
+Chaque cache (widgets, listes de référence, utilisateurs) est propre à un
+processus. Pour qu'une écriture faite dans un worker (ou par un script) soit
+vue par les autres, chaque cache nomme les données qu'il conserve ; après la
+validation d'une transaction qui les modifie, leur version est incrémentée
+dans la table cache_versions (transaction courte, distincte). Une entrée en
+cache mémorise la version lue lors de son calcul et n'est plus servie dès que
+la version a changé.
+
+Les versions sont lues en une requête, au plus une fois par requête HTTP.
+Une version incrémentée pendant qu'une entrée est calculée ne fait que
+provoquer un nouveau calcul à l'accès suivant. Si la table est inaccessible,
+les caches retombent sur leur seule durée de vie (TTL).
+"""
+import logging
+
+from flask import g, has_app_context, has_request_context
+from sqlalchemy import event, select, update, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database import db
+from models import CacheVersion
+
+logger = logging.getLogger(__name__)
+
+_table = CacheVersion.__table__
+
+
+def get_versions():
+    """{nom: version} de tous les caches, ou None si la table ne peut être lue"""
+    if has_request_context() and 'cache_versions' in g:
+        return g.cache_versions
+    if not has_app_context():
+        return None
+    try:
+        with db.engine.connect() as conn:
+            versions = dict(conn.execute(select(_table.c.name, _table.c.version)).all())
+    except Exception as e:
+        logger.warning(f"Lecture des versions des caches impossible: {str(e)}")
+        versions = None
+    if has_request_context():
+        g.cache_versions = versions
+    return versions
+
+
+def get_version(name):
+    """Version partagée d'un cache (0 si jamais incrémentée, None si inconnue)"""
+    versions = get_versions()
+    return None if versions is None else versions.get(name, 0)
+
+
+def bump(names):
+    """Incrémente les versions des caches nommés (transaction propre)"""
+    for name in sorted(names):
+        try:
+            with db.engine.begin() as conn:
+                updated = conn.execute(
+                    update(_table).where(_table.c.name == name).values(version=_table.c.version + 1)
+                ).rowcount
+                if not updated:
+                    conn.execute(insert(_table).values(name=name, version=1))
+        except IntegrityError:
+            # Ligne créée au même moment par un autre processus
+            with db.engine.begin() as conn:
+                conn.execute(update(_table).where(_table.c.name == name).values(version=_table.c.version + 1))
+        except Exception as e:
+            logger.error(f"Incrémentation de la version du cache {name} impossible: {str(e)}")
+    if has_request_context():
+        # Les lectures suivantes de cette requête doivent voir les nouvelles versions
+        g.pop('cache_versions', None)
+
+
+def track(session, names):
+    """Note les caches à incrémenter à la validation de la transaction de la session"""
+    session.info.setdefault('cache_versions_pending', set()).update(names)
+
+
+@event.listens_for(Session, 'after_commit')
+def _bump_after_commit(session):
+    pending = session.info.pop('cache_versions_pending', None)
+    if pending:
+        bump(pending)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_after_rollback(session):
+    session.info.pop('cache_versions_pending', None)
@@ -0,0 +1,653 @@
+"""
+Index de recherche approximative des contacts, par trigrammes.
+
+L'index est stocké dans une base SQLite locale (instance/contact_search.sqlite3) :
+- noms, prénoms, sociétés et adresses e-mail sont mis en minuscules et sans
+  accents, puis découpés en mots ; chaque mot distinct du répertoire est
+  découpé en trigrammes (comme pg_trgm) ;
+- les numéros de téléphone sont réduits à leurs chiffres (+33 6 12... -> 0612...)
+  et tous leurs suffixes sont indexés : un fragment de numéro, quel que soit
+  son format, est trouvé par un simple parcours d'intervalle.
+
+Une recherche se fait en deux temps :
+1. chaque mot de la requête est cherché dans le vocabulaire (les mots
+   distincts, bien moins nombreux que les contacts) comme une sous-chaîne :
+   mots commençant par lui (index du vocabulaire), puis mots le contenant
+   (index de leurs suffixes, « pont » trouve « dupont »). En l'absence de
+   correspondance, il est comparé par trigrammes, ce qui tolère les fautes de
+   frappe ;
+2. les contacts contenant les mots trouvés sont lus dans la table des
+   occurrences, triée par nom : pour une requête d'un seul mot, la lecture
+   s'arrête dès que la page de résultats est remplie.
+
+L'index est tenu à jour par les événements de session SQLAlchemy : les contacts
+ajoutés, modifiés ou supprimés sont réindexés après la validation de la
+transaction. Après une modification en masse, ou si l'index ne couvre pas tous
+les contacts (vérifié périodiquement), il est reconstruit dans un thread en
+arrière-plan ; en attendant, ensure_index() retourne False et les recherches
+se font directement dans la base. Reconstruction complète :
+
+    python contact_search.py
+"""
+import os
+import re
+import json
+import math
+import logging
+import sqlite3
+import threading
+import time
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from models import Contact
+from search_index import fold_accents
+
+logger = logging.getLogger(__name__)
+
+INDEX_PATH = os.path.join("instance", "contact_search.sqlite3")
+
+# Base temporaire d'une reconstruction complète
+REBUILD_PATH = INDEX_PATH + ".rebuild"
+
+# Tables recopiées depuis la base reconstruite
+INDEX_TABLES = ('contacts', 'words', 'word_grams', 'word_suffixes', 'postings', 'phone_suffixes')
+
+# Version du schéma de l'index : un index d'une version antérieure est reconstruit
+SCHEMA_VERSION = 2
+
+# Intervalle entre deux vérifications que l'index couvre tous les contacts (secondes)
+COVERAGE_CHECK_INTERVAL = int(os.environ.get("CONTACT_SEARCH_CHECK_INTERVAL", "60"))
+
+# Délai au-delà duquel une reconstruction inachevée (processus arrêté) peut être reprise (secondes)
+REBUILD_TIMEOUT = 3600
+
+# Part minimale des trigrammes d'un mot de la requête présents dans un mot du vocabulaire
+MIN_SIMILARITY = 0.5
+
+# Nombre maximal de mots du vocabulaire retenus pour chaque mot de la requête
+MAX_WORD_MATCHES = 50
+
+# Au-delà, le nombre d'occurrences d'un mot n'est plus compté (choix du mot le plus rare)
+POSTINGS_COUNT_CAP = 5000
+
+# Nombre maximal de résultats d'une recherche
+MAX_RESULTS = 200
+
+# Longueur minimale d'un fragment de numéro recherché
+MIN_PHONE_DIGITS = 3
+
+# Longueur minimale d'un fragment recherché à l'intérieur d'un mot (« pont » dans « dupont »)
+MIN_INFIX_LENGTH = 3
+
+# Champs textuels et téléphoniques indexés
+TEXT_FIELDS = ('first_name', 'last_name', 'company_name', 'email')
+PHONE_FIELDS = ('phone', 'mobile_phone')
+DISPLAY_FIELDS = ('first_name', 'last_name', 'company_name', 'category', 'email', 'phone',
+                  'mobile_phone', 'is_favorite')
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_PHONE_QUERY_RE = re.compile(r"^[\d\s+().\-/]+$")
+
+_local = threading.local()
+_write_lock = threading.Lock()
+_coverage = {'checked_at': 0.0, 'ok': False}  # dernière vérification de couverture (ce processus)
+_rebuild_lock = threading.Lock()
+
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS contacts (
+        contact_id INTEGER PRIMARY KEY,
+        category TEXT,
+        is_favorite INTEGER NOT NULL DEFAULT 0,
+        sort_key TEXT NOT NULL,
+        display TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS words (
+        word_id INTEGER PRIMARY KEY,
+        word TEXT NOT NULL UNIQUE,
+        gram_count INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS word_grams (
+        gram TEXT NOT NULL,
+        word_id INTEGER NOT NULL,
+        PRIMARY KEY (gram, word_id)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS word_suffixes (
+        suffix TEXT NOT NULL,
+        word_id INTEGER NOT NULL,
+        PRIMARY KEY (suffix, word_id)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS postings (
+        word_id INTEGER NOT NULL,
+        sort_key TEXT NOT NULL,
+        contact_id INTEGER NOT NULL,
+        PRIMARY KEY (word_id, sort_key, contact_id)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS ix_postings_contact ON postings (contact_id);
+    CREATE TABLE IF NOT EXISTS phone_suffixes (
+        suffix TEXT NOT NULL,
+        contact_id INTEGER NOT NULL,
+        PRIMARY KEY (suffix, contact_id)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS ix_phone_suffixes_contact ON phone_suffixes (contact_id);
+    CREATE TABLE IF NOT EXISTS changes (
+        contact_id INTEGER PRIMARY KEY
+    );
+    CREATE TABLE IF NOT EXISTS state (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    );
+    INSERT OR IGNORE INTO state (key, value) VALUES ('stale', 0);
+    INSERT OR IGNORE INTO state (key, value) VALUES ('rebuilding', 0);
+    INSERT OR IGNORE INTO state (key, value) VALUES ('schema', 0);
+"""
+
+
+def _connect(path):
+    """Ouvre une base d'index (créée au besoin)"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def _get_connection():
+    """Retourne la connexion SQLite du thread courant (créée au besoin)"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _local.conn = _connect(INDEX_PATH)
+    return conn
+
+
+def normalize_text(text):
+    """Minuscules, sans accents ni ponctuation : « Hélène D'Arcy » -> « helene d arcy »"""
+    return ' '.join(_WORD_RE.findall(fold_accents(text)))
+
+
+def normalize_phone(phone):
+    """Chiffres du numéro au format national : « +33 6 12 34 56 78 » -> « 0612345678 »"""
+    phone = (phone or '').strip()
+    digits = re.sub(r"\D", "", phone)
+    if phone.startswith('+33'):
+        return '0' + digits[2:]
+    if digits.startswith('0033'):
+        return '0' + digits[4:]
+    if digits.startswith('33') and len(digits) == 11:
+        return '0' + digits[2:]
+    return digits
+
+
+def word_trigrams(word, prefix=False):
+    """
+    Trigrammes d'un mot normalisé (encadré d'espaces, comme pg_trgm).
+    Avec prefix=True, la fin du mot n'est pas marquée (recherche à la frappe).
+    """
+    padded = f"  {word}" if prefix else f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _similarity(shared, query_count, word_count):
+    """Moyenne de la part de la requête retrouvée et de l'indice de Jaccard"""
+    return (shared / query_count + shared / (query_count + word_count - shared)) / 2
+
+
+def _contact_values(contact):
+    """Valeurs indexées d'un contact (objet Contact ou ligne de ses colonnes)"""
+    return {field: getattr(contact, field) for field in ('id',) + DISPLAY_FIELDS}
+
+
+def _word_id(conn, word, cache):
+    """Identifiant du mot dans le vocabulaire (ajouté avec ses trigrammes au besoin)"""
+    word_id = cache.get(word)
+    if word_id is None:
+        row = conn.execute("SELECT word_id FROM words WHERE word = ?", (word,)).fetchone()
+        if row:
+            word_id = row[0]
+        else:
+            grams = word_trigrams(word)
+            word_id = conn.execute(
+                "INSERT INTO words (word, gram_count) VALUES (?, ?)", (word, len(grams))
+            ).lastrowid
+            conn.executemany(
+                "INSERT INTO word_grams (gram, word_id) VALUES (?, ?)",
+                [(gram, word_id) for gram in grams]
+            )
+            # Suffixes du mot (hors mot entier) : un fragment intérieur est un début de suffixe
+            conn.executemany(
+                "INSERT INTO word_suffixes (suffix, word_id) VALUES (?, ?)",
+                [(word[i:], word_id) for i in range(1, len(word) - MIN_INFIX_LENGTH + 1)]
+            )
+        cache[word] = word_id
+    return word_id
+
+
+def _index_rows(conn, contacts, cache=None):
+    """Indexe des contacts (dictionnaires de _contact_values), sans commit"""
+    cache = {} if cache is None else cache
+    for values in contacts:
+        contact_id = values['id']
+        words = set(normalize_text(' '.join(values.get(field) or '' for field in TEXT_FIELDS)).split())
+        sort_key = normalize_text(f"{values.get('last_name') or ''} {values.get('first_name') or ''}")
+        suffixes = set()
+        for field in PHONE_FIELDS:
+            digits = normalize_phone(values.get(field))
+            suffixes.update(digits[i:] for i in range(len(digits) - MIN_PHONE_DIGITS + 1))
+
+        _remove_rows(conn, [contact_id])
+        conn.execute(
+            "INSERT INTO contacts (contact_id, category, is_favorite, sort_key, display) VALUES (?, ?, ?, ?, ?)",
+            (contact_id, values.get('category'), 1 if values.get('is_favorite') else 0, sort_key,
+             json.dumps({field: values.get(field) for field in DISPLAY_FIELDS}, ensure_ascii=False))
+        )
+        conn.executemany(
+            "INSERT INTO postings (word_id, sort_key, contact_id) VALUES (?, ?, ?)",
+            [(_word_id(conn, word, cache), sort_key, contact_id) for word in words]
+        )
+        conn.executemany(
+            "INSERT INTO phone_suffixes (suffix, contact_id) VALUES (?, ?)",
+            [(suffix, contact_id) for suffix in suffixes]
+        )
+
+
+def _remove_rows(conn, contact_ids):
+    for contact_id in contact_ids:
+        conn.execute("DELETE FROM postings WHERE contact_id = ?", (contact_id,))
+        conn.execute("DELETE FROM phone_suffixes WHERE contact_id = ?", (contact_id,))
+        conn.execute("DELETE FROM contacts WHERE contact_id = ?", (contact_id,))
+
+
+def _record_changes(conn, contact_ids):
+    """Note les contacts modifiés, à réappliquer si une reconstruction est en cours"""
+    conn.executemany("INSERT OR IGNORE INTO changes (contact_id) VALUES (?)",
+                     [(contact_id,) for contact_id in contact_ids])
+
+
+def index_contacts(contacts):
+    """Indexe (ou réindexe) des contacts (objets Contact ou dictionnaires de valeurs)"""
+    rows = [contact if isinstance(contact, dict) else _contact_values(contact) for contact in contacts]
+    with _write_lock:
+        conn = _get_connection()
+        with conn:
+            _index_rows(conn, rows)
+            _record_changes(conn, [values['id'] for values in rows])
+
+
+def remove_contacts(contact_ids):
+    """Retire des contacts de l'index"""
+    with _write_lock:
+        conn = _get_connection()
+        with conn:
+            _remove_rows(conn, contact_ids)
+            _record_changes(conn, contact_ids)
+
+
+def _reindex_from_database(conn, contact_ids, batch_size=1000):
+    """Réindexe des contacts depuis la base (ceux qui n'existent plus sont retirés), sans commit"""
+    from database import db
+
+    cache = {}
+    for i in range(0, len(contact_ids), batch_size):
+        batch = contact_ids[i:i + batch_size]
+        rows = [_contact_values(contact) for contact in db.session.query(Contact).filter(Contact.id.in_(batch))]
+        _index_rows(conn, rows, cache)
+        found = {values['id'] for values in rows}
+        _remove_rows(conn, [contact_id for contact_id in batch if contact_id not in found])
+
+
+def _claim_rebuild():
+    """Réserve la reconstruction (une seule à la fois, tous processus confondus)"""
+    now = int(time.time())
+    with _write_lock:
+        conn = _get_connection()
+        with conn:
+            return conn.execute(
+                "UPDATE state SET value = ? WHERE key = 'rebuilding' AND value < ?",
+                (now, now - REBUILD_TIMEOUT)
+            ).rowcount == 1
+
+
+def _release_rebuild():
+    with _write_lock:
+        conn = _get_connection()
+        with conn:
+            conn.execute("UPDATE state SET value = 0 WHERE key = 'rebuilding'")
+
+
+def _remove_rebuild_files():
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(REBUILD_PATH + suffix):
+            os.remove(REBUILD_PATH + suffix)
+
+
+def rebuild_index(batch_size=1000):
+    """
+    Reconstruit entièrement l'index depuis la base (dans un contexte d'application).
+    Retourne le nombre de contacts indexés, ou None si une reconstruction est déjà en cours.
+
+    Le nouvel index est construit dans une base à part (REBUILD_PATH), puis recopié
+    dans l'index courant en une seule transaction : les recherches continuent
+    d'utiliser l'ancien index pendant la construction. Les contacts modifiés
+    entre-temps (table changes) sont relus en base au moment de la recopie.
+    """
+    from database import db
+
+    if not _claim_rebuild():
+        logger.info("Reconstruction de l'index des contacts déjà en cours")
+        return None
+
+    try:
+        conn = _get_connection()
+        stale = conn.execute("SELECT value FROM state WHERE key = 'stale'").fetchone()[0]
+        with _write_lock, conn:
+            conn.execute("DELETE FROM changes")
+        # La lecture des contacts commence après la remise à zéro des modifications :
+        # celles faites pendant la lecture sont relues au moment de la recopie
+        db.session.commit()
+
+        # Lecture par lots (une courte transaction par lot) : pas de lecture longue sur la base
+        _remove_rebuild_files()
+        fresh = _connect(REBUILD_PATH)
+        columns = [getattr(Contact, field) for field in ('id',) + DISPLAY_FIELDS]
+        try:
+            with fresh:
+                count = 0
+                last_id = 0
+                cache = {}
+                while True:
+                    batch = [_contact_values(row) for row in db.session.query(*columns)
+                             .filter(Contact.id > last_id).order_by(Contact.id).limit(batch_size)]
+                    db.session.commit()
+                    if not batch:
+                        break
+                    _index_rows(fresh, batch, cache)
+                    count += len(batch)
+                    last_id = batch[-1]['id']
+        finally:
+            fresh.close()
+
+        with _write_lock:
+            conn.execute("ATTACH DATABASE ? AS fresh", (REBUILD_PATH,))
+            try:
+                with conn:
+                    for table in INDEX_TABLES:
+                        conn.execute(f"DELETE FROM main.{table}")
+                        conn.execute(f"INSERT INTO main.{table} SELECT * FROM fresh.{table}")
+                    changed = [row[0] for row in conn.execute("SELECT contact_id FROM changes")]
+                    _reindex_from_database(conn, changed)
+                    conn.execute("DELETE FROM changes")
+                    # Une demande de reconstruction arrivée entre-temps reste en attente
+                    conn.execute("UPDATE state SET value = 0 WHERE key = 'stale' AND value = ?", (stale,))
+                    conn.execute("UPDATE state SET value = ? WHERE key = 'schema'", (SCHEMA_VERSION,))
+            finally:
+                conn.execute("DETACH DATABASE fresh")
+    finally:
+        _remove_rebuild_files()
+        _release_rebuild()
+
+    _coverage.update(checked_at=time.time(), ok=True)
+    logger.info(f"Index de recherche des contacts reconstruit: {count} contacts")
+    return count
+
+
+def start_rebuild(app):
+    """
+    Lance la reconstruction de l'index dans un thread de ce processus (si aucune
+    n'y est déjà en cours). Retourne True si elle a été lancée.
+    """
+    if not _rebuild_lock.acquire(blocking=False):
+        return False
+
+    def run():
+        try:
+            with app.app_context():
+                rebuild_index()
+        except Exception as e:
+            logger.error(f"Erreur lors de la reconstruction de l'index des contacts: {str(e)}")
+        finally:
+            _rebuild_lock.release()
+
+    threading.Thread(target=run, name='contact-search-rebuild', daemon=True).start()
+    return True
+
+
+def mark_stale():
+    """Demande une reconstruction de l'index à la prochaine recherche (tous processus)"""
+    with _write_lock:
+        conn = _get_connection()
+        with conn:
+            conn.execute("UPDATE state SET value = value + 1 WHERE key = 'stale'")
+
+
+def ensure_index():
+    """
+    Indique si l'index est à jour et peut servir les recherches. Sinon (index
+    marqué périmé, d'un ancien schéma, en reconstruction ou ne couvrant pas tous
+    les contacts), lance au besoin une reconstruction en arrière-plan et
+    retourne False : l'appelant cherche alors directement dans la base.
+
+    La couverture (nombre et plus grand identifiant des contacts) est vérifiée au
+    plus une fois par COVERAGE_CHECK_INTERVAL, et à chaque appel tant qu'elle
+    n'est pas acquise : les contacts ajoutés par des scripts sont ainsi détectés.
+    """
+    from flask import current_app
+    from database import db
+
+    conn = _get_connection()
+    state = dict(conn.execute("SELECT key, value FROM state").fetchall())
+    if state['rebuilding'] > time.time() - REBUILD_TIMEOUT:
+        return False
+    if state['stale'] or state['schema'] < SCHEMA_VERSION:
+        start_rebuild(current_app._get_current_object())
+        return False
+
+    now = time.time()
+    if not _coverage['ok'] or now - _coverage['checked_at'] >= COVERAGE_CHECK_INTERVAL:
+        indexed = tuple(conn.execute("SELECT COUNT(*), COALESCE(MAX(contact_id), 0) FROM contacts").fetchone())
+        actual = tuple(db.session.query(func.count(Contact.id), func.coalesce(func.max(Contact.id), 0)).one())
+        _coverage.update(checked_at=now, ok=indexed == actual)
+        if not _coverage['ok']:
+            start_rebuild(current_app._get_current_object())
+    return _coverage['ok']
+
+
+def _match_words(conn, word, prefix):
+    """Mots du vocabulaire proches d'un mot de la requête : [(word_id, similarité)], meilleurs d'abord"""
+    grams = word_trigrams(word, prefix)
+
+    # Mots contenant le mot de la requête, comme une recherche « %mot% » : ceux qui commencent
+    # par lui (parcours de l'index unique), puis ceux qui le contiennent (index des suffixes)
+    rows = conn.execute(
+        "SELECT word_id, gram_count FROM words WHERE word >= ? AND word < ? ORDER BY length(word) LIMIT ?",
+        (word, word + '{', MAX_WORD_MATCHES)
+    ).fetchall()
+    if len(word) >= MIN_INFIX_LENGTH and len(rows) < MAX_WORD_MATCHES:
+        rows += conn.execute(
+            "SELECT DISTINCT s.word_id, w.gram_count FROM word_suffixes s "
+            "JOIN words w ON w.word_id = s.word_id WHERE s.suffix >= ? AND s.suffix < ? LIMIT ?",
+            (word, word + '{', MAX_WORD_MATCHES)
+        ).fetchall()
+    if rows:
+        matches = {}
+        for word_id, gram_count in rows:
+            matches.setdefault(word_id, _similarity(len(grams), len(grams), gram_count))
+        return list(matches.items())[:MAX_WORD_MATCHES]
+
+    # Sinon (faute de frappe) : mots partageant assez de trigrammes
+    placeholders = ",".join("?" for _ in grams)
+    rows = conn.execute(
+        f"SELECT g.word_id, COUNT(*) AS shared, w.gram_count "
+        f"FROM word_grams g JOIN words w ON w.word_id = g.word_id "
+        f"WHERE g.gram IN ({placeholders}) GROUP BY g.word_id HAVING shared >= ?",
+        list(grams) + [max(1, math.ceil(len(grams) * MIN_SIMILARITY))]
+    ).fetchall()
+    matches = [(word_id, _similarity(shared, len(grams), gram_count)) for word_id, shared, gram_count in rows]
+    matches.sort(key=lambda match: match[1], reverse=True)
+    return matches[:MAX_WORD_MATCHES]
+
+
+def search(query, category=None, favorites_only=False, limit=20):
+    """
+    Recherche approximative des contacts (au plus MAX_RESULTS résultats), à
+    n'utiliser que si ensure_index() a retourné True.
+    Retourne une liste de (contact_id, score entre 0 et 1, valeurs affichables) triée par pertinence.
+    """
+    query = (query or '').strip()
+    limit = min(limit, MAX_RESULTS)
+
+    filters = ""
+    filter_params = []
+    if category:
+        filters += " AND c.category = ?"
+        filter_params.append(category)
+    if favorites_only:
+        filters += " AND c.is_favorite = 1"
+
+    if _PHONE_QUERY_RE.match(query):
+        digits = normalize_phone(query)
+        if len(digits) < MIN_PHONE_DIGITS:
+            return []
+        # Un fragment de numéro est le début d'un des suffixes indexés (':' suit '9' en ASCII)
+        rows = _get_connection().execute(
+            f"SELECT DISTINCT c.contact_id, c.display FROM phone_suffixes s "
+            f"JOIN contacts c ON c.contact_id = s.contact_id "
+            f"WHERE s.suffix >= ? AND s.suffix < ?{filters} ORDER BY s.suffix LIMIT ?",
+            [digits, digits + ':'] + filter_params + [limit]
+        ).fetchall()
+        return [(contact_id, 1.0, json.loads(display)) for contact_id, display in rows]
+
+    words = normalize_text(query).split()
+    if not words:
+        return []
+
+    conn = _get_connection()
+    matches = []
+    for i, word in enumerate(words):
+        word_matches = _match_words(conn, word, prefix=i == len(words) - 1)
+        if not word_matches:
+            # Chaque mot de la requête doit correspondre à un mot du contact
+            return []
+        matches.append(word_matches)
+
+    if len(matches) == 1:
+        # Un seul mot : occurrences lues dans l'ordre des noms, mot par mot, jusqu'à remplir la page
+        results = []
+        seen = set()
+        for word_id, similarity in matches[0]:
+            rows = conn.execute(
+                f"SELECT c.contact_id, c.display FROM postings p "
+                f"JOIN contacts c ON c.contact_id = p.contact_id "
+                f"WHERE p.word_id = ?{filters} ORDER BY p.sort_key, p.contact_id LIMIT ?",
+                [word_id] + filter_params + [limit]
+            ).fetchall()
+            for contact_id, display in rows:
+                if contact_id not in seen and len(results) < limit:
+                    seen.add(contact_id)
+                    results.append((contact_id, similarity, json.loads(display)))
+            if len(results) >= limit:
+                break
+        return results
+
+    # Plusieurs mots : les candidats sont les contacts du mot de la requête le plus rare,
+    # puis la meilleure similarité de chaque mot est sommée par contact
+    sizes = []
+    for word_matches in matches:
+        placeholders = ",".join("?" for _ in word_matches)
+        sizes.append(conn.execute(
+            f"SELECT COUNT(*) FROM (SELECT 1 FROM postings WHERE word_id IN ({placeholders}) LIMIT ?)",
+            [word_id for word_id, similarity in word_matches] + [POSTINGS_COUNT_CAP]
+        ).fetchone()[0])
+    driver = sizes.index(min(sizes))
+
+    values = ",".join("(?, ?, ?)" for word_matches in matches for _ in word_matches)
+    params = [value for position, word_matches in enumerate(matches)
+              for word_id, similarity in word_matches for value in (word_id, position, similarity)]
+    if sizes[driver] < POSTINGS_COUNT_CAP:
+        candidates = (
+            f", candidates AS MATERIALIZED ("
+            f"  SELECT DISTINCT p.contact_id FROM m JOIN postings p ON p.word_id = m.word_id WHERE m.position = ?"
+            f") "
+        )
+        postings = "candidates k JOIN postings p ON p.contact_id = k.contact_id JOIN m ON m.word_id = p.word_id"
+        params.append(driver)
+    else:
+        # Tous les mots sont fréquents : un parcours des occurrences par mot reste le plus rapide
+        candidates = " "
+        postings = "m JOIN postings p ON p.word_id = m.word_id"
+    rows = conn.execute(
+        f"WITH m (word_id, position, similarity) AS (VALUES {values}){candidates}"
+        f"SELECT c.contact_id, s.score, c.display FROM ("
+        f"  SELECT contact_id, SUM(best) AS score FROM ("
+        f"    SELECT p.contact_id, m.position, MAX(m.similarity) AS best "
+        f"    FROM {postings} GROUP BY p.contact_id, m.position"
+        f"  ) GROUP BY contact_id HAVING COUNT(*) = ?"
+        f") s JOIN contacts c ON c.contact_id = s.contact_id "
+        f"WHERE 1 = 1{filters} ORDER BY s.score DESC, c.sort_key LIMIT ?",
+        params + [len(matches)] + filter_params + [limit]
+    ).fetchall()
+    return [(contact_id, score / len(matches), json.loads(display)) for contact_id, score, display in rows]
+
+
+# Mise à jour de l'index par les événements de session : les contacts modifiés
+# sont relevés à chaque flush et réindexés après la validation de la transaction.
+
+def _pending(session):
+    return session.info.setdefault('contact_search_pending', {})
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_contact_changes(session, flush_context):
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Contact) and obj.id is not None:
+            _pending(session)[obj.id] = _contact_values(obj)
+    for obj in session.deleted:
+        if isinstance(obj, Contact):
+            _pending(session)[obj.id] = None
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _collect_bulk_contact_changes(orm_execute_state):
+    """Query.update / Query.delete sur les contacts : index reconstruit à la prochaine recherche"""
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and mapper.class_ is Contact:
+            orm_execute_state.session.info['contact_search_rebuild'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_contact_changes(session):
+    pending = session.info.pop('contact_search_pending', None)
+    rebuild = session.info.pop('contact_search_rebuild', False)
+    if not pending and not rebuild:
+        return
+    try:
+        if rebuild:
+            # Les modifications en masse ne sont pas détaillées : reconstruction complète
+            # en arrière-plan à la prochaine recherche
+            mark_stale()
+            return
+        index_contacts([values for values in pending.values() if values])
+        remove_contacts([contact_id for contact_id, values in pending.items() if values is None])
+    except Exception as e:
+        logger.error(f"Erreur lors de la mise à jour de l'index des contacts: {str(e)}")
+        _coverage['checked_at'] = 0.0
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_contact_changes(session):
+    session.info.pop('contact_search_pending', None)
+    session.info.pop('contact_search_rebuild', None)
+
+
+if __name__ == "__main__":
+    from app import app
+
+    with app.app_context():
+        count = rebuild_index()
+        if count is None:
+            print("Une reconstruction est déjà en cours")
+        else:
+            print(f"{count} contacts indexés dans {INDEX_PATH}")
@@ -0,0 +1,441 @@
+"""
+Stockage compact et adressé par contenu des textes extraits des documents.
+
+Tous les contenus sont regroupés dans une base SQLite unique
+(static/document_contents/contents.sqlite3) :
+
+- `texts` : le texte extrait, compressé (zlib), une seule fois par empreinte
+  SHA-256 du fichier téléversé, avec la position de début de chaque page pour
+  les PDF. Des fichiers identiques rattachés à plusieurs biens partagent la
+  même extraction.
+- `records` : un enregistrement canonique par document (métadonnées et
+  empreinte du contenu), indexé par document_id, property_id et company_id
+  pour la lecture directe et le parcours filtré.
+
+Les textes qui ne sont plus référencés sont conservés comme cache puis
+supprimés, du plus ancien au plus récent, lorsque leur volume compressé dépasse
+CONTENT_CACHE_MAX_MB (512 Mo par défaut).
+
+Migration des fichiers JSON existants (anciens fichiers {id}_{horodatage}.json
+et répertoires records/ et blobs/) puis nettoyage :
+
+    python content_cache.py
+"""
+import os
+import json
+import zlib
+import shutil
+import logging
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+CONTENT_DIR = "static/document_contents"
+STORE_PATH = os.path.join(CONTENT_DIR, "contents.sqlite3")
+
+# Volume maximal des textes compressés conservés (Mo)
+MAX_BYTES = int(os.environ.get("CONTENT_CACHE_MAX_MB", "512")) * 1024 * 1024
+
+COMPRESSION_LEVEL = 6
+
+# Numéro de page signalant une extraction interrompue (délai ou mémoire dépassés) :
+# le texte partiel est conservé pour le document mais n'est pas réutilisé
+TRUNCATED = "truncated"
+
+# Anciens répertoires du cache fichier (importés par migrate_json_files)
+_OLD_BLOBS_DIR = os.path.join(CONTENT_DIR, "blobs")
+_OLD_RECORDS_DIR = os.path.join(CONTENT_DIR, "records")
+
+_local = threading.local()
+_write_lock = threading.Lock()
+
+# Anciens fichiers {id}_{horodatage}.json par document (voir _legacy_index)
+_legacy_cache = None
+_legacy_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    """Une connexion SQLite ne doit pas être réutilisée par un processus enfant (pool d'extraction)"""
+    global _local, _write_lock, _legacy_lock
+    _local = threading.local()
+    _write_lock = threading.Lock()
+    _legacy_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _get_connection():
+    """Retourne la connexion SQLite du thread courant (créée au besoin)"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        os.makedirs(os.path.dirname(STORE_PATH), exist_ok=True)
+        conn = sqlite3.connect(STORE_PATH, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS texts (
+                file_hash TEXT PRIMARY KEY,
+                content BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                extracted_at TEXT,
+                page_offsets TEXT,
+                complete INTEGER NOT NULL DEFAULT 1
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS records (
+                document_id INTEGER PRIMARY KEY,
+                file_hash TEXT NOT NULL,
+                property_id INTEGER,
+                company_id INTEGER,
+                extracted_at TEXT,
+                meta TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_records_file_hash ON records (file_hash);
+            CREATE INDEX IF NOT EXISTS ix_records_property ON records (property_id);
+            CREATE INDEX IF NOT EXISTS ix_records_company ON records (company_id);
+        """)
+        # Bases créées avant l'ajout des positions de pages
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(texts)")]
+        if 'page_offsets' not in columns:
+            conn.execute("ALTER TABLE texts ADD COLUMN page_offsets TEXT")
+        if 'complete' not in columns:
+            conn.execute("ALTER TABLE texts ADD COLUMN complete INTEGER NOT NULL DEFAULT 1")
+        _local.conn = conn
+    return conn
+
+
+def _compress(text):
+    return zlib.compress((text or '').encode('utf-8'), COMPRESSION_LEVEL)
+
+
+def _decompress(blob):
+    return zlib.decompress(blob).decode('utf-8') if blob is not None else None
+
+
+def record_locator(document_id):
+    """Emplacement lisible de l'enregistrement d'un document (journaux, résultats)"""
+    return f"{STORE_PATH}#{int(document_id)}"
+
+
+def has_text(file_hash):
+    """Indique si un texte extrait complet existe déjà pour cette empreinte"""
+    if not file_hash:
+        return False
+    row = _get_connection().execute(
+        "SELECT 1 FROM texts WHERE file_hash = ? AND complete = 1", (file_hash,)
+    ).fetchone()
+    return row is not None
+
+
+def get_text(file_hash):
+    """Retourne le texte extrait pour une empreinte, ou None"""
+    if not file_hash:
+        return None
+    row = _get_connection().execute("SELECT content FROM texts WHERE file_hash = ?", (file_hash,)).fetchone()
+    return _decompress(row[0]) if row else None
+
+
+def put_text(file_hash, text, extracted_at=None):
+    """Enregistre le texte extrait d'un fichier sous son empreinte"""
+    blob = _compress(text)
+    with _write_lock:
+        conn = _get_connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO texts (file_hash, content, size, extracted_at) VALUES (?, ?, ?, ?)",
+                (file_hash, blob, len(blob), extracted_at)
+            )
+
+
+def put_text_pages(file_hash, pages, extracted_at=None):
+    """
+    Enregistre un texte produit page par page sans le reconstituer en mémoire :
+    chaque morceau est compressé au fil de l'eau. `pages` produit des couples
+    (numéro de page ou None, texte) ; un couple (TRUNCATED, "") marque le texte
+    comme incomplet. Retourne (longueur du texte, positions de début des pages),
+    ou None si aucun texte n'a été produit.
+    """
+    compressor = zlib.compressobj(COMPRESSION_LEVEL)
+    parts = []
+    page_offsets = []
+    length = 0
+    complete = True
+    for page_number, chunk in pages:
+        if page_number == TRUNCATED:
+            complete = False
+            continue
+        if not chunk:
+            continue
+        if page_number is not None:
+            page_offsets.append([page_number, length])
+        length += len(chunk)
+        parts.append(compressor.compress(chunk.encode('utf-8')))
+
+    if not length:
+        return None
+
+    parts.append(compressor.flush())
+    blob = b"".join(parts)
+    with _write_lock:
+        conn = _get_connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO texts (file_hash, content, size, extracted_at, page_offsets, complete) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (file_hash, blob, len(blob), extracted_at, json.dumps(page_offsets) if page_offsets else None,
+                 int(complete))
+            )
+    return length, page_offsets
+
+
+def save_record(document_data):
+    """
+    Enregistre l'enregistrement canonique d'un document (remplace le précédent).
+    Le texte n'y est pas recopié : il est référencé par `file_hash`.
+    """
+    meta = {key: value for key, value in document_data.items() if key != "content"}
+    with _write_lock:
+        conn = _get_connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO records (document_id, file_hash, property_id, company_id, extracted_at, meta) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (meta["document_id"], meta.get("file_hash"), meta.get("property_id"), meta.get("company_id"),
+                 meta.get("extracted_at"), json.dumps(meta, ensure_ascii=False))
+            )
+
+
+def get_record_metadata(document_id):
+    """Retourne l'enregistrement canonique d'un document, sans son texte"""
+    row = _get_connection().execute(
+        "SELECT meta FROM records WHERE document_id = ?", (document_id,)
+    ).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def get_record(document_id):
+    """Retourne l'enregistrement d'un document avec son texte ("content"), ou None"""
+    row = _get_connection().execute(
+        "SELECT r.meta, t.content, t.page_offsets FROM records r LEFT JOIN texts t ON t.file_hash = r.file_hash "
+        "WHERE r.document_id = ?",
+        (document_id,)
+    ).fetchone()
+    if not row:
+        return None
+    record = json.loads(row[0])
+    record["content"] = _decompress(row[1]) or ""
+    record["page_offsets"] = json.loads(row[2]) if row[2] else None
+    return record
+
+
+def delete_record(document_id):
+    """Supprime l'enregistrement d'un document (le texte partagé reste en cache)"""
+    with _write_lock:
+        conn = _get_connection()
+        with conn:
+            return conn.execute("DELETE FROM records WHERE document_id = ?", (document_id,)).rowcount > 0
+
+
+def _filters(property_id=None, company_id=None):
+    """Clause WHERE (et paramètres) pour filtrer les enregistrements"""
+    clauses = []
+    params = []
+    if property_id is not None:
+        clauses.append("r.property_id = ?")
+        params.append(property_id)
+    if company_id is not None:
+        clauses.append("r.company_id = ?")
+        params.append(company_id)
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+def iter_record_metadata(property_id=None, company_id=None):
+    """Parcourt les enregistrements canoniques (filtrés au besoin), sans charger les textes"""
+    where, params = _filters(property_id, company_id)
+    rows = _get_connection().execute(f"SELECT r.meta FROM records r{where} ORDER BY r.document_id", params)
+    for (meta,) in rows:
+        yield json.loads(meta)
+
+
+def iter_records(property_id=None, company_id=None):
+    """Parcourt les enregistrements canoniques (filtrés au besoin) avec leur texte"""
+    where, params = _filters(property_id, company_id)
+    rows = _get_connection().execute(
+        "SELECT r.meta, t.content FROM records r LEFT JOIN texts t ON t.file_hash = r.file_hash"
+        f"{where} ORDER BY r.document_id",
+        params
+    )
+    for meta, content in rows:
+        record = json.loads(meta)
+        record["content"] = _decompress(content) or ""
+        yield record
+
+
+def get_record_hashes(complete_only=False):
+    """
+    Retourne {document_id: file_hash} pour tous les documents extraits (seulement
+    ceux dont l'extraction est complète avec complete_only=True)
+    """
+    if complete_only:
+        return dict(_get_connection().execute(
+            "SELECT r.document_id, r.file_hash FROM records r JOIN texts t ON t.file_hash = r.file_hash "
+            "WHERE t.complete = 1"
+        ).fetchall())
+    return dict(_get_connection().execute("SELECT document_id, file_hash FROM records").fetchall())
+
+
+def _legacy_files():
+    """Anciens fichiers {id}_{horodatage}.json, par document (du plus ancien au plus récent)"""
+    legacy = {}
+    if not os.path.exists(CONTENT_DIR):
+        return legacy
+    for filename in sorted(os.listdir(CONTENT_DIR)):
+        if filename.endswith('.json') and '_' in filename:
+            prefix = filename.split('_', 1)[0]
+            if prefix.isdigit():
+                legacy.setdefault(int(prefix), []).append(filename)
+    return legacy
+
+
+def _read_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _legacy_index():
+    """
+    Liste des anciens fichiers, lue une seule fois par processus : l'application
+    n'en écrit plus, et migrate_json_files / collect_garbage la réinitialisent.
+    """
+    global _legacy_cache
+    with _legacy_lock:
+        if _legacy_cache is None:
+            _legacy_cache = _legacy_files()
+        return _legacy_cache
+
+
+def _reset_legacy_index():
+    global _legacy_cache
+    with _legacy_lock:
+        _legacy_cache = None
+
+
+def get_legacy_record(document_id):
+    """Retourne l'ancien fichier {id}_{horodatage}.json le plus récent d'un document non migré"""
+    filenames = _legacy_index().get(int(document_id))
+    if not filenames:
+        return None
+    path = os.path.join(CONTENT_DIR, filenames[-1])
+    if not os.path.exists(path):
+        # Supprimé par un autre processus depuis la lecture de la liste
+        return None
+    return _read_json(path)
+
+
+def collect_garbage(max_bytes=None):
+    """
+    Supprime les anciens fichiers {id}_{horodatage}.json des documents migrés, puis
+    les textes non référencés (les plus anciens d'abord) tant que le volume compressé
+    dépasse le budget. Retourne les compteurs de suppression.
+    """
+    max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+    stats = {"legacy_removed": 0, "texts_removed": 0, "bytes_freed": 0, "bytes_kept": 0}
+
+    migrated = set(get_record_hashes())
+    for document_id, filenames in _legacy_files().items():
+        if document_id in migrated:
+            for filename in filenames:
+                os.remove(os.path.join(CONTENT_DIR, filename))
+                stats["legacy_removed"] += 1
+
+    with _write_lock:
+        conn = _get_connection()
+        with conn:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM texts").fetchone()[0]
+            if total > max_bytes:
+                unreferenced = conn.execute(
+                    "SELECT file_hash, size FROM texts "
+                    "WHERE file_hash NOT IN (SELECT file_hash FROM records) "
+                    "ORDER BY extracted_at"
+                ).fetchall()
+                evicted = []
+                for file_hash, size in unreferenced:
+                    if total <= max_bytes:
+                        break
+                    evicted.append((file_hash,))
+                    total -= size
+                    stats["bytes_freed"] += size
+                conn.executemany("DELETE FROM texts WHERE file_hash = ?", evicted)
+                stats["texts_removed"] = len(evicted)
+
+    stats["bytes_kept"] = total
+    _reset_legacy_index()
+    if stats["legacy_removed"] or stats["texts_removed"]:
+        logger.info(f"Cache des contenus nettoyé: {stats}")
+    return stats
+
+
+def migrate_json_files(upload_folder="static/uploads"):
+    """
+    Importe dans la base les contenus encore stockés en JSON :
+    - les répertoires records/ et blobs/ (supprimés une fois importés) ;
+    - les anciens fichiers {id}_{horodatage}.json (le plus récent par document),
+      en recalculant l'empreinte à partir du fichier téléversé si nécessaire.
+    Retourne le nombre de documents importés.
+    """
+    from main import app
+    from models import Document
+    from document_processor import compute_file_hash
+
+    migrated = 0
+
+    if os.path.exists(_OLD_BLOBS_DIR):
+        for root, _, filenames in os.walk(_OLD_BLOBS_DIR):
+            for filename in filenames:
+                if filename.endswith('.json'):
+                    blob = _read_json(os.path.join(root, filename))
+                    put_text(blob["file_hash"], blob.get("content", ""), blob.get("extracted_at"))
+        shutil.rmtree(_OLD_BLOBS_DIR)
+
+    if os.path.exists(_OLD_RECORDS_DIR):
+        for filename in os.listdir(_OLD_RECORDS_DIR):
+            if filename.endswith('.json'):
+                save_record(_read_json(os.path.join(_OLD_RECORDS_DIR, filename)))
+                migrated += 1
+        shutil.rmtree(_OLD_RECORDS_DIR)
+
+    # Les anciens fichiers ne contiennent pas le nom du fichier stocké
+    with app.app_context():
+        filepaths = dict(Document.query.with_entities(Document.id, Document.filepath).all())
+
+    known = get_record_hashes()
+    for document_id, filenames in _legacy_files().items():
+        if document_id in known:
+            continue
+        try:
+            data = _read_json(os.path.join(CONTENT_DIR, filenames[-1]))
+            file_hash = data.get("file_hash")
+            filepath = data.get("filepath") or filepaths.get(document_id)
+            if not file_hash and filepath and os.path.exists(os.path.join(upload_folder, filepath)):
+                file_hash = compute_file_hash(os.path.join(upload_folder, filepath))
+            if not file_hash:
+                # Sans fichier source, impossible de calculer l'empreinte : conserver l'ancien fichier
+                logger.warning(f"Document {document_id}: fichier source introuvable, migration ignorée")
+                continue
+            data["file_hash"] = file_hash
+            data["filepath"] = filepath
+            if not has_text(file_hash):
+                put_text(file_hash, data.get("content", ""), data.get("extracted_at"))
+            save_record(data)
+            migrated += 1
+        except Exception as e:
+            logger.error(f"Erreur lors de la migration du document {document_id}: {str(e)}")
+    _reset_legacy_index()
+    return migrated
+
+
+if __name__ == "__main__":
+    count = migrate_json_files()
+    print(f"{count} documents importés dans {STORE_PATH}")
+    print(f"Nettoyage: {collect_garbage()}")
@@ -1,6 +1,9 @@
 import os
 import logging
 import json
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 import sqlite3
 import sys
@@ -10,30 +13,130 @@ from docx import Document as DocxDocument
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
-# Configuration du logging
-logging.basicConfig(level=logging.INFO)
+from logging_setup import SAMPLED
+
 logger = logging.getLogger(__name__)
 
-def extract_text_from_pdf(filepath):
+UPLOAD_FOLDER = "static/uploads"
+
+# Liste des extensions de fichiers supportées
+SUPPORTED_EXTENSIONS = [
+    ".pdf", ".docx", ".doc", ".xls", ".xlsx", ".txt", ".csv", 
+    ".rtf", ".odt", ".ppt", ".pptx", ".html", ".htm"
+]
+
+# Retraitement en masse : nombre de processus (0 = nombre de cœurs) et taille des lots lus en base
+BULK_WORKERS = int(os.environ.get("DOCUMENT_PROCESS_WORKERS", "0"))
+BULK_BATCH_SIZE = 500
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Extraction des PDF : nombre maximal de pages et délai maximal par page en secondes (0 = sans limite)
+PDF_MAX_PAGES = int(os.environ.get("PDF_MAX_PAGES", "0"))
+PDF_PAGE_TIMEOUT = int(os.environ.get("PDF_PAGE_TIMEOUT", "60"))
+# Mémoire supplémentaire autorisée au processus d'extraction d'un PDF en Mo (0 = sans limite)
+PDF_MEMORY_LIMIT_MB = int(os.environ.get("PDF_MEMORY_LIMIT_MB", "1024"))
+
+def _limit_memory(limit_mb):
+    """Borne l'espace d'adressage du processus courant à son usage actuel + limit_mb"""
+    if not limit_mb:
+        return
+    try:
+        import resource
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (ImportError, OSError, ValueError):
+        return
+    limit = current + limit_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def _pdf_pages_worker(filepath, max_pages, memory_limit_mb, connection):
     """
-    Extrait le texte d'un fichier PDF
+    Processus d'extraction d'un PDF : envoie ("page", numéro, texte) pour chaque
+    page, puis ("done",) ou ("error", message). Tué par le parent en cas de dépassement.
     """
     try:
-        if not os.path.exists(filepath):
-            logger.error(f"Le fichier {filepath} n'existe pas")
-            return ""
-        
+        _limit_memory(memory_limit_mb)
         reader = PdfReader(filepath)
-        text = ""
-        for page in reader.pages:
-            page_text = page.extract_text()
-            if page_text:
-                text += page_text + "\n\n"
-        
-        return text
+        for index, page in enumerate(reader.pages):
+            if max_pages and index >= max_pages:
+                connection.send(("max_pages",))
+                break
+            connection.send(("page", index + 1, page.extract_text()))
+        connection.send(("done",))
+    except MemoryError:
+        connection.send(("error", f"limite mémoire de {memory_limit_mb} Mo dépassée"))
     except Exception as e:
-        logger.error(f"Erreur lors de l'extraction du texte du PDF {filepath}: {str(e)}")
-        return ""
+        connection.send(("error", str(e)))
+    finally:
+        connection.close()
+
+def iter_pdf_pages(filepath, max_pages=None, page_timeout=None, memory_limit_mb=None):
+    """
+    Parcourt un fichier PDF page par page et produit (numéro de page, texte) sans
+    conserver les pages précédentes. L'extraction s'arrête après `max_pages` pages.
+
+    Elle tourne dans un processus enfant, borné en mémoire (`memory_limit_mb`) et
+    tué si une page dépasse `page_timeout` secondes (0 = sans limite) : le travail
+    s'arrête vraiment. Le texte partiel est alors suivi de (TRUNCATED, "") pour
+    qu'il ne soit pas réutilisé comme extraction complète.
+    """
+    from content_cache import TRUNCATED
+    
+    max_pages = PDF_MAX_PAGES if max_pages is None else max_pages
+    page_timeout = PDF_PAGE_TIMEOUT if page_timeout is None else page_timeout
+    memory_limit_mb = PDF_MEMORY_LIMIT_MB if memory_limit_mb is None else memory_limit_mb
+    
+    if not os.path.exists(filepath):
+        logger.error(f"Le fichier {filepath} n'existe pas")
+        return
+    
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    worker = multiprocessing.Process(
+        target=_pdf_pages_worker, args=(filepath, max_pages, memory_limit_mb, sender), daemon=True
+    )
+    worker.start()
+    sender.close()
+    truncated = False
+    try:
+        while True:
+            if not receiver.poll(page_timeout or None):
+                logger.warning(f"Délai de {page_timeout}s dépassé sur une page de {filepath}, extraction interrompue")
+                truncated = True
+                break
+            try:
+                message = receiver.recv()
+            except EOFError:
+                # Processus arrêté sans message (limite mémoire atteinte dans l'extracteur, signal...)
+                logger.warning(f"Extraction de {filepath} interrompue (code {worker.exitcode})")
+                truncated = True
+                break
+            
+            if message[0] == "page":
+                if message[2]:
+                    yield message[1], message[2] + "\n\n"
+            elif message[0] == "max_pages":
+                logger.warning(f"Limite de {max_pages} pages atteinte pour {filepath}, pages suivantes ignorées")
+            elif message[0] == "error":
+                logger.error(f"Erreur lors de l'extraction du texte du PDF {filepath}: {message[1]}")
+                truncated = True
+                break
+            else:
+                break
+    finally:
+        receiver.close()
+        if worker.is_alive():
+            worker.kill()
+        worker.join()
+    
+    if truncated:
+        yield TRUNCATED, ""
+
+def extract_text_from_pdf(filepath):
+    """
+    Extrait le texte d'un fichier PDF
+    """
+    return "".join(page_text for _, page_text in iter_pdf_pages(filepath))
 
 def extract_text_from_docx(filepath):
     """
@@ -86,14 +189,141 @@ def extract_text_using_textract(filepath):
         logger.error(f"Erreur lors de l'extraction du texte via textract pour {filepath}: {str(e)}")
         return ""
 
-def process_document(document_id):
+def compute_file_hash(filepath):
+    """
+    Calcule l'empreinte SHA-256 d'un fichier (lecture par blocs)
+    """
+    sha256 = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+def iter_document_pages(filepath):
     """
-    Traite un document pour en extraire le contenu et le stocke dans la base de données
+    Produit le texte d'un fichier par morceaux (numéro de page, texte) selon son
+    extension : page par page pour les PDF (numéro de page), en un seul morceau
+    sinon (numéro None). Textract est utilisé en dernier recours.
+    """
+    from content_cache import TRUNCATED
+    
+    file_lower = filepath.lower()
+    found = False
+    
+    try:
+        # Traitement spécifique pour certains formats de fichiers
+        if file_lower.endswith(".pdf"):
+            pages = iter_pdf_pages(filepath)
+        elif file_lower.endswith(".docx"):
+            pages = [(None, extract_text_from_docx(filepath))]
+        elif file_lower.endswith((".txt", ".csv")):
+            # Lire directement les fichiers texte
+            with open(filepath, 'r', encoding='utf-8', errors='replace') as f:
+                pages = [(None, f.read())]
+        else:
+            # Utiliser textract pour tous les autres formats (xls, xlsx, doc, rtf, etc.)
+            logger.debug("Extraction du texte via textract pour %s", filepath, extra=SAMPLED)
+            pages = [(None, extract_text_using_textract(filepath))]
+        
+        for page_number, text in pages:
+            if text:
+                found = True
+                yield page_number, text
+            elif page_number == TRUNCATED:
+                # Extraction interrompue : transmettre la marque au stockage
+                yield page_number, text
+    except Exception as e:
+        logger.error(f"Erreur lors de l'extraction du texte de {filepath}: {str(e)}")
+        
+    # Si le texte est vide, essayer avec textract en dernier recours
+    if not found:
+        try:
+            logger.info(f"Tentative d'extraction de secours avec textract pour {filepath}")
+            text = extract_text_using_textract(filepath)
+            if text:
+                yield None, text
+        except Exception as e:
+            logger.error(f"Échec de l'extraction de secours pour {filepath}: {str(e)}")
+
+def extract_text(filepath):
+    """
+    Extrait le texte d'un fichier selon son extension, avec textract en dernier recours
+    """
+    return "".join(text for _, text in iter_document_pages(filepath))
+
+def _document_metadata(document):
+    """
+    Retourne les métadonnées d'un document (modèle Document) stockées avec son contenu
+    """
+    metadata = {
+        "document_id": document.id,
+        "filename": document.filename,
+        "filepath": document.filepath,
+        "document_type": document.document_type,
+        "document_category": document.document_category,
+        "document_date": document.document_date.isoformat() if document.document_date else None,
+        "amount": document.amount,
+        "description": document.description
+    }
+    
+    # Ajouter les identifiants property_id et company_id s'ils existent
+    if document.property_id:
+        metadata["property_id"] = document.property_id
+    
+    if getattr(document, 'company_id', None):
+        metadata["company_id"] = document.company_id
+    
+    return metadata
+
+def save_document_content(metadata, file_hash, pages=None):
+    """
+    Enregistre le contenu extrait d'un document dans le cache des contenus
+    (texte partagé par empreinte + enregistrement canonique) et met à jour l'index.
+    `pages` produit des morceaux (numéro de page, texte) écrits et indexés au fil
+    de l'eau ; s'il est omis, le texte déjà présent pour cette empreinte est réutilisé.
+    Retourne None si aucun texte n'a été extrait.
+    """
+    import content_cache
+    from search_index import TermCounter, index_document
+    
+    document_id = metadata["document_id"]
+    document_data = dict(metadata)
+    document_data["extracted_at"] = datetime.now().isoformat()
+    document_data["file_hash"] = file_hash
+    
+    counter = TermCounter()
+    if pages is None:
+        counter.add(content_cache.get_text(file_hash) or "")
+    else:
+        def counted_pages():
+            for page_number, text in pages:
+                counter.add(text)
+                yield page_number, text
+        
+        if not content_cache.put_text_pages(file_hash, counted_pages(), document_data["extracted_at"]):
+            return None
+    content_cache.save_record(document_data)
+    
+    logger.info("Contenu extrait et enregistré pour le document %s: %s",
+                document_id, metadata.get('filename'), extra=SAMPLED)
+    
+    # Mettre à jour l'index de recherche de façon incrémentale
+    try:
+        index_document(document_data, counter)
+    except Exception as e:
+        logger.error(f"Erreur lors de l'indexation du document {document_id}: {str(e)}")
+    
+    return content_cache.record_locator(document_id)
+
+def process_document(document_id, raise_errors=False):
+    """
+    Traite un document pour en extraire le contenu et le stocke dans la base de données.
+    Avec raise_errors=True, les erreurs inattendues sont propagées (pour permettre
+    à la file d'extraction de réessayer) au lieu de retourner None.
     """
     try:
         # Connexion à la base de données
         from main import app
-        import os
         
         # Importer les models seulement ici pour éviter l'import circulaire
         from models import Document
@@ -104,178 +334,193 @@ def process_document(document_id):
             if not document:
                 logger.error(f"Document avec l'ID {document_id} non trouvé")
                 return None
+            metadata = _document_metadata(document)
         
         # Construire le chemin complet vers le fichier
-        filepath = os.path.join("static/uploads", document.filepath)
+        filepath = os.path.join(UPLOAD_FOLDER, metadata["filepath"])
         
-        # Extraire le texte selon le type de fichier
-        text = ""
-        file_lower = filepath.lower()
+        # Réutiliser l'extraction d'un fichier identique si elle existe déjà
+        from content_cache import has_text
+        file_hash = compute_file_hash(filepath)
+        if has_text(file_hash):
+            logger.info("Contenu déjà extrait pour %s (empreinte %.12s)", filepath, file_hash, extra=SAMPLED)
+            pages = None
+        else:
+            # Extraire le texte selon le type de fichier, page par page
+            pages = iter_document_pages(filepath)
         
-        try:
-            # Traitement spécifique pour certains formats de fichiers
-            if file_lower.endswith(".pdf"):
-                text = extract_text_from_pdf(filepath)
-            elif file_lower.endswith(".docx"):
-                text = extract_text_from_docx(filepath)
-            elif file_lower.endswith((".txt", ".csv")):
-                # Lire directement les fichiers texte
-                with open(filepath, 'r', encoding='utf-8', errors='replace') as f:
-                    text = f.read()
-            else:
-                # Utiliser textract pour tous les autres formats (xls, xlsx, doc, rtf, etc.)
-                logger.info(f"Extraction du texte via textract pour {filepath}")
-                text = extract_text_using_textract(filepath)
-        except Exception as e:
-            logger.error(f"Erreur lors de l'extraction du texte de {filepath}: {str(e)}")
-            
-        # Si le texte est vide, essayer avec textract en dernier recours
-        if not text:
-            try:
-                logger.info(f"Tentative d'extraction de secours avec textract pour {filepath}")
-                text = extract_text_using_textract(filepath)
-            except Exception as e:
-                logger.error(f"Échec de l'extraction de secours pour {filepath}: {str(e)}")
+        # Stocker le contenu du document dans le cache des contenus
+        content_path = save_document_content(metadata, file_hash, pages)
                 
         # Si aucun texte n'a été extrait, retourner None
-        if not text:
+        if not content_path:
             logger.warning(f"Aucun texte extrait du fichier {filepath}")
             return None
         
-        # Mettre à jour le document avec le contenu extrait
-        if text:
-            # Stocker le contenu du document dans un fichier JSON
-            content_dir = "static/document_contents"
-            os.makedirs(content_dir, exist_ok=True)
-            
-            content_filename = f"{document.id}_{datetime.now().strftime('%Y%m%d%H%M%S')}.json"
-            content_path = os.path.join(content_dir, content_filename)
-            
-            # Préparer les données à stocker dans le JSON
-            document_data = {
-                "document_id": document.id,
-                "filename": document.filename,
-                "content": text,
-                "extracted_at": datetime.now().isoformat(),
-                "document_type": document.document_type,
-                "document_category": document.document_category,
-                "document_date": document.document_date.isoformat() if document.document_date else None,
-                "amount": document.amount,
-                "description": document.description
-            }
-            
-            # Ajouter les identifiants property_id et company_id s'ils existent
-            if document.property_id:
-                document_data["property_id"] = document.property_id
-            
-            if hasattr(document, 'company_id') and document.company_id:
-                document_data["company_id"] = document.company_id
-            
-            # Sauvegarder le document JSON
-            with open(content_path, 'w', encoding='utf-8') as f:
-                json.dump(document_data, f, ensure_ascii=False, indent=4)
-            
-            logger.info(f"Contenu extrait et enregistré pour le document {document.id}: {document.filename}")
-            return content_path
-        else:
-            logger.warning(f"Aucun contenu extrait du document {document.id}: {document.filename}")
-            return None
+        return content_path
     
     except Exception as e:
         logger.error(f"Erreur lors du traitement du document {document_id}: {str(e)}")
+        if raise_errors:
+            raise
         return None
 
-def process_all_documents():
+def _extract_for_bulk(document_id, filepath, known_hash):
+    """
+    Tâche exécutée dans un processus du pool : calcule l'empreinte du fichier et
+    extrait son texte, sauf si l'empreinte n'a pas changé depuis la dernière extraction.
+    Le texte est écrit dans le cache des contenus par ce processus.
+    Retourne (document_id, statut, empreinte, erreur).
+    """
+    try:
+        if not os.path.exists(filepath):
+            return document_id, "failed", None, "Fichier introuvable"
+        
+        file_hash = compute_file_hash(filepath)
+        if known_hash and file_hash == known_hash:
+            return document_id, "skipped", file_hash, None
+        
+        # Fichier identique déjà extrait pour un autre document : le parent réutilise le texte
+        from content_cache import has_text
+        if has_text(file_hash):
+            return document_id, "success", file_hash, None
+        
+        # Les pages sont écrites dans le cache des contenus au fil de l'eau, depuis ce
+        # processus : seul le statut remonte au parent, qui réutilise le texte stocké
+        from content_cache import put_text_pages
+        if not put_text_pages(file_hash, iter_document_pages(filepath), datetime.now().isoformat()):
+            return document_id, "failed", file_hash, "Échec de l'extraction du contenu"
+        return document_id, "success", file_hash, None
+    except Exception as e:
+        return document_id, "failed", None, str(e)
+
+def iter_process_all_documents(workers=None, force=False, batch_size=BULK_BATCH_SIZE):
     """
-    Traite tous les documents de la base de données
+    Retraite tous les documents en répartissant l'extraction sur un pool de processus.
+    Les documents sont lus en base par lots ; les fichiers dont l'empreinte SHA-256 n'a
+    pas changé sont ignorés (sauf si force=True). Produit un dictionnaire par fichier
+    au fur et à mesure de l'avancement.
     """
-    # Importation des modules nécessaires
     from main import app
     from models import Document
     
-    # Utilisation du contexte d'application Flask
+    from content_cache import get_record_hashes
+    
+    known_hashes = {} if force else get_record_hashes(complete_only=True)
+    workers = workers or BULK_WORKERS or os.cpu_count() or 1
+    
+    # Lecture des documents par lots, convertis en dictionnaires pour quitter le contexte
+    metadata_by_id = {}
     with app.app_context():
-        documents = Document.query.all()
-        results = {
-            "success": [],
-            "failed": []
-        }
-    
-    # Liste des extensions de fichiers supportées
-    supported_extensions = [
-        ".pdf", ".docx", ".doc", ".xls", ".xlsx", ".txt", ".csv", 
-        ".rtf", ".odt", ".ppt", ".pptx", ".html", ".htm"
-    ]
-    
-    for document in documents:
-        try:
-            filepath = os.path.join("static/uploads", document.filepath)
+        for document in Document.query.order_by(Document.id).yield_per(batch_size):
+            metadata_by_id[document.id] = _document_metadata(document)
+    
+    total = len(metadata_by_id)
+    done = 0
+    
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for document_id, metadata in metadata_by_id.items():
+            filepath = os.path.join(UPLOAD_FOLDER, metadata["filepath"])
+            file_extension = os.path.splitext(filepath.lower())[1]
             
             # Vérifier si l'extension du fichier est supportée
-            file_extension = os.path.splitext(filepath.lower())[1]
+            if file_extension not in SUPPORTED_EXTENSIONS and len(file_extension) != 0:
+                done += 1
+                yield {
+                    "id": document_id,
+                    "filename": metadata["filename"],
+                    "status": "failed",
+                    "reason": f"Type de fichier non supporté (extension: {file_extension})",
+                    "done": done,
+                    "total": total
+                }
+                continue
             
-            if file_extension in supported_extensions or len(file_extension) == 0:
-                logger.info(f"Traitement du document {document.id}: {document.filename}")
-                content_path = process_document(document.id)
-                
-                if content_path:
-                    results["success"].append({
-                        "id": document.id,
-                        "filename": document.filename,
-                        "content_path": content_path
-                    })
-                else:
-                    results["failed"].append({
-                        "id": document.id,
-                        "filename": document.filename,
-                        "reason": "Échec de l'extraction du contenu"
-                    })
-            else:
-                logger.warning(f"Type de fichier non supporté pour {document.filename} (extension: {file_extension})")
-                results["failed"].append({
-                    "id": document.id,
-                    "filename": document.filename,
-                    "reason": f"Type de fichier non supporté (extension: {file_extension})"
-                })
-        except Exception as e:
-            logger.error(f"Erreur lors du traitement du document {document.id}: {str(e)}")
-            results["failed"].append({
-                "id": document.id,
-                "filename": document.filename,
-                "reason": str(e)
-            })
-    
-    logger.info(f"Traitement terminé. {len(results['success'])} documents traités avec succès, {len(results['failed'])} échecs.")
+            futures.append(executor.submit(_extract_for_bulk, document_id, filepath, known_hashes.get(document_id)))
+        
+        for future in as_completed(futures):
+            document_id, status, file_hash, reason = future.result()
+            metadata = metadata_by_id[document_id]
+            result = {"id": document_id, "filename": metadata["filename"], "status": status}
+            
+            # Le texte est déjà stocké par le processus du pool ; l'enregistrement
+            # et l'index restent écrits par le processus parent
+            if status == "success":
+                try:
+                    result["content_path"] = save_document_content(metadata, file_hash)
+                except Exception as e:
+                    result["status"] = "failed"
+                    reason = str(e)
+            
+            if reason:
+                result["reason"] = reason
+            
+            done += 1
+            result["done"] = done
+            result["total"] = total
+            yield result
+
+def process_all_documents(workers=None, force=False):
+    """
+    Traite tous les documents de la base de données en parallèle.
+    Retourne les listes de documents traités, ignorés (inchangés) et en échec.
+    """
+    from main import app
+    from database import db
+    from models import Document
+    from extraction_queue import STATUS_DONE, STATUS_FAILED
+    
+    results = {
+        "success": [],
+        "skipped": [],
+        "failed": []
+    }
+    
+    for result in iter_process_all_documents(workers=workers, force=force):
+        status = result.pop("status")
+        logger.info("[%s/%s] Document %s (%s): %s", result.pop('done'), result.pop('total'),
+                    result['id'], result['filename'], status, extra=SAMPLED)
+        results[status].append(result)
+    
+    # Mettre à jour les statuts d'extraction en deux requêtes
+    try:
+        with app.app_context():
+            for status, items in ((STATUS_DONE, results["success"]), (STATUS_FAILED, results["failed"])):
+                ids = [item["id"] for item in items]
+                if ids:
+                    Document.query.filter(Document.id.in_(ids)).update(
+                        {Document.extraction_status: status}, synchronize_session=False
+                    )
+            db.session.commit()
+    except Exception as e:
+        logger.error(f"Erreur lors de la mise à jour des statuts d'extraction: {str(e)}")
+    
+    # Supprimer les textes qui ne sont plus référencés au-delà du budget
+    try:
+        from content_cache import collect_garbage
+        collect_garbage()
+    except Exception as e:
+        logger.error(f"Erreur lors du nettoyage du cache des contenus: {str(e)}")
+    
+    logger.info(f"Traitement terminé. {len(results['success'])} documents traités avec succès, "
+                f"{len(results['skipped'])} inchangés, {len(results['failed'])} échecs.")
     return results
 
 def get_document_content(document_id):
     """
-    Récupère le contenu d'un document depuis son fichier JSON
+    Récupère le contenu d'un document depuis le cache des contenus
     """
     try:
-        content_dir = "static/document_contents"
-        if not os.path.exists(content_dir):
-            return None
-        
-        # Chercher tous les fichiers commençant par l'ID du document
-        prefix = f"{document_id}_"
-        content_files = [f for f in os.listdir(content_dir) if f.startswith(prefix) and f.endswith('.json')]
+        import content_cache
         
-        if not content_files:
-            # Si aucun fichier n'existe déjà, tenter de traiter le document
+        record = content_cache.get_record(document_id) or content_cache.get_legacy_record(document_id)
+        if record is None:
+            # Si aucun contenu n'existe déjà, tenter de traiter le document
             process_document(document_id)
-            # Chercher à nouveau
-            content_files = [f for f in os.listdir(content_dir) if f.startswith(prefix) and f.endswith('.json')]
-            
-        if content_files:
-            # Prendre le fichier le plus récent (tri alphabétique, le timestamp fait partie du nom)
-            content_files.sort(reverse=True)
-            latest_file = content_files[0]
-            
-            with open(os.path.join(content_dir, latest_file), 'r', encoding='utf-8') as f:
-                return json.load(f)
+            record = content_cache.get_record(document_id)
         
-        return None
+        return record
     
     except Exception as e:
         logger.error(f"Erreur lors de la récupération du contenu du document {document_id}: {str(e)}")
@@ -286,79 +531,49 @@ def get_all_documents_content():
     Récupère le contenu de tous les documents pour les fournir à l'assistant IA
     """
     try:
-        content_dir = "static/document_contents"
-        if not os.path.exists(content_dir):
-            os.makedirs(content_dir, exist_ok=True)
-            return []
-        
-        documents_content = []
+        from content_cache import iter_records
         
-        for filename in os.listdir(content_dir):
-            if filename.endswith('.json'):
-                try:
-                    with open(os.path.join(content_dir, filename), 'r', encoding='utf-8') as f:
-                        content = json.load(f)
-                        documents_content.append(content)
-                except Exception as e:
-                    logger.error(f"Erreur lors de la lecture du fichier {filename}: {str(e)}")
-        
-        return documents_content
+        return list(iter_records())
     
     except Exception as e:
         logger.error(f"Erreur lors de la récupération du contenu de tous les documents: {str(e)}")
         return []
 
-def search_in_documents(query, property_id=None, company_id=None):
+def search_in_documents(query, property_id=None, company_id=None, limit=20):
     """
-    Recherche une requête dans le contenu des documents
+    Recherche une requête dans le contenu des documents via l'index inversé.
+    Les résultats sont triés par pertinence et accompagnés d'extraits.
     """
     try:
-        # Convertir la requête en minuscules pour une recherche insensible à la casse
-        query = query.lower()
-        
-        # Récupérer tous les contenus de documents
-        all_contents = get_all_documents_content()
-        
-        # Filtrer par propriété si demandé
-        if property_id:
-            all_contents = [content for content in all_contents if content.get("property_id") == property_id]
+        from search_index import search, locate_excerpts
         
-        # Filtrer par société si demandé
-        if company_id:
-            all_contents = [content for content in all_contents if content.get("company_id") == company_id]
-        
-        # Rechercher la requête dans le contenu
         results = []
-        for content in all_contents:
-            document_text = content.get("content", "").lower()
-            if query in document_text:
-                # Trouver les extraits contenant la requête
-                excerpts = []
-                lines = document_text.split('\n')
-                for line in lines:
-                    if query in line:
-                        excerpts.append(line.strip())
-                
-                if excerpts:
-                    result = {
-                        "document_id": content.get("document_id"),
-                        "filename": content.get("filename"),
-                        "excerpts": excerpts[:5],  # Limiter à 5 extraits par document
-                        "document_type": content.get("document_type"),
-                        "document_category": content.get("document_category"),
-                        "document_date": content.get("document_date"),
-                        "amount": content.get("amount"),
-                        "description": content.get("description")
-                    }
-                    
-                    # Ajouter property_id et company_id s'ils existent
-                    if content.get("property_id"):
-                        result["property_id"] = content.get("property_id")
-                    
-                    if content.get("company_id"):
-                        result["company_id"] = content.get("company_id")
-                    
-                    results.append(result)
+        for document_id, score, meta in search(query, property_id=property_id, company_id=company_id, limit=limit):
+            # Charger le texte uniquement pour les documents retenus (extraits et numéros de page)
+            content = get_document_content(document_id) or {}
+            located = locate_excerpts(content.get("content", ""), query, content.get("page_offsets"))
+            
+            result = {
+                "document_id": document_id,
+                "filename": meta.get("filename"),
+                "score": round(score, 4),
+                "excerpts": [excerpt["text"] for excerpt in located],
+                "excerpt_pages": [excerpt["page"] for excerpt in located],
+                "document_type": meta.get("document_type"),
+                "document_category": meta.get("document_category"),
+                "document_date": meta.get("document_date"),
+                "amount": meta.get("amount"),
+                "description": meta.get("description")
+            }
+            
+            # Ajouter property_id et company_id s'ils existent
+            if meta.get("property_id"):
+                result["property_id"] = meta.get("property_id")
+            
+            if meta.get("company_id"):
+                result["company_id"] = meta.get("company_id")
+            
+            results.append(result)
         
         return results
     
@@ -371,13 +586,10 @@ def get_property_documents_content(property_id):
     Récupère le contenu de tous les documents associés à une propriété
     """
     try:
-        # Récupérer tous les contenus de documents
-        all_contents = get_all_documents_content()
+        from content_cache import iter_records
         
-        # Filtrer par propriété
-        property_contents = [content for content in all_contents if content.get("property_id") == property_id]
-        
-        return property_contents
+        # Parcours filtré par propriété (index sur property_id)
+        return list(iter_records(property_id=property_id))
     
     except Exception as e:
         logger.error(f"Erreur lors de la récupération du contenu des documents de la propriété {property_id}: {str(e)}")
@@ -388,14 +600,25 @@ def get_company_documents_content(company_id):
     Récupère le contenu de tous les documents associés à une société
     """
     try:
-        # Récupérer tous les contenus de documents
-        all_contents = get_all_documents_content()
-        
-        # Filtrer par société
-        company_contents = [content for content in all_contents if content.get("company_id") == company_id]
+        from content_cache import iter_records
         
-        return company_contents
+        # Parcours filtré par société (index sur company_id)
+        return list(iter_records(company_id=company_id))
     
     except Exception as e:
         logger.error(f"Erreur lors de la récupération du contenu des documents de la société {company_id}: {str(e)}")
-        return []
\ No newline at end of file
+        return []
+
+if __name__ == "__main__":
+    # Retraitement en masse : python document_processor.py [--workers N] [--force]
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Retraite le contenu de tous les documents")
+    parser.add_argument("--workers", type=int, default=None, help="Nombre de processus d'extraction")
+    parser.add_argument("--force", action="store_true", help="Retraiter aussi les fichiers inchangés")
+    args = parser.parse_args()
+    
+    summary = process_all_documents(workers=args.workers, force=args.force)
+    print(f"Traités: {len(summary['success'])}, inchangés: {len(summary['skipped'])}, échecs: {len(summary['failed'])}")
+    for failure in summary["failed"]:
+        print(f"  - {failure['id']} {failure['filename']}: {failure.get('reason')}")
@@ -0,0 +1,256 @@
+"""
+File d'attente durable pour l'extraction du contenu des documents.
+
+Le téléversement enregistre le fichier puis ajoute une tâche dans une base
+SQLite locale (instance/extraction_queue.sqlite3). Un groupe de threads
+exécute document_processor.process_document hors de la requête, avec de
+nouvelles tentatives espacées (backoff exponentiel) en cas d'erreur.
+L'avancement est reporté dans Document.extraction_status.
+
+Les tâches survivent à un redémarrage : une tâche restée "en_cours" après un
+arrêt brutal est reprise une fois son bail expiré.
+
+Traitement manuel des tâches en attente :
+
+    python extraction_queue.py
+"""
+import os
+import time
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+QUEUE_PATH = os.path.join("instance", "extraction_queue.sqlite3")
+
+# Nombre de threads d'extraction par processus
+WORKER_COUNT = int(os.environ.get("EXTRACTION_WORKERS", "2"))
+
+# Nouvelles tentatives : 30s, 60s, 120s... plafonnées à 30 min
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 30
+RETRY_MAX_DELAY = 30 * 60
+
+# Durée pendant laquelle une tâche en cours reste réservée à un thread
+LEASE_SECONDS = 30 * 60
+
+# Attente entre deux consultations de la file lorsqu'elle est vide
+POLL_INTERVAL = 5
+
+# Statuts d'extraction (tâches et Document.extraction_status)
+STATUS_PENDING = 'en_attente'
+STATUS_RUNNING = 'en_cours'
+STATUS_DONE = 'extrait'
+STATUS_EMPTY = 'sans_texte'
+STATUS_FAILED = 'echec'
+
+_local = threading.local()
+_wakeup = threading.Event()
+_workers_lock = threading.Lock()
+_workers = []
+
+
+def _get_connection():
+    """Retourne la connexion SQLite du thread courant (créée au besoin)"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        os.makedirs(os.path.dirname(QUEUE_PATH), exist_ok=True)
+        conn = sqlite3.connect(QUEUE_PATH, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                document_id INTEGER PRIMARY KEY,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available_at REAL NOT NULL,
+                locked_until REAL,
+                last_error TEXT,
+                content_path TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_jobs_status ON jobs (status, available_at);
+        """)
+        _local.conn = conn
+    return conn
+
+
+def retry_delay(attempts):
+    """Délai avant la prochaine tentative après `attempts` échecs"""
+    return min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+
+
+def enqueue_document(document_id):
+    """
+    Ajoute (ou réinitialise) la tâche d'extraction d'un document.
+    Le document doit déjà être enregistré en base.
+    """
+    now = datetime.now().isoformat()
+    conn = _get_connection()
+    conn.execute(
+        "INSERT INTO jobs (document_id, status, attempts, available_at, created_at, updated_at) "
+        "VALUES (?, ?, 0, ?, ?, ?) "
+        "ON CONFLICT (document_id) DO UPDATE SET status = excluded.status, attempts = 0, "
+        "available_at = excluded.available_at, locked_until = NULL, last_error = NULL, "
+        "content_path = NULL, updated_at = excluded.updated_at",
+        (document_id, STATUS_PENDING, time.time(), now, now)
+    )
+    _set_document_status(document_id, STATUS_PENDING)
+
+    start_workers()
+    _wakeup.set()
+
+
+def remove_job(document_id):
+    """Supprime la tâche d'un document (par exemple après sa suppression)"""
+    _get_connection().execute("DELETE FROM jobs WHERE document_id = ?", (document_id,))
+
+
+def get_job(document_id):
+    """Retourne l'état de la tâche d'extraction d'un document, ou None"""
+    conn = _get_connection()
+    row = conn.execute(
+        "SELECT document_id, status, attempts, available_at, last_error, content_path, created_at, updated_at "
+        "FROM jobs WHERE document_id = ?",
+        (document_id,)
+    ).fetchone()
+    if not row:
+        return None
+
+    job = dict(zip(
+        ('document_id', 'status', 'attempts', 'available_at', 'last_error', 'content_path', 'created_at', 'updated_at'),
+        row
+    ))
+    job['max_attempts'] = MAX_ATTEMPTS
+    available_at = job.pop('available_at')
+    job['next_attempt_at'] = (
+        datetime.fromtimestamp(available_at).isoformat() if job['status'] == STATUS_PENDING else None
+    )
+    return job
+
+
+def get_queue_stats():
+    """Retourne le nombre de tâches par statut"""
+    return dict(_get_connection().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+
+def _claim_job():
+    """Réserve la prochaine tâche disponible ; retourne (document_id, attempts) ou None"""
+    conn = _get_connection()
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT document_id, attempts FROM jobs "
+            "WHERE (status = ? AND available_at <= ?) OR (status = ? AND locked_until < ?) "
+            "ORDER BY available_at LIMIT 1",
+            (STATUS_PENDING, now, STATUS_RUNNING, now)
+        ).fetchone()
+        if row:
+            conn.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, locked_until = ?, updated_at = ? "
+                "WHERE document_id = ?",
+                (STATUS_RUNNING, now + LEASE_SECONDS, datetime.now().isoformat(), row[0])
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+    if not row:
+        return None
+    return row[0], row[1] + 1
+
+
+def _finish_job(document_id, status, content_path=None, error=None, available_at=None):
+    """Enregistre le résultat d'une tentative"""
+    _get_connection().execute(
+        "UPDATE jobs SET status = ?, content_path = ?, last_error = ?, locked_until = NULL, "
+        "available_at = COALESCE(?, available_at), updated_at = ? WHERE document_id = ?",
+        (status, content_path, error, available_at, datetime.now().isoformat(), document_id)
+    )
+    _set_document_status(document_id, status)
+
+
+def _set_document_status(document_id, status):
+    """Reporte le statut d'extraction sur le document"""
+    try:
+        from main import app
+        from database import db
+        from models import Document
+
+        with app.app_context():
+            Document.query.filter_by(id=document_id).update(
+                {Document.extraction_status: status}, synchronize_session=False
+            )
+            db.session.commit()
+    except Exception as e:
+        logger.error(f"Erreur lors de la mise à jour du statut d'extraction du document {document_id}: {str(e)}")
+
+
+def run_job(document_id, attempts):
+    """Exécute une tentative d'extraction et planifie une nouvelle tentative en cas d'erreur"""
+    from document_processor import process_document
+
+    _set_document_status(document_id, STATUS_RUNNING)
+    try:
+        content_path = process_document(document_id, raise_errors=True)
+    except Exception as e:
+        if attempts >= MAX_ATTEMPTS:
+            logger.error(f"Extraction du document {document_id} abandonnée après {attempts} tentatives: {str(e)}")
+            _finish_job(document_id, STATUS_FAILED, error=str(e))
+        else:
+            delay = retry_delay(attempts)
+            logger.warning(f"Échec de l'extraction du document {document_id} (tentative {attempts}), "
+                           f"nouvel essai dans {delay}s: {str(e)}")
+            _finish_job(document_id, STATUS_PENDING, error=str(e), available_at=time.time() + delay)
+        return None
+
+    if content_path:
+        _finish_job(document_id, STATUS_DONE, content_path=content_path)
+    else:
+        # Fichier lisible mais sans texte : inutile de réessayer
+        _finish_job(document_id, STATUS_EMPTY)
+    return content_path
+
+
+def run_pending_jobs():
+    """Traite toutes les tâches disponibles dans le thread courant ; retourne leur nombre"""
+    processed = 0
+    while True:
+        job = _claim_job()
+        if not job:
+            return processed
+        run_job(*job)
+        processed += 1
+
+
+def _worker_loop():
+    """Boucle d'un thread d'extraction"""
+    while True:
+        try:
+            if run_pending_jobs():
+                continue
+        except Exception as e:
+            logger.error(f"Erreur dans le thread d'extraction: {str(e)}")
+        _wakeup.wait(POLL_INTERVAL)
+        _wakeup.clear()
+
+
+def start_workers(count=None):
+    """Démarre les threads d'extraction de ce processus s'ils ne tournent pas déjà"""
+    with _workers_lock:
+        _workers[:] = [worker for worker in _workers if worker.is_alive()]
+        for i in range(len(_workers), count or WORKER_COUNT):
+            worker = threading.Thread(target=_worker_loop, name=f"extraction-worker-{i}", daemon=True)
+            worker.start()
+            _workers.append(worker)
+
+
+if __name__ == "__main__":
+    count = run_pending_jobs()
+    print(f"{count} tâches d'extraction traitées")
+    print(f"État de la file: {get_queue_stats()}")
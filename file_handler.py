@@ -1,10 +1,35 @@
+"""
+Téléversement par morceaux, reprenable et parallélisable.
+
+Chaque téléversement possède un enregistrement côté serveur
+(static/uploads/temp/<upload_id>/upload.json) : plusieurs téléversements
+peuvent être en cours pour un même utilisateur. Les morceaux peuvent arriver
+en parallèle et dans le désordre ; un morceau est considéré reçu dès que son
+fichier existe (écriture dans un fichier temporaire puis renommage atomique).
+
+Protocole :
+- POST /api/init-upload : filename, property_id [, total_chunks, total_size, checksum]
+- POST /api/upload-chunk : upload_id, chunk_index, chunk
+- GET  /api/upload-status/<upload_id> : morceaux reçus et manquants (reprise)
+- POST /api/finalize-upload : upload_id [, total_chunks, checksum] ; assemble
+  les morceaux par copie en flux et vérifie l'empreinte SHA-256 du fichier final.
+  La finalisation est réservée par renommage atomique de upload.json : une
+  requête concurrente (double envoi, nouvel essai) reçoit 409
+"""
 import os
 import json
+import time
+import shutil
+import hashlib
+import logging
 from flask import Blueprint, request, jsonify, current_app, session
 from werkzeug.utils import secure_filename
 import uuid
 from datetime import datetime
 from models import Document, db
+from logging_setup import SAMPLED
+
+logger = logging.getLogger(__name__)
 
 # Création d'un Blueprint pour les routes de gestion de fichiers
 file_handler = Blueprint('file_handler', __name__)
@@ -18,6 +43,18 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)  # Crée le dossier s'il n'existe pas
 TEMP_UPLOAD_FOLDER = 'static/uploads/temp'
 os.makedirs(TEMP_UPLOAD_FOLDER, exist_ok=True)  # Crée le dossier temporaire s'il n'existe pas
 
+# Nom du fichier d'enregistrement d'un téléversement dans son dossier
+UPLOAD_RECORD_FILENAME = 'upload.json'
+
+# Nom de l'enregistrement pendant la finalisation (renommé pour réserver l'assemblage)
+FINALIZING_RECORD_FILENAME = 'finalizing.json'
+
+# Les téléversements inactifs depuis plus longtemps sont supprimés (secondes)
+STALE_UPLOAD_SECONDS = 24 * 60 * 60
+
+# Taille des blocs copiés lors de l'assemblage
+COPY_BUFFER_SIZE = 1024 * 1024
+
 def allowed_file(filename):
     """Vérifie si l'extension du fichier est autorisée"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -32,6 +69,76 @@ def generate_unique_filename(filename):
         unique_name = f"{unique_name}.{ext}"
     return unique_name
 
+def _upload_dir(upload_id):
+    """Dossier temporaire d'un téléversement (None si l'identifiant est invalide)"""
+    try:
+        return os.path.join(TEMP_UPLOAD_FOLDER, str(uuid.UUID(upload_id)))
+    except (ValueError, TypeError):
+        return None
+
+def _chunk_path(upload_dir, chunk_index):
+    return os.path.join(upload_dir, f"chunk_{chunk_index}")
+
+def _load_upload(upload_id, record_filename=UPLOAD_RECORD_FILENAME):
+    """
+    Retourne (dossier, enregistrement) d'un téléversement appartenant à l'utilisateur
+    connecté, ou (None, None)
+    """
+    upload_dir = _upload_dir(upload_id)
+    if not upload_dir:
+        return None, None
+    try:
+        with open(os.path.join(upload_dir, record_filename), 'r', encoding='utf-8') as f:
+            record = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None, None
+    if record.get('user_id') != session.get('user_id'):
+        return None, None
+    return upload_dir, record
+
+def _received_chunks(upload_dir):
+    """Retourne {index: taille} des morceaux complètement reçus"""
+    chunks = {}
+    for entry in os.scandir(upload_dir):
+        name = entry.name
+        if name.startswith('chunk_') and name[len('chunk_'):].isdigit():
+            chunks[int(name[len('chunk_'):])] = entry.stat().st_size
+    return chunks
+
+def _claim_upload(upload_dir):
+    """
+    Réserve la finalisation d'un téléversement en renommant son enregistrement
+    (opération atomique) : une seule requête l'obtient, les autres reçoivent False
+    """
+    try:
+        os.rename(os.path.join(upload_dir, UPLOAD_RECORD_FILENAME),
+                  os.path.join(upload_dir, FINALIZING_RECORD_FILENAME))
+        return True
+    except FileNotFoundError:
+        return False
+
+def _release_upload(upload_dir):
+    """Rend un téléversement non finalisé au client (nouvel essai, morceaux manquants)"""
+    try:
+        os.rename(os.path.join(upload_dir, FINALIZING_RECORD_FILENAME),
+                  os.path.join(upload_dir, UPLOAD_RECORD_FILENAME))
+    except FileNotFoundError:
+        pass
+
+def _cleanup_stale_uploads():
+    """Supprime les dossiers des téléversements abandonnés"""
+    limit = time.time() - STALE_UPLOAD_SECONDS
+    try:
+        for entry in os.scandir(TEMP_UPLOAD_FOLDER):
+            if entry.is_dir() and entry.stat().st_mtime < limit:
+                shutil.rmtree(entry.path, ignore_errors=True)
+    except OSError as e:
+        logger.warning(f"Nettoyage des téléversements abandonnés impossible: {str(e)}")
+
+def _optional_int(name):
+    value = request.form.get(name)
+    return int(value) if value not in (None, '') else None
+
 @file_handler.route('/api/init-upload', methods=['POST'])
 def init_upload():
     """Initialise un téléchargement de fichier"""
@@ -48,6 +155,14 @@ def init_upload():
     if not allowed_file(filename):
         return jsonify({'error': 'File type not allowed'}), 400
     
+    try:
+        total_chunks = _optional_int('total_chunks')
+        total_size = _optional_int('total_size')
+    except ValueError:
+        return jsonify({'error': 'Invalid total_chunks or total_size'}), 400
+    
+    _cleanup_stale_uploads()
+    
     # Sécuriser le nom de fichier et le rendre unique
     secure_name = secure_filename(filename)
     unique_filename = generate_unique_filename(secure_name)
@@ -57,15 +172,20 @@ def init_upload():
     upload_dir = os.path.join(TEMP_UPLOAD_FOLDER, upload_id)
     os.makedirs(upload_dir, exist_ok=True)
     
-    # Stocker les informations de téléchargement en session
-    session['upload_info'] = {
-        'upload_dir': upload_dir,
+    # Enregistrer les informations de téléchargement côté serveur (jamais modifiées ensuite)
+    record = {
+        'upload_id': upload_id,
+        'user_id': session['user_id'],
         'original_filename': secure_name,
         'unique_filename': unique_filename,
         'property_id': property_id,
-        'chunks_received': 0,
-        'total_size': 0
+        'total_chunks': total_chunks,
+        'total_size': total_size,
+        'checksum': (request.form.get('checksum') or '').lower() or None,
+        'created_at': datetime.now().isoformat()
     }
+    with open(os.path.join(upload_dir, UPLOAD_RECORD_FILENAME), 'w', encoding='utf-8') as f:
+        json.dump(record, f)
     
     return jsonify({
         'status': 'initialized',
@@ -74,7 +194,7 @@ def init_upload():
 
 @file_handler.route('/api/upload-chunk', methods=['POST'])
 def upload_chunk():
-    """Télécharge un morceau de fichier"""
+    """Télécharge un morceau de fichier (dans n'importe quel ordre, éventuellement en parallèle)"""
     if 'user_id' not in session:
         return jsonify({'error': 'Authentication required'}), 401
         
@@ -83,137 +203,204 @@ def upload_chunk():
         if 'upload_id' not in request.form: missing.append('upload_id')
         if 'chunk_index' not in request.form: missing.append('chunk_index')
         if 'chunk' not in request.files: missing.append('chunk')
-        import logging
-        logging.error(f"Paramètres manquants: {', '.join(missing)}. Form: {list(request.form.keys())}, Files: {list(request.files.keys())}")
+        logger.error(f"Paramètres manquants: {', '.join(missing)}. Form: {list(request.form.keys())}, Files: {list(request.files.keys())}")
         return jsonify({'error': f"Paramètres manquants: {', '.join(missing)}"}), 400
     
     upload_id = request.form['upload_id']
-    chunk_index = int(request.form['chunk_index'])
+    try:
+        chunk_index = int(request.form['chunk_index'])
+    except ValueError:
+        return jsonify({'error': 'Invalid chunk_index'}), 400
     chunk_file = request.files['chunk']
     
     # Vérifier si ce téléchargement est en cours
-    upload_info = session.get('upload_info')
-    if not upload_info:
-        import logging
-        logging.error(f"Upload non initialisé. Session: {session.keys()}")
+    upload_dir, record = _load_upload(upload_id)
+    if not record:
+        logger.error(f"Upload {upload_id} non initialisé ou inconnu")
         return jsonify({'error': 'Upload not initialized'}), 400
     
-    # Enregistrer le morceau dans un fichier séparé
-    upload_dir = upload_info['upload_dir']
-    chunk_path = os.path.join(upload_dir, f"chunk_{chunk_index}")
+    total_chunks = record.get('total_chunks')
+    if chunk_index < 0 or (total_chunks is not None and chunk_index >= total_chunks):
+        return jsonify({'error': 'chunk_index out of range'}), 400
+    
+    # Écrire dans un fichier temporaire propre à la requête puis renommer :
+    # un morceau n'est visible qu'une fois complet, même avec des envois concurrents
+    chunk_path = _chunk_path(upload_dir, chunk_index)
+    part_path = f"{chunk_path}.{uuid.uuid4().hex}.part"
     
-    import logging
-    logging.info(f"Réception du morceau {chunk_index} pour l'upload {upload_id}, taille: {request.content_length} octets")
+    logger.debug("Réception du morceau %s pour l'upload %s, taille: %s octets",
+                 chunk_index, upload_id, request.content_length, extra=SAMPLED)
     
     try:
-        # Sauvegarder le morceau dans son propre fichier
-        chunk_file.save(chunk_path)
-        chunk_size = os.path.getsize(chunk_path)
+        chunk_file.save(part_path)
+        chunk_size = os.path.getsize(part_path)
+        os.replace(part_path, chunk_path)
         
-        # Mettre à jour les compteurs
-        upload_info['chunks_received'] = upload_info.get('chunks_received', 0) + 1
-        upload_info['total_size'] = upload_info.get('total_size', 0) + chunk_size
-        session['upload_info'] = upload_info
-        
-        logging.info(f"Morceau {chunk_index} enregistré avec succès, taille: {chunk_size} octets, total reçu: {upload_info['chunks_received']} morceaux")
+        received = _received_chunks(upload_dir)
+        logger.info("Morceau %s enregistré avec succès, taille: %s octets, total reçu: %s morceaux",
+                    chunk_index, chunk_size, len(received), extra=SAMPLED)
         
         return jsonify({
             'status': 'chunk_received',
-            'chunks_received': upload_info['chunks_received'],
-            'total_size': upload_info['total_size']
+            'chunk_index': chunk_index,
+            'chunks_received': len(received),
+            'total_size': sum(received.values())
         })
     except Exception as e:
-        logging.error(f"Erreur lors de l'enregistrement du morceau {chunk_index}: {str(e)}")
-        if os.path.exists(chunk_path):
-            os.remove(chunk_path)
+        logger.error(f"Erreur lors de l'enregistrement du morceau {chunk_index}: {str(e)}")
+        if os.path.exists(part_path):
+            os.remove(part_path)
         return jsonify({'error': str(e)}), 500
 
+@file_handler.route('/api/upload-status/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    """Indique les morceaux déjà reçus pour reprendre un téléversement interrompu"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Authentication required'}), 401
+    
+    upload_dir, record = _load_upload(upload_id)
+    if not record:
+        return jsonify({'error': 'Upload not found'}), 404
+    
+    received = _received_chunks(upload_dir)
+    total_chunks = record.get('total_chunks')
+    response = {
+        'upload_id': upload_id,
+        'filename': record['original_filename'],
+        'received_chunks': sorted(received),
+        'received_size': sum(received.values()),
+        'total_chunks': total_chunks,
+        'total_size': record.get('total_size')
+    }
+    if total_chunks is not None:
+        response['missing_chunks'] = [i for i in range(total_chunks) if i not in received]
+    return jsonify(response)
+
 @file_handler.route('/api/finalize-upload', methods=['POST'])
 def finalize_upload():
     """Finalise le téléchargement et crée l'entrée en base de données"""
-    import logging
-    
     if 'user_id' not in session:
-        logging.error("Tentative de finalisation sans authentification")
+        logger.error("Tentative de finalisation sans authentification")
         return jsonify({'error': 'Authentication required'}), 401
         
     if 'upload_id' not in request.form:
-        logging.error(f"Paramètre upload_id manquant. Form: {list(request.form.keys())}")
+        logger.error(f"Paramètre upload_id manquant. Form: {list(request.form.keys())}")
         return jsonify({'error': 'Missing upload_id'}), 400
     
     upload_id = request.form['upload_id']
-    logging.info(f"Finalisation de l'upload {upload_id}")
+    logger.info(f"Finalisation de l'upload {upload_id}")
     
     # Vérifier si ce téléchargement est en cours
-    upload_info = session.get('upload_info')
-    if not upload_info:
-        logging.error(f"Upload non initialisé. Session: {session.keys()}")
+    upload_dir, record = _load_upload(upload_id)
+    
+    # Un seul assemblage par téléversement (double envoi, nouvel essai du client)
+    if (record and not _claim_upload(upload_dir)) or (
+            not record and _load_upload(upload_id, FINALIZING_RECORD_FILENAME)[1]):
+        logger.warning(f"Upload {upload_id} déjà en cours de finalisation")
+        return jsonify({'error': 'Upload already being finalized'}), 409
+    
+    if not record:
+        logger.error(f"Upload {upload_id} non initialisé ou inconnu")
         return jsonify({'error': 'Upload not initialized'}), 400
+
+    try:
+        return _finalize_claimed_upload(upload_id, upload_dir, record)
+    finally:
+        # Après un succès, l'enregistrement a été supprimé et il n'y a rien à rendre
+        _release_upload(upload_dir)
+
+def _finalize_claimed_upload(upload_id, upload_dir, record):
+    """Assemble un téléversement réservé par _claim_upload et crée le document"""
+    received = _received_chunks(upload_dir)
+    try:
+        total_chunks = record.get('total_chunks') or _optional_int('total_chunks')
+    except ValueError:
+        return jsonify({'error': 'Invalid total_chunks'}), 400
+    if total_chunks is None:
+        total_chunks = max(received) + 1 if received else 0
     
-    upload_dir = upload_info['upload_dir']
-    final_path = os.path.join(UPLOAD_FOLDER, upload_info['unique_filename'])
+    # Tous les morceaux doivent être présents avant l'assemblage
+    missing = [i for i in range(total_chunks) if i not in received]
+    if not total_chunks or missing:
+        logger.error(f"Upload {upload_id} incomplet, morceaux manquants: {missing}")
+        return jsonify({'error': 'Missing chunks', 'missing_chunks': missing}), 409
+    
+    expected_checksum = record.get('checksum') or (request.form.get('checksum') or '').lower() or None
+    final_path = os.path.join(UPLOAD_FOLDER, record['unique_filename'])
+    assembling_path = os.path.join(upload_dir, 'assembling.part')
     
     try:
-        # Vérifier que le répertoire des morceaux existe
-        if not os.path.exists(upload_dir):
-            logging.error(f"Répertoire des morceaux inexistant: {upload_dir}")
-            return jsonify({'error': 'Chunks directory not found'}), 500
+        # Assembler les morceaux par copie en flux, en calculant l'empreinte au passage
+        logger.info(f"Assemblage de {total_chunks} morceaux depuis {upload_dir}")
+        sha256 = hashlib.sha256()
+        final_size = 0
+        with open(assembling_path, 'wb') as output_file:
+            for i in range(total_chunks):
+                with open(_chunk_path(upload_dir, i), 'rb') as chunk_file:
+                    for block in iter(lambda: chunk_file.read(COPY_BUFFER_SIZE), b''):
+                        sha256.update(block)
+                        output_file.write(block)
+                        final_size += len(block)
         
-        # Assembler tous les morceaux en un seul fichier final
-        chunks_count = upload_info['chunks_received']
-        logging.info(f"Assemblage de {chunks_count} morceaux depuis {upload_dir}")
+        checksum = sha256.hexdigest()
+        if expected_checksum and checksum != expected_checksum:
+            logger.error(f"Empreinte invalide pour l'upload {upload_id}: {checksum} au lieu de {expected_checksum}")
+            os.remove(assembling_path)
+            return jsonify({'error': 'Checksum mismatch', 'checksum': checksum}), 422
         
-        with open(final_path, 'wb') as output_file:
-            # Parcourir tous les morceaux dans l'ordre
-            for i in range(chunks_count):
-                chunk_path = os.path.join(upload_dir, f"chunk_{i}")
-                if os.path.exists(chunk_path):
-                    chunk_size = os.path.getsize(chunk_path)
-                    logging.info(f"Traitement du morceau {i}, taille: {chunk_size} octets")
-                    with open(chunk_path, 'rb') as chunk_file:
-                        output_file.write(chunk_file.read())
-                else:
-                    logging.warning(f"Morceau {i} manquant: {chunk_path}")
+        if record.get('total_size') is not None and final_size != record['total_size']:
+            logger.error(f"Taille invalide pour l'upload {upload_id}: {final_size} au lieu de {record['total_size']}")
+            os.remove(assembling_path)
+            return jsonify({'error': 'Size mismatch', 'size': final_size}), 422
         
-        # Vérifier que le fichier final a été créé
-        if not os.path.exists(final_path):
-            logging.error(f"Échec de création du fichier final: {final_path}")
-            return jsonify({'error': 'Failed to create final file'}), 500
-            
-        final_size = os.path.getsize(final_path)
-        logging.info(f"Fichier final créé avec succès, taille: {final_size} octets")
+        os.replace(assembling_path, final_path)
+        logger.info(f"Fichier final créé avec succès, taille: {final_size} octets")
             
         # Créer l'entrée en base de données
         document = Document(
-            property_id=upload_info['property_id'],
-            filename=upload_info['original_filename'],
-            filepath=upload_info['unique_filename']
+            property_id=record['property_id'],
+            filename=record['original_filename'],
+            filepath=record['unique_filename']
         )
         
         db.session.add(document)
+        db.session.flush()
+        document_id = document.id
         db.session.commit()
-        logging.info(f"Document enregistré en base de données, ID: {document.id}")
-        
-        # Nettoyer les fichiers temporaires
-        import shutil
-        if os.path.exists(upload_dir):
-            logging.info(f"Nettoyage du répertoire temporaire: {upload_dir}")
-            shutil.rmtree(upload_dir)
-        
-        # Supprimer les informations de téléchargement de la session
-        session.pop('upload_info', None)
-        
-        return jsonify({
-            'status': 'success',
-            'document_id': document.id,
-            'filename': document.filename
-        })
     except Exception as e:
-        # Nettoyer en cas d'erreur
-        if os.path.exists(final_path):
-            os.remove(final_path)
+        # Nettoyer en cas d'erreur (rien n'a été validé : le fichier final n'est référencé par aucun document)
+        db.session.rollback()
+        for path in (assembling_path, final_path):
+            if os.path.exists(path):
+                os.remove(path)
             
         # Journaliser l'erreur pour faciliter le débogage
-        logging.error(f"Erreur lors de la finalisation du téléversement: {str(e)}", exc_info=True)
+        logger.error(f"Erreur lors de la finalisation du téléversement: {str(e)}", exc_info=True)
         
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        return jsonify({'error': str(e)}), 500
+    
+    # Le document est enregistré : la suite ne doit plus faire échouer la requête
+    logger.info(f"Document enregistré en base de données, ID: {document_id}")
+    
+    # Nettoyer les fichiers temporaires (l'enregistrement d'abord : le téléversement est terminé)
+    logger.info(f"Nettoyage du répertoire temporaire: {upload_dir}")
+    try:
+        os.remove(os.path.join(upload_dir, FINALIZING_RECORD_FILENAME))
+    except OSError as e:
+        logger.error(f"Erreur lors du nettoyage de l'upload {upload_id}: {str(e)}")
+    shutil.rmtree(upload_dir, ignore_errors=True)
+    
+    # Extraire le contenu en arrière-plan
+    try:
+        from extraction_queue import enqueue_document
+        enqueue_document(document_id)
+    except Exception as e:
+        logger.error(f"Erreur lors de la mise en file de l'extraction du document {document_id}: {str(e)}")
+    
+    return jsonify({
+        'status': 'success',
+        'document_id': document_id,
+        'filename': record['original_filename'],
+        'size': final_size,
+        'checksum': checksum
+    })
@@ -1,9 +1,16 @@
 # Configuration de Gunicorn
+#
+# Deux profils, choisis par la variable d'environnement GUNICORN_PROFILE :
+# - "development" (par défaut) : un seul worker synchrone avec rechargement automatique
+# - "production" : plusieurs workers multi-threads, application préchargée, sans rechargement
+#
+#     GUNICORN_PROFILE=production gunicorn -c gunicorn_config.py main:app
+import os
+import multiprocessing
+
+PROFILE = os.environ.get("GUNICORN_PROFILE", "development").lower()
+
 bind = "0.0.0.0:5000"
-reload = True
-workers = 1
-worker_class = "sync"
-timeout = 300  # Timeout plus long pour gérer les téléchargements longs (5 minutes)
 graceful_timeout = 60  # Délai pour terminer les requêtes en cours
 keepalive = 5  # Maintenir les connexions actives
 max_requests = 1000  # Redémarrer les workers après X requêtes pour éviter les fuites mémoire
@@ -16,4 +23,55 @@ limit_request_fields = 0  # Pas de limite sur le nombre de champs
 capture_output = True
 loglevel = "info"
 errorlog = "-"
-accesslog = "-"
\ No newline at end of file
+accesslog = "-"
+
+if PROFILE == "production":
+    _uses_sqlite = os.environ.get("DATABASE_URL", "sqlite:///").startswith("sqlite")
+
+    # SQLite ne supporte qu'un écrivain à la fois : un seul processus, la concurrence passe par les threads
+    if _uses_sqlite:
+        workers = 1
+    else:
+        workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+
+    # Workers multi-threads : les téléversements et téléchargements (I/O) ne bloquent plus les autres
+    # requêtes. gevent peut être choisi s'il est installé (GUNICORN_WORKER_CLASS=gevent).
+    worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+    if worker_class == "gevent":
+        try:
+            import gevent  # noqa: F401
+        except ImportError:
+            worker_class = "gthread"
+    threads = int(os.environ.get("GUNICORN_THREADS", "8" if _uses_sqlite else "4"))
+    worker_connections = 1000  # Utilisé par gevent uniquement
+
+    reload = False
+    preload_app = True
+    timeout = 120  # Les téléversements longs passent par /api/upload-chunk, morceau par morceau
+
+    # Les threads d'extraction sont démarrés dans chaque worker après le fork, pas dans le maître
+    os.environ.setdefault("EXTRACTION_AUTOSTART", "0")
+
+    # Journalisation JSON, asynchrone et échantillonnée (voir logging_setup.py)
+    os.environ.setdefault("LOG_LEVEL", "INFO")
+    os.environ.setdefault("LOG_FORMAT", "json")
+    os.environ.setdefault("LOG_ASYNC", "1")
+    os.environ.setdefault("LOG_SAMPLE_RATE", "0.01")
+
+    def post_fork(server, worker):
+        """Réinitialiser les ressources héritées du processus maître après le fork"""
+        from app import app
+        from database import db
+
+        # Ne pas réutiliser les connexions ouvertes par le maître pendant le préchargement
+        # (close=False : le maître garde les siennes, le worker repart d'un pool vide)
+        with app.app_context():
+            db.engine.dispose(close=False)
+
+        from extraction_queue import start_workers
+        start_workers()
+else:
+    reload = True
+    workers = 1
+    worker_class = "sync"
+    timeout = 300  # Timeout plus long pour gérer les téléchargements longs (5 minutes)
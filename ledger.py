@@ -0,0 +1,434 @@
+"""
+Grand livre mensuel : cumuls des paiements reçus et des charges payées par mois,
+bien, société et type (table monthly_ledger).
+
+Le grand livre est tenu à jour de façon incrémentale par un écouteur
+`before_flush` : chaque insertion, modification (montant, date, statut...) ou
+suppression d'un Payment ou d'une Expense applique la différence entre son
+ancienne et sa nouvelle contribution, dans la même transaction ; un bien qui
+change de société emporte ses revenus vers la nouvelle société. Les
+suppressions en masse (Query.delete) contournent les événements de session et
+doivent appeler `remove_rows_from_ledger` au préalable ; les modifications en
+masse (Query.update), `remove_rows_from_ledger` avant et `add_query_to_ledger`
+après ; les insertions en masse (insert(model) avec une liste de valeurs),
+`add_rows_to_ledger`. Un changement de société de biens en masse
+(Query.update sur Property.company_id) impose une reconstruction.
+
+Les widgets du tableau de bord lisent quelques lignes agrégées au lieu de
+parcourir tout l'historique. Les variations sont appliquées par upsert
+(INSERT ... ON CONFLICT DO UPDATE) : des transactions concurrentes sur une même
+clé s'additionnent sans conflit d'unicité.
+
+La table est remplie au démarrage de l'application si elle est vide
+(backfill_if_empty), ou par la migration add_monthly_ledger_table.py.
+Reconstruction complète :
+
+    python ledger.py
+"""
+import logging
+
+from sqlalchemy import event, select, func, cast, literal, and_, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database import db
+from models import Payment, Expense, Property, MonthlyLedger
+
+# Types d'écriture
+INCOME = 'revenu'
+EXPENSE = 'charge'
+
+# Statuts considérés comme payés (les charges utilisent 'payé', l'ancien code 'Payé')
+PAYMENT_PAID_STATUSES = ('Payé',)
+EXPENSE_PAID_STATUSES = ('payé', 'Payé')
+
+_ledger = MonthlyLedger.__table__
+
+# Colonnes nécessaires pour calculer la contribution d'une ligne
+_PAYMENT_COLUMNS = ('id', 'status', 'payment_date', 'amount', 'property_id', 'payment_type')
+_EXPENSE_COLUMNS = ('id', 'status', 'payment_date', 'amount', 'property_id', 'company_id', 'charge_type')
+
+
+def _contribution(model, values, property_companies):
+    """Retourne (clé, montant) de la contribution d'une ligne au grand livre, ou None"""
+    payment_date = values.get('payment_date')
+    amount = values.get('amount')
+    if not payment_date or amount is None:
+        return None
+
+    property_id = values.get('property_id') or 0
+    if model is Payment:
+        if values.get('status') not in PAYMENT_PAID_STATUSES:
+            return None
+        key = (payment_date.year, payment_date.month, property_id,
+               property_companies.get(property_id) or 0, INCOME, values.get('payment_type') or '')
+    else:
+        if values.get('status') not in EXPENSE_PAID_STATUSES:
+            return None
+        key = (payment_date.year, payment_date.month, property_id,
+               values.get('company_id') or 0, EXPENSE, values.get('charge_type') or '')
+    return key, amount
+
+
+def _add(deltas, contribution, sign):
+    if contribution:
+        key, amount = contribution
+        total, count = deltas.get(key, (0, 0))
+        deltas[key] = (total + sign * amount, count + sign)
+
+
+def _property_companies(connection, property_ids):
+    """Retourne {property_id: company_id} pour les biens donnés"""
+    property_ids = [pid for pid in property_ids if pid]
+    if not property_ids:
+        return {}
+    rows = connection.execute(
+        select(Property.id, Property.company_id).where(Property.id.in_(property_ids))
+    )
+    return {row[0]: row[1] for row in rows}
+
+
+def _stored_values(connection, model, columns, ids):
+    """Valeurs actuellement en base (avant le flush) des lignes données"""
+    if not ids:
+        return {}
+    rows = connection.execute(
+        select(*[getattr(model, column) for column in columns]).where(model.id.in_(ids))
+    )
+    return {row[0]: dict(zip(columns, row)) for row in rows}
+
+
+_KEY_COLUMNS = ('year', 'month', 'property_id', 'company_id', 'entry_type', 'category')
+
+
+def _upsert_statement(dialect_name):
+    """
+    INSERT ... ON CONFLICT (clé) DO UPDATE cumulant les variations (SQLite,
+    PostgreSQL) : deux transactions créant la même clé ne se gênent pas. None
+    pour les autres bases.
+    """
+    if dialect_name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        return None
+    statement = insert(_ledger)
+    return statement.on_conflict_do_update(
+        index_elements=list(_KEY_COLUMNS),
+        set_={
+            'total': _ledger.c.total + statement.excluded.total,
+            'entry_count': _ledger.c.entry_count + statement.excluded.entry_count,
+        }
+    )
+
+
+def _apply_delta_fallback(connection, values):
+    """UPDATE puis INSERT ; si une autre transaction a créé la clé entre-temps, refaire l'UPDATE"""
+    key_filter = and_(*[_ledger.c[column] == values[column] for column in _KEY_COLUMNS])
+    increment = _ledger.update().where(key_filter).values(
+        total=_ledger.c.total + values['total'],
+        entry_count=_ledger.c.entry_count + values['entry_count']
+    )
+    if connection.execute(increment).rowcount:
+        return
+    try:
+        with connection.begin_nested():
+            connection.execute(_ledger.insert().values(**values))
+    except IntegrityError:
+        connection.execute(increment)
+
+
+def apply_deltas(connection, deltas):
+    """Applique des variations {clé: (montant, nombre)} au grand livre"""
+    rows = [
+        dict(zip(_KEY_COLUMNS, key), total=total, entry_count=count)
+        for key, (total, count) in deltas.items()
+        if count or abs(total) >= 1e-9
+    ]
+    if not rows:
+        return
+    upsert = _upsert_statement(connection.dialect.name)
+    if upsert is not None:
+        connection.execute(upsert, rows)
+        return
+    for values in rows:
+        _apply_delta_fallback(connection, values)
+
+
+def _move_property_income(connection, property_companies):
+    """
+    Rattache les revenus déjà cumulés des biens donnés à leur nouvelle société
+    ({property_id: company_id}) : les lignes sont retirées puis cumulées sous la
+    nouvelle clé, fusionnant avec une ligne existante le cas échéant.
+    """
+    rows = connection.execute(
+        select(_ledger.c.id, *[_ledger.c[column] for column in _KEY_COLUMNS],
+               _ledger.c.total, _ledger.c.entry_count).where(
+            _ledger.c.property_id.in_(list(property_companies)),
+            _ledger.c.entry_type == INCOME
+        )
+    ).all()
+    moved_ids = []
+    deltas = {}
+    for row in rows:
+        key = dict(zip(_KEY_COLUMNS, row[1:7]))
+        company_id = property_companies[key['property_id']]
+        if key['company_id'] == company_id:
+            continue
+        moved_ids.append(row[0])
+        key['company_id'] = company_id
+        new_key = tuple(key[column] for column in _KEY_COLUMNS)
+        total, count = deltas.get(new_key, (0, 0))
+        deltas[new_key] = (total + row[7], count + row[8])
+    if not moved_ids:
+        return
+    connection.execute(_ledger.delete().where(_ledger.c.id.in_(moved_ids)))
+    apply_deltas(connection, deltas)
+
+
+def backfill_if_empty():
+    """
+    Remplit le grand livre s'il est vide alors que des paiements ou charges
+    existent (première mise en service de la table). Retourne le nombre de lignes
+    créées, ou None si rien n'était à faire.
+    """
+    if db.session.query(MonthlyLedger.id).first() is not None:
+        return None
+    if db.session.query(Payment.id).first() is None and db.session.query(Expense.id).first() is None:
+        return None
+    return rebuild_ledger()
+
+
+@event.listens_for(Session, 'before_flush')
+def _update_ledger_before_flush(session, flush_context, instances):
+    """Répercute sur le grand livre les paiements et charges ajoutés, modifiés ou supprimés"""
+    tracked = [
+        (state, obj) for state, objects in (
+            ('new', session.new), ('dirty', session.dirty), ('deleted', session.deleted)
+        )
+        for obj in objects if isinstance(obj, (Payment, Expense))
+    ]
+    # Biens changeant de société : leurs revenus suivent le bien
+    moved_properties = {
+        obj.id: obj.company_id or 0 for obj in session.dirty
+        if isinstance(obj, Property) and obj.id is not None
+        and inspect(obj).attrs.company_id.history.has_changes()
+    }
+    if not tracked and not moved_properties:
+        return
+
+    connection = session.connection()
+    stored = {}
+    for model, columns in ((Payment, _PAYMENT_COLUMNS), (Expense, _EXPENSE_COLUMNS)):
+        ids = [obj.id for state, obj in tracked
+               if isinstance(obj, model) and state != 'new' and obj.id is not None]
+        stored[model] = _stored_values(connection, model, columns, ids)
+
+    current = []
+    for state, obj in tracked:
+        model = type(obj)
+        columns = _PAYMENT_COLUMNS if model is Payment else _EXPENSE_COLUMNS
+        old_values = stored[model].get(obj.id) if state != 'new' else None
+        new_values = None
+        if state == 'new' or (state == 'dirty' and session.is_modified(obj)):
+            new_values = {column: getattr(obj, column) for column in columns}
+        if state == 'dirty' and new_values is None:
+            continue
+        current.append((model, old_values, new_values))
+
+    property_ids = set()
+    for model, old_values, new_values in current:
+        if model is Payment:
+            for values in (old_values, new_values):
+                if values:
+                    property_ids.add(values.get('property_id'))
+    property_companies = _property_companies(connection, property_ids)
+
+    deltas = {}
+    for model, old_values, new_values in current:
+        if old_values:
+            _add(deltas, _contribution(model, old_values, property_companies), -1)
+        if new_values:
+            _add(deltas, _contribution(model, new_values, property_companies), 1)
+
+    if deltas:
+        apply_deltas(connection, deltas)
+
+    # Après les variations ci-dessus, calculées avec la société encore en base
+    if moved_properties:
+        _move_property_income(connection, moved_properties)
+
+
+def _year(column):
+    return cast(func.extract('year', column), db.Integer)
+
+
+def _month(column):
+    return cast(func.extract('month', column), db.Integer)
+
+
+def _apply_query(query, sign):
+    """
+    Ajoute (sign=1) ou retire (sign=-1) du grand livre les lignes d'une requête
+    Payment ou Expense, agrégées en SQL par clé du grand livre (aucune ligne chargée).
+    """
+    model = query.column_descriptions[0]['entity']
+    if model is Payment:
+        query = query.outerjoin(Property, Property.id == Payment.property_id).filter(
+            Payment.status.in_(PAYMENT_PAID_STATUSES))
+        company_id, entry_type, category = Property.company_id, INCOME, Payment.payment_type
+    else:
+        query = query.filter(Expense.status.in_(EXPENSE_PAID_STATUSES))
+        company_id, entry_type, category = Expense.company_id, EXPENSE, Expense.charge_type
+
+    keys = (
+        _year(model.payment_date), _month(model.payment_date), func.coalesce(model.property_id, 0),
+        func.coalesce(company_id, 0), func.coalesce(category, '')
+    )
+    rows = query.filter(model.payment_date.isnot(None)).with_entities(
+        *keys, func.sum(model.amount), func.count(model.id)
+    ).group_by(*keys).all()
+    if not rows:
+        return
+
+    deltas = {
+        (year, month, property_id, company_id, entry_type, category): (sign * total, sign * count)
+        for year, month, property_id, company_id, category, total, count in rows
+    }
+    apply_deltas(db.session.connection(), deltas)
+
+
+def remove_rows_from_ledger(query):
+    """
+    Retire du grand livre les lignes d'une requête Payment ou Expense avant une
+    suppression ou une modification en masse (query.delete / query.update), qui
+    ne déclenchent pas before_flush.
+    """
+    _apply_query(query, -1)
+
+
+def add_query_to_ledger(query):
+    """Ajoute au grand livre les lignes d'une requête après une modification en masse (query.update)"""
+    _apply_query(query, 1)
+
+
+def add_rows_to_ledger(model, rows):
+    """
+    Ajoute au grand livre des lignes Payment ou Expense insérées en masse
+    (insert(model) avec une liste de valeurs), qui ne déclenchent pas before_flush.
+    """
+    property_companies = {}
+    if model is Payment:
+        property_companies = _property_companies(db.session.connection(), {row.get('property_id') for row in rows})
+    deltas = {}
+    for row in rows:
+        _add(deltas, _contribution(model, row, property_companies), 1)
+    if deltas:
+        apply_deltas(db.session.connection(), deltas)
+
+
+def rebuild_ledger():
+    """
+    Reconstruit entièrement le grand livre à partir des paiements et charges
+    (deux INSERT ... SELECT agrégés). Doit être appelée dans un contexte d'application.
+    """
+    target_columns = ['year', 'month', 'property_id', 'company_id', 'entry_type', 'category', 'total', 'entry_count']
+
+    payment_keys = (
+        _year(Payment.payment_date), _month(Payment.payment_date),
+        func.coalesce(Payment.property_id, 0), func.coalesce(Property.company_id, 0),
+        func.coalesce(Payment.payment_type, '')
+    )
+    payments = select(
+        *payment_keys[:4], literal(INCOME), payment_keys[4], func.sum(Payment.amount), func.count(Payment.id)
+    ).select_from(Payment).outerjoin(Property, Property.id == Payment.property_id).where(
+        Payment.status.in_(PAYMENT_PAID_STATUSES), Payment.payment_date.isnot(None)
+    ).group_by(*payment_keys)
+
+    expense_keys = (
+        _year(Expense.payment_date), _month(Expense.payment_date),
+        func.coalesce(Expense.property_id, 0), func.coalesce(Expense.company_id, 0),
+        func.coalesce(Expense.charge_type, '')
+    )
+    expenses = select(
+        *expense_keys[:4], literal(EXPENSE), expense_keys[4], func.sum(Expense.amount), func.count(Expense.id)
+    ).where(
+        Expense.status.in_(EXPENSE_PAID_STATUSES), Expense.payment_date.isnot(None)
+    ).group_by(*expense_keys)
+
+    try:
+        db.session.execute(_ledger.delete())
+        db.session.execute(_ledger.insert().from_select(target_columns, payments))
+        db.session.execute(_ledger.insert().from_select(target_columns, expenses))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Erreur lors de la reconstruction du grand livre mensuel: {str(e)}")
+        raise
+
+    count = db.session.query(func.count(MonthlyLedger.id)).scalar()
+    logging.info(f"Grand livre mensuel reconstruit: {count} lignes")
+    return count
+
+
+def get_ledger_rows(start_year, start_month, end_year, end_month):
+    """
+    Retourne les cumuls [(année, mois, type, catégorie, total)] de la période
+    (bornes incluses), en une seule requête partageable entre plusieurs widgets.
+    """
+    period = MonthlyLedger.year * 100 + MonthlyLedger.month
+    return db.session.query(
+        MonthlyLedger.year, MonthlyLedger.month, MonthlyLedger.entry_type,
+        MonthlyLedger.category, func.sum(MonthlyLedger.total)
+    ).filter(
+        period >= start_year * 100 + start_month,
+        period <= end_year * 100 + end_month
+    ).group_by(
+        MonthlyLedger.year, MonthlyLedger.month, MonthlyLedger.entry_type, MonthlyLedger.category
+    ).all()
+
+
+def get_monthly_totals(start_year, start_month, end_year, end_month, rows=None):
+    """
+    Retourne {(année, mois): {'income': ..., 'expenses': ...}} sur la période (bornes incluses).
+    `rows` (résultat de get_ledger_rows couvrant la période) évite une requête.
+    """
+    if rows is None:
+        rows = get_ledger_rows(start_year, start_month, end_year, end_month)
+
+    totals = {}
+    for year, month, entry_type, category, total in rows:
+        if not start_year * 100 + start_month <= year * 100 + month <= end_year * 100 + end_month:
+            continue
+        month_totals = totals.setdefault((year, month), {'income': 0, 'expenses': 0})
+        month_totals['income' if entry_type == INCOME else 'expenses'] += total or 0
+    return totals
+
+
+def get_category_totals(year, entry_type, rows=None):
+    """
+    Retourne [(catégorie, total)] de l'année pour un type d'écriture.
+    `rows` (résultat de get_ledger_rows couvrant l'année) évite une requête.
+    """
+    if rows is None:
+        return db.session.query(
+            MonthlyLedger.category, func.sum(MonthlyLedger.total)
+        ).filter(
+            MonthlyLedger.year == year,
+            MonthlyLedger.entry_type == entry_type
+        ).group_by(MonthlyLedger.category).all()
+
+    totals = {}
+    for row_year, month, row_type, category, total in rows:
+        if row_year == year and row_type == entry_type:
+            totals[category] = totals.get(category, 0) + (total or 0)
+    return list(totals.items())
+
+
+if __name__ == "__main__":
+    from app import app
+
+    with app.app_context():
+        db.create_all()
+        print(f"{rebuild_ledger()} lignes dans le grand livre mensuel")
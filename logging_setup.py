@@ -0,0 +1,157 @@
+"""
+Configuration de la journalisation de l'application.
+
+Tout est réglé par variables d'environnement, lues par configure_logging() :
+
+- LOG_LEVEL : niveau global (DEBUG par défaut)
+- LOG_LEVELS : niveaux par module, ex. "file_handler=WARNING,app.auth=INFO,werkzeug=WARNING"
+- LOG_FORMAT : "text" (par défaut) ou "json" (un objet JSON par ligne)
+- LOG_ASYNC : "1" pour écrire depuis un thread dédié (QueueHandler/QueueListener) :
+  le thread de la requête ne fait que déposer l'enregistrement dans une file
+- LOG_SAMPLE_RATE : proportion (0 à 1) conservée des messages fréquents
+  (une ligne par requête, par morceau téléversé, par fichier traité) ; 1 par défaut
+
+Les messages fréquents sont marqués par extra=SAMPLED et s'écrivent en style
+paresseux (logger.info("... %s", valeur)) : s'ils sont écartés par le niveau ou
+l'échantillonnage, le message n'est jamais formaté. Les avertissements et
+erreurs ne sont jamais échantillonnés.
+
+Le profil de production de gunicorn_config.py active JSON, écriture asynchrone
+et échantillonnage. Le thread d'écriture ne survit pas au fork : il est
+redémarré dans chaque processus enfant (workers Gunicorn, pool d'extraction).
+"""
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+import multiprocessing.util
+from datetime import datetime, timezone
+
+# À passer en extra= aux messages fréquents (échantillonnés)
+SAMPLED = {'sampled': True}
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
+
+_listener = None
+_queue_handler = None
+
+
+class SamplingFilter(logging.Filter):
+    """Ne conserve qu'une proportion des messages marqués SAMPLED (sous WARNING)"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if self.rate >= 1 or record.levelno >= logging.WARNING or not getattr(record, 'sampled', False):
+            return True
+        return random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    """Un objet JSON par ligne : horodatage, niveau, logger, message et emplacement"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'line': record.lineno,
+            'thread': record.threadName,
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc_info'] = record.exc_text
+        if getattr(record, 'sampled', False):
+            entry['sampled'] = True
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler qui ne fusionne que le message et ses arguments dans le thread
+    appelant (les arguments peuvent être modifiés ensuite) ; la mise en forme
+    (horodatage, JSON, traceback) est faite par le thread d'écriture.
+    """
+
+    def prepare(self, record):
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _parse_levels(value):
+    """'module=NIVEAU,autre=NIVEAU' -> {module: niveau}"""
+    levels = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            name, level = item.split('=', 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def _output_handler():
+    handler = logging.StreamHandler(sys.stderr)
+    if os.environ.get('LOG_FORMAT', 'text').lower() == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    return handler
+
+
+def configure_logging():
+    """Configure le logger racine (remplace les handlers existants)"""
+    global _queue_handler
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(os.environ.get('LOG_LEVEL', 'DEBUG').upper())
+    for name, level in _parse_levels(os.environ.get('LOG_LEVELS')).items():
+        logging.getLogger(name).setLevel(level)
+
+    sampling = SamplingFilter(float(os.environ.get('LOG_SAMPLE_RATE', '1')))
+    if os.environ.get('LOG_ASYNC', '0') == '1':
+        _queue_handler = DeferredQueueHandler(queue.SimpleQueue())
+        _queue_handler.addFilter(sampling)
+        root.addHandler(_queue_handler)
+        restart_listener()
+    else:
+        handler = _output_handler()
+        handler.addFilter(sampling)
+        root.addHandler(handler)
+
+
+def restart_listener():
+    """(Re)démarre le thread d'écriture de la file, par exemple après un fork"""
+    global _listener
+    if _queue_handler is None:
+        return
+    # La file héritée du processus parent n'a plus de lecteur : en repartir d'une neuve
+    _queue_handler.queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, _output_handler())
+    _listener.start()
+
+
+def _stop_listener():
+    """Écrit les messages restant dans la file avant la sortie du processus"""
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+
+atexit.register(_stop_listener)
+# Les enfants de multiprocessing sortent par os._exit, sans passer par atexit
+multiprocessing.util.Finalize(None, _stop_listener, exitpriority=0)
+os.register_at_fork(after_in_child=restart_listener)
@@ -9,6 +9,13 @@ from app_routes_dashboard import dashboard_bp  # Routes pour le tableau de bord
 # Enregistrer les blueprints
 app.register_blueprint(dashboard_bp)
 
+# Démarrer les threads d'extraction (reprend les tâches restées en attente).
+# En production (préchargement Gunicorn), ils sont démarrés dans chaque worker par post_fork.
+import os
+if os.environ.get("EXTRACTION_AUTOSTART", "1") == "1":
+    from extraction_queue import start_workers
+    start_workers()
+
 # IMPORTANT: L'application autonome de gestion des contacts a été COMPLÈTEMENT désactivée
 # pour éviter les problèmes de duplication. Une approche standalone est maintenant utilisée
 # directement dans app_routes_contacts.py avec un template autonome qui n'utilise pas base.html.
@@ -100,6 +100,10 @@ class Building(db.Model):
 class Property(db.Model):
     """Model for real estate properties"""
     __tablename__ = 'properties'
+    # Index des filtres fréquents (voir add_query_indexes.py pour les bases existantes)
+    __table_args__ = (
+        db.Index('ix_properties_building_id', 'building_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     address = db.Column(db.String(255), nullable=False)
@@ -161,6 +165,11 @@ class Company(db.Model):
 class Document(db.Model):
     """Model for property-related documents"""
     __tablename__ = 'documents'
+    # Index des filtres fréquents (voir add_query_indexes.py pour les bases existantes)
+    __table_args__ = (
+        db.Index('ix_documents_property_id', 'property_id'),
+        db.Index('ix_documents_company_property', 'company_id', 'property_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     property_id = db.Column(db.Integer, db.ForeignKey('properties.id', ondelete='CASCADE'), nullable=True)
@@ -173,6 +182,7 @@ class Document(db.Model):
     amount = db.Column(db.Float, nullable=True)  # Montant (pour factures, relevés, etc.)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
     description = db.Column(db.Text, nullable=True)  # Description ou note sur le document
+    extraction_status = db.Column(db.String(20), nullable=True)  # en_attente, en_cours, extrait, sans_texte, echec
     
     def __repr__(self):
         if self.property_id:
@@ -186,6 +196,11 @@ class Document(db.Model):
 class Payment(db.Model):
     """Model for tenant payments"""
     __tablename__ = 'payments'
+    # Index des filtres fréquents (voir add_query_indexes.py pour les bases existantes)
+    __table_args__ = (
+        db.Index('ix_payments_status_date', 'status', 'payment_date'),
+        db.Index('ix_payments_property_date', 'property_id', 'payment_date'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     property_id = db.Column(db.Integer, db.ForeignKey('properties.id', ondelete='CASCADE'), nullable=False)
@@ -229,6 +244,10 @@ class Payment(db.Model):
 class Contact(db.Model):
     """Model for contact management"""
     __tablename__ = 'contacts'
+    # Index des filtres fréquents (voir add_query_indexes.py pour les bases existantes)
+    __table_args__ = (
+        db.Index('ix_contacts_category', 'category', 'last_name', 'first_name'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     first_name = db.Column(db.String(100), nullable=False)
@@ -269,6 +288,11 @@ contact_building = db.Table('contact_building',
 class Expense(db.Model):
     """Modèle pour les charges (appels de fonds, factures, etc.)"""
     __tablename__ = 'expenses'
+    # Index des filtres fréquents (voir add_query_indexes.py pour les bases existantes)
+    __table_args__ = (
+        db.Index('ix_expenses_status_due_date', 'status', 'due_date'),
+        db.Index('ix_expenses_status_property', 'status', 'property_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     property_id = db.Column(db.Integer, db.ForeignKey('properties.id', ondelete='CASCADE'), nullable=True)
@@ -311,21 +335,23 @@ class Expense(db.Model):
     def __repr__(self):
         return f'<Expense {self.id}: {self.charge_type} - {self.amount}€>'
     
+    # Libellés des types de charge
+    CHARGE_TYPE_LABELS = {
+        'appel_fonds': 'Appel de fonds',
+        'edf': 'Électricité (EDF)',
+        'eau': 'Eau',
+        'chauffage': 'Chauffage',
+        'syndic': 'Syndic',
+        'taxe_fonciere': 'Taxe foncière',
+        'taxe_habitation': 'Taxe d\'habitation',
+        'assurance': 'Assurance',
+        'travaux': 'Travaux',
+        'autre': 'Autre'
+    }
+    
     def get_charge_type_display(self):
         """Retourne une version lisible du type de charge"""
-        types = {
-            'appel_fonds': 'Appel de fonds',
-            'edf': 'Électricité (EDF)',
-            'eau': 'Eau',
-            'chauffage': 'Chauffage',
-            'syndic': 'Syndic',
-            'taxe_fonciere': 'Taxe foncière',
-            'taxe_habitation': 'Taxe d\'habitation',
-            'assurance': 'Assurance',
-            'travaux': 'Travaux',
-            'autre': 'Autre'
-        }
-        return types.get(self.charge_type, self.charge_type)
+        return self.CHARGE_TYPE_LABELS.get(self.charge_type, self.charge_type)
     
     def get_status_display(self):
         """Retourne une version lisible du statut"""
@@ -363,3 +389,86 @@ class UserDashboardPreference(db.Model):
     
     def __repr__(self):
         return f'<UserDashboardPreference {self.id} - User {self.user_id}>'
+
+
+class MonthlyLedger(db.Model):
+    """
+    Cumuls mensuels des paiements reçus et des charges payées, par bien, société
+    et type (maintenus par ledger.py). property_id et company_id valent 0 lorsque
+    la ligne n'est rattachée à aucun bien ou aucune société.
+    """
+    __tablename__ = 'monthly_ledger'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    year = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.Integer, nullable=False)
+    property_id = db.Column(db.Integer, nullable=False, default=0)
+    company_id = db.Column(db.Integer, nullable=False, default=0)
+    entry_type = db.Column(db.String(10), nullable=False)  # revenu, charge
+    category = db.Column(db.String(50), nullable=False, default='')  # Type de paiement ou de charge
+    total = db.Column(db.Float, nullable=False, default=0)
+    entry_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.UniqueConstraint('year', 'month', 'property_id', 'company_id', 'entry_type', 'category',
+                            name='uq_monthly_ledger_key'),
+        db.Index('ix_monthly_ledger_period', 'year', 'month'),
+    )
+    
+    def __repr__(self):
+        return f'<MonthlyLedger {self.year}-{self.month:02d} {self.entry_type} {self.category}: {self.total}>'
+
+
+class RecurringSeries(db.Model):
+    """
+    Série récurrente sans fin fixe (paiements ou charges), matérialisée au fil de
+    l'eau par recurring_schedule.py : les occurrences sont créées un horizon
+    glissant à l'avance au lieu d'être toutes insérées à la création.
+    """
+    __tablename__ = 'recurring_series'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    recurring_group_id = db.Column(db.String(50), nullable=False, unique=True)  # Groupe des lignes créées
+    target = db.Column(db.String(20), nullable=False)  # payment, expense
+    frequency = db.Column(db.String(20), nullable=False, default='mensuel')  # mensuel, trimestriel, semestriel, annuel
+    start_date = db.Column(db.Date, nullable=False)  # Première échéance (mois de départ)
+    day = db.Column(db.Integer, nullable=False)  # Jour d'échéance, ramené au dernier jour des mois courts (31 = fin de mois)
+    end_date = db.Column(db.Date, nullable=True)  # Dernière échéance possible (aucune si vide)
+    amount = db.Column(db.Float, nullable=False)
+    values = db.Column(db.Text, nullable=False)  # Autres colonnes des lignes créées (JSON)
+    next_index = db.Column(db.Integer, nullable=False, default=0)  # Rang de la prochaine occurrence à créer
+    is_active = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<RecurringSeries {self.recurring_group_id} ({self.target}, {self.frequency})>'
+
+
+class HttpSession(db.Model):
+    """
+    Session HTTP côté serveur (session_store.py) : contenu sérialisé en JSON,
+    identifiée par l'identifiant aléatoire porté par le cookie de session.
+    """
+    __tablename__ = 'http_sessions'
+    
+    id = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+    def __repr__(self):
+        return f'<HttpSession {self.id[:8]} (expire {self.expires_at})>'
+
+
+class CacheVersion(db.Model):
+    """
+    Numéro de version partagé d'un cache en mémoire (cache_versions.py) :
+    incrémenté après chaque écriture validée sur les données mises en cache,
+    il permet à tous les processus de détecter qu'une entrée est périmée.
+    """
+    __tablename__ = 'cache_versions'
+    
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<CacheVersion {self.name}={self.version}>'
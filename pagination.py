@@ -0,0 +1,134 @@
+"""
+Pagination par clé (keyset) des listes volumineuses.
+
+Au lieu d'un OFFSET, chaque page reprend après la dernière ligne affichée :
+WHERE (colonne, id) > (dernière valeur, dernier id), ce qui reste rapide
+quelle que soit la profondeur de la page. Le curseur transmis au client est
+signé (itsdangerous) et contient aussi les filtres et le tri : la page suivante
+n'a besoin que du curseur.
+
+Le comptage peut être exact, estimé ou désactivé :
+- "exact" : COUNT(*) de la requête filtrée ;
+- "estimate" : estimation du planificateur sous PostgreSQL (EXPLAIN), sinon
+  comptage plafonné à COUNT_ESTIMATE_CAP lignes ;
+- "none" : pas de comptage.
+"""
+import json
+from datetime import date, datetime
+
+from flask import current_app
+from itsdangerous import URLSafeSerializer, BadSignature
+from sqlalchemy import and_, or_, func, select
+
+from database import db
+
+COUNT_MODES = ('exact', 'estimate', 'none')
+
+# Au-delà, le comptage « estimé » hors PostgreSQL s'arrête et renvoie un minorant
+COUNT_ESTIMATE_CAP = 10000
+
+
+class InvalidCursor(ValueError):
+    """Curseur illisible, altéré ou incompatible avec la liste demandée"""
+
+
+def _serializer():
+    return URLSafeSerializer(current_app.config["SECRET_KEY"], salt="keyset-cursor")
+
+
+def _dump_value(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def _load_value(column, value):
+    """Reconvertit une valeur de curseur dans le type Python de la colonne"""
+    if value is None:
+        return None
+    python_type = column.type.python_type
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if python_type is date:
+        return date.fromisoformat(value)
+    return python_type(value)
+
+
+def encode_cursor(state):
+    """Signe et encode l'état d'une liste (filtres, tri, dernière clé)"""
+    return _serializer().dumps(state)
+
+
+def decode_cursor(cursor):
+    """Décode un curseur ; lève InvalidCursor s'il a été altéré"""
+    try:
+        return _serializer().loads(cursor)
+    except BadSignature as e:
+        raise InvalidCursor(str(e))
+
+
+def _after(column, id_column, value, last_id, descending):
+    """Condition « après (value, last_id) » dans l'ordre (colonne IS NULL, colonne, id)"""
+    later = (lambda a, b: a < b) if descending else (lambda a, b: a > b)
+    if column is id_column:
+        return later(id_column, last_id)
+    if value is None:
+        # Les valeurs NULL sont en fin de liste, départagées par l'id
+        return and_(column.is_(None), later(id_column, last_id))
+    condition = or_(later(column, value), and_(column == value, later(id_column, last_id)))
+    if column.nullable:
+        condition = or_(condition, column.is_(None))
+    return condition
+
+
+def keyset_page(query, column, id_column, limit, after=None, descending=False):
+    """
+    Retourne (lignes, clé de la dernière ligne ou None s'il n'y a pas de page suivante).
+
+    `after` est la clé [valeur, id] de la dernière ligne de la page précédente.
+    """
+    if after is not None:
+        value, last_id = after
+        query = query.filter(_after(column, id_column, _load_value(column, value), last_id, descending))
+
+    order_by = []
+    if column is not id_column:
+        if column.nullable:
+            order_by.append(column.is_(None))
+        order_by.append(column.desc() if descending else column)
+    order_by.append(id_column.desc() if descending else id_column)
+
+    rows = query.order_by(*order_by).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, [_dump_value(getattr(last, column.key)), getattr(last, id_column.key)]
+
+
+def count_rows(query, mode='estimate'):
+    """
+    Compte les lignes d'une requête selon le mode ("exact", "estimate", "none").
+    Retourne (nombre ou None, exact).
+    """
+    if mode == 'none':
+        return None, False
+
+    statement = query.order_by(None).statement
+    if mode == 'exact':
+        count = db.session.execute(select(func.count()).select_from(statement.subquery())).scalar()
+        return count, True
+
+    if db.engine.dialect.name == 'postgresql':
+        compiled = statement.compile(dialect=db.engine.dialect)
+        plan = db.session.connection().exec_driver_sql(
+            f"EXPLAIN (FORMAT JSON) {compiled.string}", compiled.params
+        ).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"]), False
+
+    capped = statement.limit(COUNT_ESTIMATE_CAP + 1).subquery()
+    count = db.session.execute(select(func.count()).select_from(capped)).scalar()
+    return min(count, COUNT_ESTIMATE_CAP), count <= COUNT_ESTIMATE_CAP
@@ -0,0 +1,68 @@
+"""
+Chargement des documents d'un bien pour la page de détail.
+
+Un bien voit ses propres documents (property_id) et les documents généraux de
+sa société propriétaire (company_id, sans property_id). Les deux ensembles sont
+lus en une seule requête, servie par les index ix_documents_property_id et
+ix_documents_company_property, puis répartis et indexés par type en un passage.
+
+Le bien est chargé avec sa société et son immeuble (jointures) : les relations
+document.property et document.company se résolvent ensuite depuis la session,
+sans requête. Le nombre de requêtes ne dépend donc pas du nombre de documents.
+"""
+from sqlalchemy import or_, and_
+from sqlalchemy.orm import joinedload
+
+from database import db
+from models import Property, Document
+
+# Types de documents essentiels affichés sur la page du bien
+REQUIRED_DOCUMENT_TYPES = ['Bail', 'DPE', 'VISALE', 'Assurance locataire', 'État des lieux', 'Caution']
+
+
+def get_property_with_relations(property_id):
+    """Retourne le bien avec sa société et son immeuble, ou None"""
+    return db.session.get(
+        Property, property_id,
+        options=[joinedload(Property.company), joinedload(Property.building)]
+    )
+
+
+def load_property_documents(property):
+    """
+    Retourne les documents d'un bien en une requête :
+    {'documents', 'direct_documents', 'company_documents', 'documents_by_type'}.
+
+    company_documents contient les documents de la société, généraux ou liés à
+    ce bien ; documents contient chaque document une seule fois. documents_by_type
+    associe à chaque type essentiel le premier document de ce type (documents du
+    bien d'abord), ou None.
+    """
+    condition = Document.property_id == property.id
+    if property.company_id:
+        condition = or_(condition, and_(Document.company_id == property.company_id, Document.property_id.is_(None)))
+    rows = Document.query.filter(condition).order_by(Document.id).all()
+
+    direct_documents = []
+    general_documents = []
+    for document in rows:
+        (direct_documents if document.property_id == property.id else general_documents).append(document)
+
+    company_documents = []
+    if property.company_id:
+        company_documents = general_documents + [
+            document for document in direct_documents if document.company_id == property.company_id
+        ]
+
+    documents = direct_documents + general_documents
+    documents_by_type = dict.fromkeys(REQUIRED_DOCUMENT_TYPES)
+    for document in documents:
+        if document.document_type in documents_by_type and documents_by_type[document.document_type] is None:
+            documents_by_type[document.document_type] = document
+
+    return {
+        'documents': documents,
+        'direct_documents': direct_documents,
+        'company_documents': company_documents,
+        'documents_by_type': documents_by_type,
+    }
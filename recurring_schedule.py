@@ -0,0 +1,476 @@
+"""
+Échéanciers des paiements et charges récurrents.
+
+Les dates et montants d'une série sont calculés directement à partir du rang de
+chaque occurrence (mois de départ + rang x pas de la fréquence), sans chaîner
+les dates d'une échéance à la suivante : une échéance au 31 tombe au dernier
+jour des mois courts sans glisser au 28 pour la suite de la série. Le premier
+montant peut être calculé au prorata des jours restants de la première période.
+
+Les séries d'une longueur donnée sont insérées en masse (INSERT multi-lignes).
+Les séries sans fin sont enregistrées dans recurring_series et matérialisées un
+horizon glissant à l'avance (RECURRING_HORIZON_DAYS, 90 jours par défaut) par
+une tâche planifiée, une fois par jour :
+
+    python recurring_schedule.py
+
+La matérialisation hors des requêtes est le mode par défaut ; elle peut aussi
+être déclenchée une fois par jour et par processus depuis before_request
+(RECURRING_MATERIALIZE_ON_REQUEST=1). Chaque série est réservée atomiquement :
+plusieurs workers ou le cron peuvent s'exécuter en même temps sans doublon.
+
+Les opérations sur une série existante (décalage des dates, nouveau montant à
+partir d'une date, scission, suppression de la fin) sont chacune une seule
+instruction UPDATE ou DELETE sur recurring_group_id, sans charger la série.
+"""
+import os
+import json
+import uuid
+import logging
+import calendar
+import threading
+from datetime import date, timedelta
+
+from sqlalchemy import insert, select, update, func, cast, case, literal_column, Date, Integer, String
+
+from database import db
+from models import Payment, Expense, RecurringSeries
+import ledger
+
+# Pas en mois de chaque fréquence
+FREQUENCY_MONTHS = {'mensuel': 1, 'trimestriel': 3, 'semestriel': 6, 'annuel': 12}
+
+# Modèle et colonne d'échéance de chaque type de série
+TARGETS = {'payment': (Payment, 'payment_date'), 'expense': (Expense, 'due_date')}
+
+# Nombre de jours à l'avance pour lesquels les séries sans fin sont matérialisées
+HORIZON_DAYS = int(os.environ.get("RECURRING_HORIZON_DAYS", "90"))
+
+# Matérialisation depuis les requêtes (before_request) : désactivée par défaut,
+# les séries sans fin sont alors matérialisées par le cron
+MATERIALIZE_ON_REQUEST = os.environ.get("RECURRING_MATERIALIZE_ON_REQUEST", "0") == "1"
+
+# Nombre maximal d'occurrences d'une série de longueur fixe
+MAX_OCCURRENCES = 120
+
+# Nombre de lignes par INSERT
+INSERT_BATCH_SIZE = 1000
+
+_lock = threading.Lock()
+_last_run = {'run_date': None}
+
+
+def anchor_day(due_date):
+    """Jour d'échéance d'une série partant de due_date (31 si c'est le dernier jour du mois)"""
+    if due_date.day == calendar.monthrange(due_date.year, due_date.month)[1]:
+        return 31
+    return due_date.day
+
+
+def _add_months(year, month, months):
+    month_index = year * 12 + month - 1 + months
+    return month_index // 12, month_index % 12 + 1
+
+
+def occurrence_date(start, index, frequency='mensuel', day=None):
+    """Date de l'occurrence de rang index (0 = start), jour ramené à la fin des mois courts"""
+    year, month = _add_months(start.year, start.month, index * FREQUENCY_MONTHS.get(frequency, 1))
+    return date(year, month, min(day or start.day, calendar.monthrange(year, month)[1]))
+
+
+def _last_index_until(start, until, frequency, day):
+    """Rang de la dernière occurrence tombant au plus tard à la date until (-1 si aucune)"""
+    step = FREQUENCY_MONTHS.get(frequency, 1)
+    index = ((until.year - start.year) * 12 + until.month - start.month) // step
+    if index >= 0 and occurrence_date(start, index, frequency, day) > until:
+        index -= 1
+    return index
+
+
+def build_schedule(start, amount, frequency='mensuel', day=None, count=None, until=None,
+                   first_index=0, prorata_from=None):
+    """
+    Retourne les occurrences [(rang, date, montant, prorata)] de la série, du rang
+    first_index jusqu'à count occurrences au total et/ou jusqu'à la date until.
+
+    Avec prorata_from, le montant de la première occurrence (rang 0) est réduit au
+    prorata des jours restants de sa période à partir de cette date ; prorata vaut
+    alors (jours facturés, jours de la période), sinon None.
+    """
+    if count is None and until is None:
+        raise ValueError("Une série doit avoir un nombre d'occurrences ou une date de fin")
+
+    last_index = count - 1 if count is not None else MAX_OCCURRENCES + first_index
+    if until is not None:
+        last_index = min(last_index, _last_index_until(start, until, frequency, day))
+
+    occurrences = [
+        (index, occurrence_date(start, index, frequency, day), amount, None)
+        for index in range(first_index, last_index + 1)
+    ]
+
+    if prorata_from and occurrences and occurrences[0][0] == 0:
+        period_start = date(start.year, start.month, 1)
+        period_end = date(*_add_months(start.year, start.month, FREQUENCY_MONTHS.get(frequency, 1)), 1)
+        period_days = (period_end - period_start).days
+        days = max(0, min(period_days, (period_end - prorata_from).days))
+        if days < period_days:
+            index, due_date, _, _ = occurrences[0]
+            occurrences[0] = (index, due_date, round(amount * days / period_days, 2), (days, period_days))
+    return occurrences
+
+
+def schedule_rows(target, values, occurrences, period_days=None):
+    """
+    Valeurs des lignes à insérer pour des occurrences : values (colonnes communes)
+    complétées par l'échéance et le montant. Avec period_days, la période couverte
+    (period_start, period_end) se termine à chaque échéance.
+    """
+    date_column = TARGETS[target][1]
+    rows = []
+    for index, due_date, amount, prorata in occurrences:
+        row = dict(values, amount=amount)
+        row[date_column] = due_date
+        if period_days is not None:
+            row['period_start'] = due_date - timedelta(days=period_days)
+            row['period_end'] = due_date
+        if prorata:
+            row['description'] = f"{values.get('description') or ''}\nMontant ajusté pour {prorata[0]} jours sur {prorata[1]}"
+        rows.append(row)
+    return rows
+
+
+def insert_rows(target, rows):
+    """Insère des lignes en masse et les reporte au grand livre (sans commit)"""
+    model = TARGETS[target][0]
+    for i in range(0, len(rows), INSERT_BATCH_SIZE):
+        db.session.execute(insert(model), rows[i:i + INSERT_BATCH_SIZE])
+    ledger.add_rows_to_ledger(model, rows)
+    return len(rows)
+
+
+def create_series(target, values, start, amount, frequency='mensuel', day=None, count=None,
+                  first_index=0, prorata_from=None, period_days=None, today=None):
+    """
+    Crée une série récurrente (sans commit) et retourne le nombre de lignes insérées.
+
+    - values : colonnes communes des lignes (recurring_group_id compris) ;
+    - count : nombre total d'occurrences ; sans count, la série est sans fin et
+      seules les occurrences de l'horizon glissant sont créées ;
+    - first_index : rang de la première occurrence à insérer (1 si l'occurrence 0
+      a déjà été créée par l'appelant).
+    """
+    day = day or anchor_day(start)
+    if count is not None:
+        occurrences = build_schedule(start, amount, frequency, day, count=min(count, MAX_OCCURRENCES),
+                                     first_index=first_index, prorata_from=prorata_from)
+        return insert_rows(target, schedule_rows(target, values, occurrences, period_days))
+
+    stored_values = dict(values)
+    if period_days is not None:
+        stored_values['period_days'] = period_days
+    series = RecurringSeries(
+        recurring_group_id=values['recurring_group_id'],
+        target=target,
+        frequency=frequency,
+        start_date=start,
+        day=day,
+        amount=amount,
+        values=json.dumps(stored_values, default=str),
+        next_index=first_index
+    )
+    db.session.add(series)
+    until = (today or date.today()) + timedelta(days=HORIZON_DAYS)
+    occurrences = build_schedule(start, amount, frequency, day, until=until,
+                                 first_index=first_index, prorata_from=prorata_from)
+    # La première échéance est toujours créée, même au-delà de l'horizon
+    if not occurrences and first_index == 0:
+        occurrences = build_schedule(start, amount, frequency, day, count=1, prorata_from=prorata_from)
+    if occurrences:
+        series.next_index = occurrences[-1][0] + 1
+    return insert_rows(target, schedule_rows(target, values, occurrences, period_days))
+
+
+def stop_series(recurring_group_id):
+    """Arrête la matérialisation d'une série sans fin (suppression des occurrences futures)"""
+    return RecurringSeries.query.filter_by(recurring_group_id=recurring_group_id).update(
+        {RecurringSeries.is_active: False}, synchronize_session=False
+    )
+
+
+# Opérations ensemblistes sur une série existante : chacune est une instruction
+# UPDATE ou DELETE sur recurring_group_id et retourne le nombre de lignes touchées.
+# Le grand livre n'est ajusté que pour les lignes déjà payées (agrégats SQL).
+
+def series_query(target, recurring_group_id, from_date=None, after=None, exclude_id=None, property_id=None):
+    """Occurrences d'une série, éventuellement à partir de from_date (incluse) ou après after"""
+    model, date_column = TARGETS[target]
+    column = getattr(model, date_column)
+    query = model.query.filter(model.recurring_group_id == recurring_group_id)
+    if from_date:
+        query = query.filter(column >= from_date)
+    if after:
+        query = query.filter(column > after)
+    if exclude_id:
+        query = query.filter(model.id != exclude_id)
+    if property_id:
+        query = query.filter(model.property_id == property_id)
+    return query
+
+
+def _bulk_update(target, query, values):
+    """UPDATE ensembliste ; les lignes payées sont retirées puis remises au grand livre"""
+    model = TARGETS[target][0]
+    paid_statuses = ledger.PAYMENT_PAID_STATUSES if model is Payment else ledger.EXPENSE_PAID_STATUSES
+    paid_ids = [row[0] for row in query.filter(model.status.in_(paid_statuses)).with_entities(model.id)]
+    if paid_ids:
+        ledger.remove_rows_from_ledger(model.query.filter(model.id.in_(paid_ids)))
+    count = query.update(values, synchronize_session=False)
+    if paid_ids:
+        ledger.add_query_to_ledger(model.query.filter(model.id.in_(paid_ids)))
+    return count
+
+
+def _shift_date(value, days=0, months=0, anchor=31):
+    """
+    Décale une date de months mois puis de days jours. Le jour est conservé (ramené
+    à la fin des mois courts) ; une date au dernier jour de son mois passe au jour
+    anchor du mois cible (31 : dernier jour), comme les échéances de la série.
+    """
+    year, month = _add_months(value.year, value.month, months)
+    day = value.day
+    if months and day == calendar.monthrange(value.year, value.month)[1]:
+        day = max(day, anchor)
+    return date(year, month, min(day, calendar.monthrange(year, month)[1])) + timedelta(days=days)
+
+
+def _day_of_month(column):
+    """Expression SQL du jour du mois d'une colonne de dates"""
+    if db.engine.dialect.name == 'postgresql':
+        return cast(func.date_part('day', column), Integer)
+    return cast(func.strftime('%d', column), Integer)
+
+
+def _shifted_column(column, days=0, months=0, anchor=31):
+    """Expression SQL de _shift_date appliquée à une colonne de dates"""
+    if not months:
+        if db.engine.dialect.name == 'postgresql':
+            return cast(column + func.make_interval(0, 0, 0, days), Date)
+        return func.date(column, f'{days:+d} days') if days else column
+
+    # Premier jour du mois cible + (jour - 1) jours, borné au dernier jour de ce mois ;
+    # le jour d'une date en fin de mois est porté à anchor
+    day = _day_of_month(column)
+    if db.engine.dialect.name == 'postgresql':
+        month_start = func.date_trunc('month', column)
+        is_month_end = column == cast(month_start + literal_column("interval '1 month'") - literal_column("interval '1 day'"), Date)
+        first_day = cast(month_start + func.make_interval(0, months), Date)
+        last_day = cast(first_day + literal_column("interval '1 month'") - literal_column("interval '1 day'"), Date)
+        target_day = case((is_month_end, func.greatest(day, anchor)), else_=day)
+        shifted = func.least(first_day + target_day - 1, last_day)
+        return shifted + days if days else shifted
+
+    # SQLite
+    is_month_end = column == func.date(column, 'start of month', '+1 month', '-1 day')
+    first_day = func.date(column, 'start of month', f'{months:+d} months')
+    target_day = case((is_month_end, func.max(day, anchor)), else_=day)
+    shifted = func.min(
+        func.date(first_day, '+' + cast(target_day - 1, String) + ' days'),
+        func.date(first_day, '+1 month', '-1 day')
+    )
+    if days:
+        shifted = func.date(shifted, f'{days:+d} days')
+    return shifted
+
+
+def _template(recurring_group_id):
+    return RecurringSeries.query.filter_by(recurring_group_id=recurring_group_id).first()
+
+
+def update_series(target, recurring_group_id, values, from_date=None, after=None, exclude_id=None):
+    """
+    Modifie les colonnes values ({nom: valeur}, hors statut) des occurrences de la
+    série à partir de from_date (ou après after), ainsi que les occurrences futures
+    d'une série sans fin.
+    """
+    count = _bulk_update(target, series_query(target, recurring_group_id, from_date, after, exclude_id), values)
+    series = _template(recurring_group_id)
+    if series:
+        stored_values = json.loads(series.values)
+        for column, value in values.items():
+            if column == 'amount':
+                series.amount = value
+            else:
+                stored_values[column] = value
+        series.values = json.dumps(stored_values, default=str)
+    return count
+
+
+def change_series_amount(target, recurring_group_id, amount, from_date=None):
+    """Nouveau montant des occurrences à partir de from_date"""
+    return update_series(target, recurring_group_id, {'amount': amount}, from_date=from_date)
+
+
+def shift_series(target, recurring_group_id, days=0, months=0, from_date=None):
+    """
+    Décale les échéances (et les périodes des charges) à partir de from_date.
+
+    Lors d'un décalage en mois, les échéances tombées en fin de mois court
+    reprennent le jour de la série (jour du modèle d'une série sans fin, sinon le
+    plus grand jour des échéances) : une série au 31 reste en fin de mois.
+    """
+    model, date_column = TARGETS[target]
+    query = series_query(target, recurring_group_id, from_date)
+    series = _template(recurring_group_id)
+    if series:
+        anchor = series.day
+    else:
+        anchor = query.with_entities(func.max(_day_of_month(getattr(model, date_column)))).scalar() or 31
+
+    values = {date_column: _shifted_column(getattr(model, date_column), days, months, anchor)}
+    if model is Expense:
+        for column in ('period_start', 'period_end'):
+            values[column] = _shifted_column(getattr(model, column), days, months)
+    count = _bulk_update(target, query, values)
+
+    if series:
+        series.start_date = _shift_date(series.start_date, days, months, anchor)
+        if days:
+            series.day = anchor_day(series.start_date)
+    return count
+
+
+def split_series(target, recurring_group_id, from_date, new_group_id=None):
+    """
+    Rattache les occurrences à partir de from_date à une nouvelle série (qui reprend
+    aussi la suite d'une série sans fin). Retourne (nouvel identifiant, nombre de lignes).
+    """
+    new_group_id = new_group_id or str(uuid.uuid4())
+    # L'identifiant de série n'entre pas dans le grand livre : pas d'ajustement
+    count = series_query(target, recurring_group_id, from_date).update(
+        {TARGETS[target][0].recurring_group_id: new_group_id}, synchronize_session=False
+    )
+    RecurringSeries.query.filter_by(recurring_group_id=recurring_group_id).update(
+        {RecurringSeries.recurring_group_id: new_group_id}, synchronize_session=False
+    )
+    return new_group_id, count
+
+
+def delete_series(target, recurring_group_id, from_date=None, after=None, property_id=None):
+    """Supprime les occurrences (toutes, ou la fin de la série) et arrête une série sans fin"""
+    query = series_query(target, recurring_group_id, from_date, after, property_id=property_id)
+    ledger.remove_rows_from_ledger(query)
+    count = query.delete(synchronize_session=False)
+    stop_series(recurring_group_id)
+    return count
+
+
+def _occurrence_rows(series, until):
+    """Occurrences de la série jusqu'à until : (prochain rang, lignes à insérer), ou None"""
+    if occurrence_date(series.start_date, series.next_index, series.frequency, series.day) > until:
+        return None
+    values = json.loads(series.values)
+    period_days = values.pop('period_days', None)
+    occurrences = build_schedule(series.start_date, series.amount, series.frequency, series.day,
+                                 until=until, first_index=series.next_index)
+    if not occurrences:
+        return None
+    rows = schedule_rows(series.target, values, occurrences, period_days)
+    # Les dates et montants stockés en JSON sont du texte
+    model = TARGETS[series.target][0]
+    for row in rows:
+        for column, value in row.items():
+            if isinstance(value, str) and model.__table__.c[column].type.python_type is date:
+                row[column] = date.fromisoformat(value)
+    return occurrences[-1][0] + 1, rows
+
+
+def materialize_series(today=None, horizon_days=HORIZON_DAYS, failures=None):
+    """
+    Crée les occurrences des séries sans fin jusqu'à today + horizon_days.
+    Doit être appelée dans un contexte d'application. Retourne le nombre de lignes créées.
+
+    Une série en échec (modèle invalide, contrainte violée) est journalisée et
+    ignorée : les autres séries sont tout de même matérialisées. Les
+    recurring_group_id des séries en échec sont ajoutés à la liste failures.
+
+    Chaque série est réservée avant insertion par un UPDATE conditionnel de
+    next_index (WHERE next_index = valeur lue), dans la même transaction que ses
+    occurrences : si un autre processus l'a déjà avancée, la réservation ne
+    touche aucune ligne et la série est ignorée. Deux exécutions simultanées
+    (workers, cron) ne créent donc jamais deux fois la même occurrence.
+    """
+    until = (today or date.today()) + timedelta(days=horizon_days)
+    table = RecurringSeries.__table__
+    series_rows = db.session.execute(select(table).where(table.c.is_active.is_(True))).all()
+    # Terminer la transaction de lecture : chaque réservation part d'un état à jour
+    db.session.commit()
+
+    created = 0
+    failed = []
+    for series in series_rows:
+        try:
+            pending = _occurrence_rows(series, until)
+            if pending is None:
+                continue
+            next_index, rows = pending
+            claimed = db.session.execute(
+                update(table)
+                .where(table.c.id == series.id, table.c.next_index == series.next_index)
+                .values(next_index=next_index)
+            ).rowcount
+            if claimed != 1:
+                db.session.rollback()
+                logging.info(f"Série récurrente {series.recurring_group_id} déjà matérialisée par un autre processus")
+                continue
+            created += insert_rows(series.target, rows)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Erreur lors de la matérialisation de la série {series.recurring_group_id}: {str(e)}")
+            failed.append(series.recurring_group_id)
+
+    if failed:
+        logging.error(f"{len(failed)} séries récurrentes non matérialisées: {', '.join(failed)}")
+        if failures is not None:
+            failures.extend(failed)
+    if created:
+        logging.info(f"{created} occurrences de séries récurrentes créées (horizon: {until})")
+    return created
+
+
+def maybe_materialize_series():
+    """
+    Matérialise les séries sans fin au plus une fois par jour et par processus,
+    seulement si RECURRING_MATERIALIZE_ON_REQUEST=1 (sinon : cron). La journée
+    n'est marquée comme faite qu'après une exécution menée à son terme (les
+    séries en échec sont journalisées et reprises le lendemain).
+    """
+    today = date.today()
+    if not MATERIALIZE_ON_REQUEST or _last_run['run_date'] == today:
+        return None
+    if not _lock.acquire(blocking=False):
+        return None
+    try:
+        if _last_run['run_date'] == today:
+            return None
+        created = materialize_series(today)
+        _last_run['run_date'] = today
+        return created
+    except Exception as e:
+        logging.exception(f"Matérialisation des séries récurrentes impossible, nouvel essai à la prochaine requête: {str(e)}")
+        return None
+    finally:
+        _lock.release()
+
+
+if __name__ == "__main__":
+    # Exécution planifiée (cron) : python recurring_schedule.py
+    from app import app
+
+    with app.app_context():
+        failures = []
+        print(f"{materialize_series(failures=failures)} occurrences créées")
+        if failures:
+            print(f"Séries en échec: {', '.join(failures)}")
+            raise SystemExit(1)
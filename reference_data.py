@@ -0,0 +1,144 @@
+"""
+Listes de référence des formulaires (immeubles, biens, sociétés).
+
+Les listes déroulantes n'ont besoin que de quelques colonnes : chaque liste est
+lue une fois (requête sur ces seules colonnes, sans objets ORM) puis conservée
+en mémoire sous forme de tuples nommés, qui s'utilisent dans les templates
+comme les objets (building.id, building.name, property.address...).
+
+Chaque liste porte un numéro de version, incrémenté à chaque écriture validée
+sur sa table (via la session SQLAlchemy, y compris Query.update/Query.delete
+et les insertions en masse) : la liste est alors relue à la demande suivante.
+
+Le cache est propre à chaque processus ; les écritures faites par un autre
+worker (ou un script) sont détectées par la version partagée de la liste
+(cache_versions.py, lue une fois par requête). Le TTL (REFERENCE_CACHE_TTL,
+300 s par défaut) ne sert plus que de filet si cette version est illisible.
+"""
+import os
+import time
+import threading
+from collections import namedtuple
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+import cache_versions
+from database import db
+from models import Building, Property, Company
+
+# Durée de vie d'une liste (secondes)
+REFERENCE_CACHE_TTL = int(os.environ.get("REFERENCE_CACHE_TTL", "300"))
+
+BuildingOption = namedtuple('BuildingOption', 'id name')
+CompanyOption = namedtuple('CompanyOption', 'id name')
+# Loyer et charges servent à préremplir les montants des formulaires de paiement
+PropertyOption = namedtuple('PropertyOption', 'id address tenant rent charges building_id company_id')
+
+# Liste -> (modèle, type de ligne, colonne de tri)
+REFERENCE_LISTS = {
+    'buildings': (Building, BuildingOption, 'name'),
+    'companies': (Company, CompanyOption, 'name'),
+    'properties': (Property, PropertyOption, 'address'),
+}
+
+_lock = threading.Lock()
+_entries = {}   # liste -> (expire_at, version, version partagée, lignes)
+_versions = {}  # liste -> compteur d'invalidations
+
+
+def _load(name):
+    model, row_type, order_column = REFERENCE_LISTS[name]
+    columns = [getattr(model, field) for field in row_type._fields]
+    rows = db.session.execute(select(*columns).order_by(getattr(model, order_column), model.id)).all()
+    return [row_type(*row) for row in rows]
+
+
+def _shared_version(name):
+    return cache_versions.get_version(f'reference:{name}')
+
+
+def get_options(name):
+    """Retourne la liste de référence (tuples nommés), depuis le cache si elle est à jour"""
+    shared = _shared_version(name)
+    with _lock:
+        version = _versions.get(name, 0)
+        entry = _entries.get(name)
+        if (entry and entry[0] > time.time() and entry[1] == version
+                and (shared is None or entry[2] == shared)):
+            return entry[3]
+
+    rows = _load(name)
+    with _lock:
+        # Ne pas conserver une liste lue avant une invalidation concurrente
+        if _versions.get(name, 0) == version:
+            _entries[name] = (time.time() + REFERENCE_CACHE_TTL, version, shared, rows)
+    return rows
+
+
+def get_buildings():
+    return get_options('buildings')
+
+
+def get_companies():
+    return get_options('companies')
+
+
+def get_properties():
+    return get_options('properties')
+
+
+def invalidate(names=None):
+    """Invalide des listes de référence (toutes si None)"""
+    with _lock:
+        for name in (REFERENCE_LISTS if names is None else names):
+            _versions[name] = _versions.get(name, 0) + 1
+            _entries.pop(name, None)
+
+
+# Invalidation par les événements de session : les listes touchées sont
+# collectées pendant les flush et invalidées à la validation de la transaction.
+
+_LIST_BY_MODEL = {model: name for name, (model, _, _) in REFERENCE_LISTS.items()}
+
+
+def _pending(session):
+    return session.info.setdefault('reference_data_pending', set())
+
+
+def _track(session, name):
+    _pending(session).add(name)
+    # Les autres processus le verront par la version partagée
+    cache_versions.track(session, {f'reference:{name}'})
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_flush_changes(session, flush_context, instances):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        name = _LIST_BY_MODEL.get(type(obj))
+        if name is None:
+            continue
+        if obj in session.dirty and not session.is_modified(obj):
+            continue
+        _track(session, name)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _collect_bulk_changes(orm_execute_state):
+    """Query.update / Query.delete et les insertions en masse ne passent pas par le flush"""
+    if orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and mapper.class_ in _LIST_BY_MODEL:
+            _track(orm_execute_state.session, _LIST_BY_MODEL[mapper.class_])
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    pending = session.info.pop('reference_data_pending', None)
+    if pending:
+        invalidate(pending)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_after_rollback(session):
+    session.info.pop('reference_data_pending', None)
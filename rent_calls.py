@@ -0,0 +1,202 @@
+"""
+Génération en masse des appels de loyer (paiements mensuels "En attente").
+
+Pour une période d'un ou plusieurs mois, une seule requête calcule les couples
+(bien loué, mois) sans appel existant : produit des biens par les mois demandés
+et anti-jointure (NOT EXISTS) sur les paiements Loyer, Charges ou Loyer+Charges
+du mois, servie par l'index ix_payments_property_date. Les appels manquants
+sont ensuite insérés par lots (INSERT multi-lignes) dans une transaction courte.
+
+Un essai à blanc (dry_run) retourne le même rapport sans rien écrire.
+
+    python rent_calls.py 2026-11                  # un mois
+    python rent_calls.py 2026-11 2027-01 --day 1  # plusieurs mois
+    python rent_calls.py 2026-11 --dry-run        # rapport sans écriture
+
+Les appels générés sont "En attente" : ils ne contribuent pas au grand livre
+mensuel (ledger), qui ne cumule que les paiements reçus.
+"""
+import uuid
+import logging
+import argparse
+import calendar
+from datetime import date
+
+from sqlalchemy import select, literal, union_all, exists, insert, true, Integer, Date
+
+from database import db
+from models import Payment, Property
+
+# Types de paiement considérés comme un appel déjà émis pour le mois
+RENT_CALL_TYPES = ('Loyer+Charges', 'Loyer', 'Charges')
+
+# Nombre maximal de mois générés en une fois
+MAX_MONTHS = 24
+
+# Nombre de lignes par INSERT
+INSERT_BATCH_SIZE = 1000
+
+
+def month_range(start_year, start_month, end_year=None, end_month=None):
+    """Retourne [(année, mois)] de start à end inclus"""
+    end_year = end_year or start_year
+    end_month = end_month or start_month
+    months = []
+    year, month = start_year, start_month
+    while (year, month) <= (end_year, end_month):
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def due_date_for(year, month, day):
+    """Date d'échéance du mois (ramenée au dernier jour si le jour n'existe pas, ex. 31 février)"""
+    return date(year, month, min(day, calendar.monthrange(year, month)[1]))
+
+
+def _months_subquery(months):
+    """Sous-requête (year, month, period_start, period_end) des mois demandés"""
+    return union_all(*[
+        select(
+            literal(year, Integer).label('year'),
+            literal(month, Integer).label('month'),
+            literal(date(year, month, 1), Date).label('period_start'),
+            literal(date(year, month, calendar.monthrange(year, month)[1]), Date).label('period_end')
+        )
+        for year, month in months
+    ]).subquery('months')
+
+
+def find_missing_rent_calls(months):
+    """
+    Retourne les lignes (id, rent, charges, tenant, year, month) des biens loués
+    sans appel pour chacun des mois, en une requête (biens x mois, anti-jointure).
+    """
+    months_query = _months_subquery(months)
+    existing = exists().where(
+        Payment.property_id == Property.id,
+        Payment.payment_type.in_(RENT_CALL_TYPES),
+        Payment.payment_date.between(months_query.c.period_start, months_query.c.period_end)
+    )
+    return db.session.execute(
+        select(Property.id, Property.rent, Property.charges, Property.tenant,
+               months_query.c.year, months_query.c.month)
+        .join(months_query, true())
+        .where(Property.tenant != '', ~existing)
+        .order_by(months_query.c.year, months_query.c.month, Property.id)
+    ).all()
+
+
+def plan_rent_calls(months, day=5, include_rent=True, include_charges=True):
+    """Retourne les valeurs des appels à créer (dictionnaires de colonnes de Payment)"""
+    run_id = uuid.uuid4().hex[:8]
+    rows = []
+    for prop in find_missing_rent_calls(months):
+        year, month = prop.year, prop.month
+        total_amount = 0
+        payment_types = []
+        if include_rent and prop.rent > 0:
+            total_amount += prop.rent
+            payment_types.append('Loyer')
+        if include_charges and prop.charges and prop.charges > 0:
+            total_amount += prop.charges
+            payment_types.append('Charges')
+        if total_amount <= 0:
+            continue
+
+        month_name = calendar.month_name[month]
+        if len(payment_types) == 2:
+            payment_type = 'Loyer+Charges'
+            description = f"Loyer et charges de {month_name} {year} pour {prop.tenant}"
+        elif payment_types[0] == 'Loyer':
+            payment_type = 'Loyer'
+            description = f"Loyer de {month_name} {year} pour {prop.tenant}"
+        else:
+            payment_type = 'Charges'
+            description = f"Charges de {month_name} {year} pour {prop.tenant}"
+
+        rows.append({
+            'property_id': prop.id,
+            'amount': total_amount,
+            'payment_date': due_date_for(year, month, day),
+            'payment_type': payment_type,
+            'payment_method': '',
+            'status': 'En attente',
+            'description': description,
+            'recurring_group_id': f"gen_{year}_{month}_{run_id}",
+            'is_recurring': True,
+        })
+    return rows
+
+
+def summarize_rent_calls(months, rows):
+    """Rapport par mois : {'months': [{'year', 'month', 'count', 'amount'}], 'count', 'amount'}"""
+    by_month = {(year, month): {'year': year, 'month': month, 'count': 0, 'amount': 0} for year, month in months}
+    for row in rows:
+        entry = by_month[(row['payment_date'].year, row['payment_date'].month)]
+        entry['count'] += 1
+        entry['amount'] += row['amount']
+    return {
+        'months': list(by_month.values()),
+        'count': len(rows),
+        'amount': sum(row['amount'] for row in rows),
+    }
+
+
+def generate_rent_calls(months, day=5, include_rent=True, include_charges=True, dry_run=False):
+    """
+    Crée les appels de loyer manquants pour les mois donnés ([(année, mois)]).
+    Doit être appelée dans un contexte d'application Flask. Avec dry_run=True,
+    rien n'est écrit. Retourne le rapport de summarize_rent_calls (avec 'dry_run').
+    """
+    if not months:
+        raise ValueError("Aucun mois demandé")
+    if len(months) > MAX_MONTHS:
+        raise ValueError(f"Au plus {MAX_MONTHS} mois peuvent être générés en une fois")
+
+    rows = plan_rent_calls(months, day, include_rent, include_charges)
+    report = summarize_rent_calls(months, rows)
+    report['dry_run'] = dry_run
+    if dry_run or not rows:
+        return report
+
+    try:
+        for i in range(0, len(rows), INSERT_BATCH_SIZE):
+            db.session.execute(insert(Payment), rows[i:i + INSERT_BATCH_SIZE])
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Erreur lors de la génération des appels de loyer: {str(e)}")
+        raise
+
+    logging.info(f"{len(rows)} appels de loyer générés pour {len(months)} mois")
+    return report
+
+
+def _parse_month(value):
+    year, month = value.split('-')
+    return int(year), int(month)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Génération des appels de loyer mensuels")
+    parser.add_argument('start', type=_parse_month, help="Premier mois (AAAA-MM)")
+    parser.add_argument('end', type=_parse_month, nargs='?', help="Dernier mois (AAAA-MM), par défaut le premier")
+    parser.add_argument('--day', type=int, default=5, help="Jour d'échéance (5 par défaut)")
+    parser.add_argument('--no-rent', action='store_true', help="Ne pas inclure le loyer")
+    parser.add_argument('--no-charges', action='store_true', help="Ne pas inclure les charges")
+    parser.add_argument('--dry-run', action='store_true', help="Afficher le rapport sans rien écrire")
+    args = parser.parse_args()
+
+    from app import app
+
+    with app.app_context():
+        end = args.end or args.start
+        report = generate_rent_calls(
+            month_range(*args.start, *end), day=args.day,
+            include_rent=not args.no_rent, include_charges=not args.no_charges, dry_run=args.dry_run
+        )
+        for entry in report['months']:
+            print(f"{entry['year']}-{entry['month']:02d}: {entry['count']} appels, {entry['amount']:.2f} €")
+        action = "à créer (essai à blanc)" if report['dry_run'] else "créés"
+        print(f"Total: {report['count']} appels {action}, {report['amount']:.2f} €")
@@ -0,0 +1,386 @@
+"""
+Index inversé persistant pour la recherche plein texte dans les documents extraits.
+
+L'index est stocké dans une base SQLite à côté des contenus extraits
+(static/document_contents/search_index.sqlite3). Les termes sont normalisés
+(minuscules, suppression des accents, mots vides français) puis racinisés avec
+un raciniseur léger adapté au vocabulaire immobilier (bail/baux, appel de
+charges, relevé, procès-verbal...). Les résultats sont classés avec BM25.
+
+Reconstruction complète :
+
+    python search_index.py
+"""
+import os
+import re
+import json
+import math
+import bisect
+import logging
+import sqlite3
+import threading
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+CONTENT_DIR = "static/document_contents"
+INDEX_PATH = os.path.join(CONTENT_DIR, "search_index.sqlite3")
+
+# Paramètres BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Bonus appliqué aux expressions métier (ex: "appel de charges")
+PHRASE_BOOST = 1.5
+
+MAX_EXCERPTS = 5
+
+# Mots vides français (après suppression des accents)
+STOPWORDS = {
+    'a', 'au', 'aux', 'avec', 'ce', 'ces', 'c', 'd', 'dans', 'de', 'des', 'du', 'elle', 'en', 'et',
+    'eux', 'il', 'ils', 'j', 'je', 'l', 'la', 'le', 'les', 'leur', 'leurs', 'lui', 'm', 'ma', 'mais',
+    'me', 'meme', 'mes', 'moi', 'mon', 'n', 'ne', 'nos', 'notre', 'nous', 'on', 'ou', 'par', 'pas',
+    'pour', 'qu', 'que', 'qui', 's', 'sa', 'se', 'ses', 'son', 'sur', 't', 'ta', 'te', 'tes', 'toi',
+    'ton', 'tu', 'un', 'une', 'vos', 'votre', 'vous', 'y', 'est', 'sont', 'ete', 'etre', 'cette',
+    'cet',
+}
+
+# Formes irrégulières du vocabulaire immobilier, ramenées à une forme canonique
+DOMAIN_FORMS = {
+    'baux': 'bail',
+    'bail': 'bail',
+    'syndicat': 'syndic',
+    'syndics': 'syndic',
+    'tantiemes': 'tantieme',
+    'copropriete': 'copropriet',
+    'coproprietes': 'copropriet',
+    'coproprietaire': 'copropriet',
+    'coproprietaires': 'copropriet',
+}
+
+# Expressions métier indexées en plus des termes simples
+DOMAIN_PHRASES = [
+    ('appel', 'charges'),
+    ('appel', 'fonds'),
+    ('releve', 'charges'),
+    ('releve', 'compte'),
+    ('etat', 'lieux'),
+    ('taxe', 'fonciere'),
+    ('depot', 'garantie'),
+    ('proces', 'verbal'),
+    ('assemblee', 'generale'),
+    ('quittance', 'loyer'),
+]
+
+# Suffixes retirés par le raciniseur, du plus long au plus court
+_SUFFIXES = (
+    'issements', 'issement', 'atrices', 'ateurs', 'ations', 'ements', 'iteres',
+    'atrice', 'ateur', 'ation', 'ement', 'ances', 'ences', 'iques', 'ables', 'istes',
+    'euses', 'ance', 'ence', 'ique', 'able', 'iste', 'euse', 'ites', 'ives', 'ite',
+    'ive', 'ifs', 'eux', 'if',
+)
+_ENDINGS = ('iere', 'ier', 'ees', 'ee', 'es', 'er', 'e')
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+_local = threading.local()
+_write_lock = threading.Lock()
+
+
+def fold_accents(text):
+    """Met en minuscules et supprime les accents (é -> e, œ -> oe...)"""
+    text = (text or '').lower().replace('œ', 'oe').replace('æ', 'ae')
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def stem(word):
+    """Raciniseur français léger (pluriels, féminins et suffixes courants)"""
+    if word in DOMAIN_FORMS:
+        return DOMAIN_FORMS[word]
+    if word.isdigit() or len(word) <= 3:
+        return word
+
+    # Pluriels
+    if word.endswith('aux') and len(word) > 4:
+        word = word[:-3] + 'al'
+    elif word.endswith(('s', 'x')) and not word.endswith(('ss', 'us')):
+        word = word[:-1]
+
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+
+    return word
+
+
+def tokenize(text):
+    """Découpe un texte en termes normalisés et racinisés (mots vides exclus)"""
+    return [stem(token) for token in _TOKEN_RE.findall(fold_accents(text)) if token not in STOPWORDS]
+
+
+_PHRASE_TERMS = {(stem(a), stem(b)): f"{stem(a)}_{stem(b)}" for a, b in DOMAIN_PHRASES}
+
+
+def _phrases(tokens):
+    """Expressions métier présentes dans une suite de termes"""
+    return [_PHRASE_TERMS[pair] for pair in zip(tokens, tokens[1:]) if pair in _PHRASE_TERMS]
+
+
+def extract_terms(text):
+    """Retourne les termes d'un texte, expressions métier comprises"""
+    tokens = tokenize(text)
+    return tokens + _phrases(tokens)
+
+
+class TermCounter:
+    """
+    Compte les termes d'un texte lu par morceaux (pages d'un PDF par exemple)
+    sans conserver le texte ; les expressions à cheval sur deux morceaux sont
+    également comptées.
+    """
+
+    def __init__(self):
+        self.frequencies = {}
+        self.length = 0
+        self._last_token = None
+
+    def add(self, text):
+        tokens = tokenize(text)
+        if not tokens:
+            return
+        previous = [self._last_token] if self._last_token else []
+        for term in tokens + _phrases(previous + tokens):
+            self.frequencies[term] = self.frequencies.get(term, 0) + 1
+            self.length += 1
+        self._last_token = tokens[-1]
+
+
+def _get_connection():
+    """Retourne la connexion SQLite du thread courant (créée au besoin)"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        os.makedirs(os.path.dirname(INDEX_PATH), exist_ok=True)
+        conn = sqlite3.connect(INDEX_PATH, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS docs (
+                document_id INTEGER PRIMARY KEY,
+                length INTEGER NOT NULL,
+                property_id INTEGER,
+                company_id INTEGER,
+                meta TEXT
+            );
+            CREATE INDEX IF NOT EXISTS ix_docs_property ON docs (property_id);
+            CREATE INDEX IF NOT EXISTS ix_docs_company ON docs (company_id);
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                document_id INTEGER NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (term, document_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS ix_postings_document ON postings (document_id);
+            CREATE TABLE IF NOT EXISTS stats (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO stats (key, value) VALUES ('doc_count', 0), ('total_length', 0);
+        """)
+        _local.conn = conn
+    return conn
+
+
+def _remove(conn, document_id):
+    """Retire un document de l'index (sans commit)"""
+    row = conn.execute("SELECT length FROM docs WHERE document_id = ?", (document_id,)).fetchone()
+    if not row:
+        return False
+    conn.execute("DELETE FROM postings WHERE document_id = ?", (document_id,))
+    conn.execute("DELETE FROM docs WHERE document_id = ?", (document_id,))
+    conn.execute("UPDATE stats SET value = value - 1 WHERE key = 'doc_count'")
+    conn.execute("UPDATE stats SET value = value - ? WHERE key = 'total_length'", (row[0],))
+    return True
+
+
+def index_document(document_data, counter=None):
+    """
+    Indexe (ou réindexe) un document extrait. `document_data` a le format des
+    enregistrements produits par document_processor.process_document ; si les
+    termes ont déjà été comptés page par page, `counter` (TermCounter) remplace
+    la lecture de document_data["content"].
+    """
+    document_id = document_data.get("document_id")
+    if document_id is None:
+        return
+
+    if counter is None:
+        counter = TermCounter()
+        counter.add(document_data.get("content", ""))
+    frequencies = counter.frequencies
+    length = counter.length
+
+    meta = {key: value for key, value in document_data.items() if key != "content"}
+
+    with _write_lock:
+        conn = _get_connection()
+        with conn:
+            _remove(conn, document_id)
+            conn.execute(
+                "INSERT INTO docs (document_id, length, property_id, company_id, meta) VALUES (?, ?, ?, ?, ?)",
+                (document_id, length, document_data.get("property_id"),
+                 document_data.get("company_id"), json.dumps(meta, ensure_ascii=False))
+            )
+            conn.executemany(
+                "INSERT INTO postings (term, document_id, tf) VALUES (?, ?, ?)",
+                [(term, document_id, tf) for term, tf in frequencies.items()]
+            )
+            conn.execute("UPDATE stats SET value = value + 1 WHERE key = 'doc_count'")
+            conn.execute("UPDATE stats SET value = value + ? WHERE key = 'total_length'", (length,))
+
+
+def remove_document(document_id):
+    """Retire un document de l'index"""
+    with _write_lock:
+        conn = _get_connection()
+        with conn:
+            return _remove(conn, document_id)
+
+
+def search(query, property_id=None, company_id=None, limit=20):
+    """
+    Recherche les documents contenant tous les termes de la requête.
+    Retourne une liste de (document_id, score, meta) triée par pertinence.
+    """
+    query_terms = list(dict.fromkeys(extract_terms(query)))
+    if not query_terms:
+        return []
+
+    conn = _get_connection()
+    stats = dict(conn.execute("SELECT key, value FROM stats").fetchall())
+    doc_count = stats.get('doc_count', 0)
+    if doc_count <= 0:
+        return []
+    avg_length = max(stats.get('total_length', 0) / doc_count, 1)
+
+    filters = ""
+    params = []
+    if property_id:
+        filters += " AND d.property_id = ?"
+        params.append(property_id)
+    if company_id:
+        filters += " AND d.company_id = ?"
+        params.append(company_id)
+
+    # Fréquence documentaire de chaque terme (dans le périmètre filtré)
+    term_placeholders = ",".join("?" for _ in query_terms)
+    document_frequencies = dict(conn.execute(
+        "SELECT p.term, COUNT(*) FROM postings p "
+        "JOIN docs d ON d.document_id = p.document_id "
+        f"WHERE p.term IN ({term_placeholders})" + filters + " GROUP BY p.term",
+        query_terms + params
+    ).fetchall())
+
+    # Les expressions ne font que bonifier le score, les termes simples sont obligatoires
+    weights = []
+    for term in query_terms:
+        df = document_frequencies.get(term, 0)
+        is_phrase = '_' in term
+        if not df:
+            if is_phrase:
+                continue
+            return []
+        idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+        weights.append((term, (PHRASE_BOOST if is_phrase else 1.0) * idf, 0 if is_phrase else 1))
+    required = sum(weight[2] for weight in weights)
+
+    # Score BM25 calculé par SQLite : seuls les `limit` meilleurs documents sont lus
+    values = ",".join("(?, ?, ?)" for _ in weights)
+    ranked = conn.execute(
+        f"WITH q (term, weight, required) AS (VALUES {values}) "
+        "SELECT p.document_id, SUM(q.weight * p.tf * ? / "
+        "(p.tf + ? * (1 - ? + ? * d.length / ?))) AS score "
+        "FROM q JOIN postings p ON p.term = q.term "
+        "JOIN docs d ON d.document_id = p.document_id "
+        "WHERE 1 = 1" + filters + " "
+        "GROUP BY p.document_id HAVING SUM(q.required) = ? "
+        "ORDER BY score DESC, p.document_id LIMIT ?",
+        [value for weight in weights for value in weight]
+        + [BM25_K1 + 1, BM25_K1, BM25_B, BM25_B, float(avg_length)]
+        + params + [required, limit]
+    ).fetchall()
+    if not ranked:
+        return []
+    scores = dict(ranked)
+    ranked = [doc_id for doc_id, _ in ranked]
+
+    placeholders = ",".join("?" for _ in ranked)
+    metas = dict(conn.execute(
+        f"SELECT document_id, meta FROM docs WHERE document_id IN ({placeholders})", ranked
+    ).fetchall())
+
+    return [(doc_id, scores[doc_id], json.loads(metas.get(doc_id) or '{}')) for doc_id in ranked]
+
+
+def locate_excerpts(text, query, page_offsets=None, max_excerpts=MAX_EXCERPTS):
+    """
+    Retourne les lignes du texte contenant au moins un terme de la requête, avec
+    leur numéro de page lorsque `page_offsets` ([numéro, position de début], ...) est connu
+    """
+    query_terms = set(tokenize(query))
+    starts = [offset for _, offset in page_offsets or []]
+    excerpts = []
+    position = 0
+    for line in (text or '').split('\n'):
+        if query_terms & set(tokenize(line)):
+            index = bisect.bisect_right(starts, position) - 1
+            excerpts.append({
+                "text": line.strip(),
+                "page": page_offsets[index][0] if index >= 0 else None,
+            })
+            if len(excerpts) >= max_excerpts:
+                break
+        position += len(line) + 1
+    return excerpts
+
+
+def build_excerpts(text, query, max_excerpts=MAX_EXCERPTS):
+    """Retourne les lignes du texte contenant au moins un terme de la requête"""
+    return [excerpt["text"] for excerpt in locate_excerpts(text, query, max_excerpts=max_excerpts)]
+
+
+def rebuild_index(documents_content):
+    """Reconstruit entièrement l'index à partir d'une liste d'enregistrements extraits"""
+    # Ne garder que l'extraction la plus récente de chaque document
+    latest = {}
+    for content in documents_content:
+        document_id = content.get("document_id")
+        if document_id is None:
+            continue
+        previous = latest.get(document_id)
+        if not previous or (content.get("extracted_at") or '') > (previous.get("extracted_at") or ''):
+            latest[document_id] = content
+
+    with _write_lock:
+        conn = _get_connection()
+        with conn:
+            conn.execute("DELETE FROM postings")
+            conn.execute("DELETE FROM docs")
+            conn.execute("UPDATE stats SET value = 0")
+
+    for content in latest.values():
+        index_document(content)
+
+    logger.info(f"Index de recherche reconstruit: {len(latest)} documents")
+    return len(latest)
+
+
+if __name__ == "__main__":
+    from document_processor import get_all_documents_content
+
+    count = rebuild_index(get_all_documents_content())
+    print(f"{count} documents indexés dans {INDEX_PATH}")
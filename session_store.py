@@ -0,0 +1,302 @@
+"""
+Sessions HTTP côté serveur, avec stockage interchangeable (SESSION_TYPE) :
+
+- 'sqlalchemy' (par défaut) : table http_sessions de la base de l'application,
+  via le pool de connexions du moteur SQLAlchemy. Les écritures passent par
+  leur propre connexion, jamais par db.session : enregistrer la session ne
+  valide pas les modifications en cours de la requête.
+- 'sqlite' : magasin clé-valeur local (SESSION_SQLITE_PATH), une connexion par
+  thread, partagé par les workers d'un même serveur.
+- 'filesystem' : ancien stockage Flask-Session, un fichier par session.
+
+Le cookie ne porte qu'un identifiant aléatoire (signé si SESSION_USE_SIGNER).
+Le contenu, sérialisé en JSON, n'est réécrit que s'il a changé ou si
+l'expiration doit être prolongée (au plus une fois par SESSION_REFRESH_INTERVAL) :
+la plupart des requêtes ne font qu'une lecture. Une session vide n'est jamais
+stockée.
+
+Les sessions expirées sont purgées par lots, au plus une fois par
+SESSION_PURGE_INTERVAL dans chaque processus, ou par tâche planifiée :
+
+    python session_store.py --purge
+"""
+import os
+import time
+import sqlite3
+import logging
+import secrets
+import argparse
+import threading
+from datetime import datetime, timedelta
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import Signer, BadSignature
+from sqlalchemy import select, update, insert, delete
+from werkzeug.datastructures import CallbackDict
+
+from database import db
+from models import HttpSession
+
+# Délai minimal entre deux prolongations de l'expiration d'une session inchangée (secondes)
+REFRESH_INTERVAL = timedelta(seconds=int(os.environ.get("SESSION_REFRESH_INTERVAL", "3600")))
+
+# Purge des sessions expirées : fréquence par processus (secondes) et taille des lots
+PURGE_INTERVAL = int(os.environ.get("SESSION_PURGE_INTERVAL", "3600"))
+PURGE_BATCH_SIZE = int(os.environ.get("SESSION_PURGE_BATCH", "500"))
+
+SQLITE_PATH = os.environ.get("SESSION_SQLITE_PATH", os.path.join("instance", "sessions.sqlite3"))
+
+_purge_state = {'last_run': 0.0}
+_purge_lock = threading.Lock()
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session dont le contenu est stocké côté serveur sous l'identifiant sid"""
+
+    def __init__(self, initial=None, sid=None, stored=None, expires_at=None):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.stored = stored  # contenu sérialisé tel que lu (pour ne réécrire que s'il change)
+        self.expires_at = expires_at
+        self.modified = False
+
+
+class SqlAlchemySessionBackend:
+    """Sessions dans la table http_sessions, via le pool du moteur de l'application"""
+
+    table = HttpSession.__table__
+
+    def get(self, sid):
+        with db.engine.connect() as conn:
+            row = conn.execute(
+                select(self.table.c.data, self.table.c.expires_at).where(self.table.c.id == sid)
+            ).first()
+        return (row.data, row.expires_at) if row else None
+
+    def save(self, sid, data, expires_at):
+        with db.engine.begin() as conn:
+            result = conn.execute(
+                update(self.table).where(self.table.c.id == sid).values(data=data, expires_at=expires_at)
+            )
+            if result.rowcount == 0:
+                conn.execute(insert(self.table).values(id=sid, data=data, expires_at=expires_at))
+
+    def delete(self, sid):
+        with db.engine.begin() as conn:
+            conn.execute(delete(self.table).where(self.table.c.id == sid))
+
+    def purge_expired(self, now, batch_size):
+        """Supprime les sessions expirées par lots (une transaction courte par lot)"""
+        purged = 0
+        while True:
+            with db.engine.begin() as conn:
+                ids = conn.execute(
+                    select(self.table.c.id).where(self.table.c.expires_at <= now).limit(batch_size)
+                ).scalars().all()
+                if ids:
+                    conn.execute(delete(self.table).where(self.table.c.id.in_(ids)))
+            purged += len(ids)
+            if len(ids) < batch_size:
+                return purged
+
+
+class SqliteSessionBackend:
+    """Magasin clé-valeur SQLite local (une connexion par thread)"""
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+
+    def _get_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    id TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    expires_at TEXT NOT NULL
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS ix_sessions_expires_at ON sessions (expires_at);
+            """)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _format(value):
+        return value.isoformat(sep=' ', timespec='seconds')
+
+    def get(self, sid):
+        row = self._get_connection().execute(
+            "SELECT data, expires_at FROM sessions WHERE id = ?", (sid,)
+        ).fetchone()
+        return (row[0], datetime.fromisoformat(row[1])) if row else None
+
+    def save(self, sid, data, expires_at):
+        with self._write_lock:
+            conn = self._get_connection()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO sessions (id, data, expires_at) VALUES (?, ?, ?)",
+                    (sid, data, self._format(expires_at))
+                )
+
+    def delete(self, sid):
+        with self._write_lock:
+            conn = self._get_connection()
+            with conn:
+                conn.execute("DELETE FROM sessions WHERE id = ?", (sid,))
+
+    def purge_expired(self, now, batch_size):
+        purged = 0
+        while True:
+            with self._write_lock:
+                conn = self._get_connection()
+                with conn:
+                    count = conn.execute(
+                        "DELETE FROM sessions WHERE id IN "
+                        "(SELECT id FROM sessions WHERE expires_at <= ? LIMIT ?)",
+                        (self._format(now), batch_size)
+                    ).rowcount
+            purged += count
+            if count < batch_size:
+                return purged
+
+
+class ServerSessionInterface(SessionInterface):
+    """Interface de session Flask adossée à un backend (get/save/delete/purge_expired)"""
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def _signer(self, app):
+        if not app.config.get('SESSION_USE_SIGNER'):
+            return None
+        return Signer(app.secret_key, salt='flask-session', key_derivation='hmac')
+
+    def _read_sid(self, app, request):
+        value = request.cookies.get(self.get_cookie_name(app))
+        if not value:
+            return None
+        signer = self._signer(app)
+        if signer is None:
+            return value
+        try:
+            return signer.unsign(value).decode()
+        except BadSignature:
+            return None
+
+    def open_session(self, app, request):
+        sid = self._read_sid(app, request)
+        if sid:
+            try:
+                found = self.backend.get(sid)
+            except Exception as e:
+                logging.error(f"Lecture de la session impossible: {str(e)}")
+                found = None
+            if found and found[1] > datetime.utcnow():
+                data, expires_at = found
+                return ServerSession(self.serializer.loads(data), sid=sid, stored=data, expires_at=expires_at)
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        maybe_purge_expired(self.backend)
+
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        # Session vidée (déconnexion) : supprimer le contenu stocké et le cookie
+        if not session:
+            if session.stored is not None:
+                self.backend.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=secure,
+                                       samesite=samesite, httponly=httponly)
+            return
+
+        data = self.serializer.dumps(dict(session))
+        now = datetime.utcnow()
+        lifetime = app.permanent_session_lifetime
+        needs_refresh = session.expires_at is None or session.expires_at - now < lifetime - REFRESH_INTERVAL
+        if data == session.stored and not needs_refresh:
+            return
+
+        if session.sid is None:
+            session.sid = secrets.token_urlsafe(32)
+        expires_at = now + lifetime
+        self.backend.save(session.sid, data, expires_at)
+
+        signer = self._signer(app)
+        cookie_value = signer.sign(session.sid).decode() if signer else session.sid
+        permanent = app.config.get('SESSION_PERMANENT', True) or session.permanent
+        response.set_cookie(
+            name, cookie_value, expires=expires_at if permanent else None,
+            httponly=httponly, domain=domain, path=path, secure=secure, samesite=samesite
+        )
+
+
+def purge_expired(backend, batch_size=PURGE_BATCH_SIZE):
+    """Supprime les sessions expirées ; retourne leur nombre"""
+    purged = backend.purge_expired(datetime.utcnow(), batch_size)
+    if purged:
+        logging.info(f"{purged} sessions expirées supprimées")
+    return purged
+
+
+def maybe_purge_expired(backend):
+    """Purge les sessions expirées si la dernière purge de ce processus date de plus de PURGE_INTERVAL"""
+    now = time.time()
+    if now - _purge_state['last_run'] < PURGE_INTERVAL or not _purge_lock.acquire(blocking=False):
+        return
+    try:
+        _purge_state['last_run'] = now
+        purge_expired(backend)
+    except Exception as e:
+        logging.error(f"Erreur lors de la purge des sessions expirées: {str(e)}")
+    finally:
+        _purge_lock.release()
+
+
+def create_backend(app):
+    """Backend correspondant à SESSION_TYPE ('sqlalchemy' ou 'sqlite')"""
+    session_type = app.config.get('SESSION_TYPE', 'sqlalchemy')
+    if session_type == 'sqlalchemy':
+        return SqlAlchemySessionBackend()
+    if session_type == 'sqlite':
+        return SqliteSessionBackend(app.config.get('SESSION_SQLITE_PATH', SQLITE_PATH))
+    raise ValueError(f"Type de session inconnu: {session_type}")
+
+
+def init_session(app):
+    """Installe l'interface de session choisie par SESSION_TYPE"""
+    if app.config.get('SESSION_TYPE') == 'filesystem':
+        from flask_session import Session
+        Session(app)
+        return
+    app.session_interface = ServerSessionInterface(create_backend(app))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintenance des sessions côté serveur")
+    parser.add_argument('--purge', action='store_true', help="Supprimer les sessions expirées")
+    args = parser.parse_args()
+
+    from app import app
+
+    with app.app_context():
+        if args.purge:
+            print(f"Sessions expirées supprimées: {purge_expired(create_backend(app))}")
+        else:
+            parser.print_help()
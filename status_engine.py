@@ -0,0 +1,133 @@
+"""
+Moteur de mise à jour des statuts en retard (paiements et charges).
+
+Les statuts sont basculés par des UPDATE ensemblistes au lieu de charger chaque
+ligne en Python. Le moteur s'exécute au plus une fois par jour et par processus
+(via `maybe_run_status_update`), ou à la demande depuis un cron :
+
+    python status_engine.py
+"""
+import os
+import logging
+import threading
+from datetime import datetime, date, timedelta
+
+from database import db
+
+# Statuts "en attente" -> "en retard" pour chaque modèle
+PAYMENT_PENDING_STATUS = 'En attente'
+PAYMENT_LATE_STATUS = 'En retard'
+EXPENSE_PENDING_STATUS = 'à_payer'
+EXPENSE_LATE_STATUS = 'en_retard'
+
+# Délai avant un nouvel essai après une exécution en échec (secondes)
+RETRY_DELAY = int(os.environ.get("STATUS_ENGINE_RETRY_DELAY", "300"))
+
+# État du moteur pour ce processus
+_lock = threading.Lock()
+_last_run = {
+    'run_at': None,        # Date et heure de la dernière exécution
+    'run_date': None,      # Jour de la dernière exécution réussie (pour la limite quotidienne)
+    'retry_at': None,      # Après un échec, pas de nouvel essai avant cette date et heure
+    'payments_updated': 0,
+    'expenses_updated': 0,
+    'error': None,
+}
+
+
+def update_late_payments(today=None):
+    """Passe en 'En retard' les paiements en attente dont la date est dépassée"""
+    from models import Payment
+
+    today = today or date.today()
+    return Payment.query.filter(
+        Payment.status == PAYMENT_PENDING_STATUS,
+        Payment.payment_date < today
+    ).update({Payment.status: PAYMENT_LATE_STATUS}, synchronize_session=False)
+
+
+def update_late_expenses(today=None):
+    """Passe en 'en_retard' les charges à payer dont l'échéance est dépassée"""
+    from models import Expense
+
+    today = today or date.today()
+    return Expense.query.filter(
+        Expense.status == EXPENSE_PENDING_STATUS,
+        Expense.due_date < today
+    ).update({Expense.status: EXPENSE_LATE_STATUS}, synchronize_session=False)
+
+
+def run_status_update(today=None):
+    """
+    Exécute la mise à jour des statuts pour les paiements et les charges.
+    Doit être appelée dans un contexte d'application Flask.
+    Retourne un dictionnaire avec les compteurs de lignes mises à jour.
+    """
+    today = today or date.today()
+
+    with _lock:
+        try:
+            payments_updated = update_late_payments(today)
+            expenses_updated = update_late_expenses(today)
+            db.session.commit()
+            error = None
+        except Exception as e:
+            db.session.rollback()
+            payments_updated = 0
+            expenses_updated = 0
+            error = str(e)
+            logging.error(f"Erreur lors de la mise à jour des statuts en retard: {error}")
+
+        # La journée n'est acquise qu'après une validation réussie ; sinon nouvel essai après RETRY_DELAY
+        now = datetime.now()
+        _last_run.update({
+            'run_at': now,
+            'payments_updated': payments_updated,
+            'expenses_updated': expenses_updated,
+            'error': error,
+        })
+        if error is None:
+            _last_run.update({'run_date': today, 'retry_at': None})
+        else:
+            _last_run['retry_at'] = now + timedelta(seconds=RETRY_DELAY)
+
+    if payments_updated or expenses_updated:
+        logging.info(
+            f"Statuts mis à jour: {payments_updated} paiements, {expenses_updated} charges en retard"
+        )
+
+    return get_status_engine_stats()
+
+
+def maybe_run_status_update():
+    """
+    Exécute la mise à jour si elle n'a pas encore réussi aujourd'hui dans ce
+    processus (après un échec, au plus une tentative par RETRY_DELAY)
+    """
+    if _last_run['run_date'] == date.today():
+        return None
+    if _last_run['retry_at'] and datetime.now() < _last_run['retry_at']:
+        return None
+    return run_status_update()
+
+
+def get_status_engine_stats():
+    """Retourne la date de la dernière exécution et les compteurs associés"""
+    run_at = _last_run['run_at']
+    return {
+        'last_run': run_at.isoformat() if run_at else None,
+        'payments_updated': _last_run['payments_updated'],
+        'expenses_updated': _last_run['expenses_updated'],
+        'error': _last_run['error'],
+    }
+
+
+if __name__ == "__main__":
+    # Exécution planifiée (cron) : python status_engine.py
+    from app import app
+
+    with app.app_context():
+        stats = run_status_update()
+        print(f"Dernière exécution: {stats['last_run']}")
+        print(f"Paiements passés en retard: {stats['payments_updated']}")
+        print(f"Charges passées en retard: {stats['expenses_updated']}")
@@ -0,0 +1,185 @@
+"""
+Chargement de l'utilisateur connecté, au plus une fois par requête.
+
+get_request_user() est la seule porte d'entrée : le before_request
+load_logged_in_user, le décorateur login_required, get_current_user() et le
+context processor des templates partagent l'utilisateur conservé dans g.
+
+Entre les requêtes, les colonnes des utilisateurs sont gardées dans un petit
+cache LRU en mémoire (USER_CACHE_SIZE entrées, USER_CACHE_TTL secondes, 60 par
+défaut). Un succès ne coûte que la lecture des versions partagées des caches,
+faite une fois par requête : l'instance est rattachée à la session sans
+rechargement (merge(load=False)) et reste modifiable, comme dans
+edit_profile. Le mot de passe et le jeton de confirmation ne sont pas mis en
+cache ; ils sont chargés à la demande s'ils sont lus.
+
+Toute modification ou suppression d'un utilisateur validée via la session
+SQLAlchemy (y compris Query.update/Query.delete) invalide son entrée. Le cache
+est propre à chaque processus : une modification faite dans un autre worker ou
+par un script (delete_user.py) incrémente la version partagée 'users'
+(cache_versions.py), ce qui invalide les entrées de tous les processus.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from flask import g, session
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+import cache_versions
+from database import db
+from models import User
+
+# Durée de vie d'une entrée (secondes)
+USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", "60"))
+
+# Nombre maximal d'utilisateurs conservés (les moins récemment utilisés sont évincés)
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "1000"))
+
+# Colonnes conservées (password_hash et confirmation_token restent en base)
+CACHED_COLUMNS = (
+    'id', 'email', 'username', 'first_name', 'last_name', 'is_admin',
+    'created_at', 'email_confirmed', 'confirmation_sent_at',
+)
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # user_id -> (expire_at, generation, colonnes)
+# Une génération est le triplet (invalidations globales, de l'utilisateur, version partagée)
+_generations = {}         # user_id -> compteur d'invalidations
+_generation_all = 0       # invalidations globales (modifications en masse)
+_stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'evictions': 0}
+
+
+# Version partagée entre les processus
+SHARED_VERSION = 'users'
+
+
+def _generation(user_id):
+    return (_generation_all, _generations.get(user_id, 0))
+
+
+def _lookup(user_id):
+    """Retourne (trouvé, colonnes, génération) ; la génération est à repasser à _store()"""
+    shared = cache_versions.get_version(SHARED_VERSION)
+    with _lock:
+        generation = _generation(user_id) + (shared,)
+        entry = _entries.get(user_id)
+        # Version partagée illisible : seul le TTL s'applique
+        if (entry and entry[0] > time.time() and entry[1][:2] == generation[:2]
+                and (shared is None or entry[1][2] == shared)):
+            _entries.move_to_end(user_id)
+            _stats['hits'] += 1
+            return True, entry[2], generation
+        _stats['misses'] += 1
+    return False, None, generation
+
+
+def _store(user_id, values, generation):
+    """Conserve les colonnes lues en base, sauf si une invalidation a eu lieu depuis _lookup()"""
+    with _lock:
+        if _generation(user_id) != generation[:2]:
+            return
+        _entries[user_id] = (time.time() + USER_CACHE_TTL, generation, values)
+        _entries.move_to_end(user_id)
+        while len(_entries) > USER_CACHE_SIZE:
+            _entries.popitem(last=False)
+            _stats['evictions'] += 1
+
+
+def _attach(values):
+    """Instance User persistante construite depuis le cache, sans requête SQL"""
+    user = User(**values)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def load_user(user_id):
+    """Retourne l'utilisateur (attaché à la session courante), ou None s'il n'existe pas"""
+    found, values, generation = _lookup(user_id)
+    if found:
+        return _attach(values)
+
+    user = db.session.get(User, user_id)
+    if user is not None:
+        _store(user_id, {column: getattr(user, column) for column in CACHED_COLUMNS}, generation)
+    return user
+
+
+def get_request_user():
+    """
+    Utilisateur connecté de la requête courante, ou None. Chargé au plus une fois
+    par requête (et rechargé seulement si user_id change en session).
+    """
+    user_id = session.get('user_id')
+    if 'identity_user_id' not in g or g.identity_user_id != user_id:
+        g.user = load_user(user_id) if user_id else None
+        g.identity_user_id = user_id
+    return g.user
+
+
+def invalidate(user_ids=None):
+    """Invalide des utilisateurs (tous si None)"""
+    global _generation_all
+    with _lock:
+        if user_ids is None:
+            _generation_all += 1
+            _entries.clear()
+            _stats['invalidations'] += 1
+            return
+        for user_id in user_ids:
+            _generations[user_id] = _generations.get(user_id, 0) + 1
+            _entries.pop(user_id, None)
+        _stats['invalidations'] += len(user_ids)
+
+
+def get_stats():
+    """Retourne les compteurs du cache"""
+    with _lock:
+        lookups = _stats['hits'] + _stats['misses']
+        return {
+            **_stats,
+            'hit_rate': round(_stats['hits'] / lookups, 3) if lookups else 0,
+            'entries': len(_entries),
+        }
+
+
+# Invalidation par les événements de session : les utilisateurs modifiés sont
+# collectés pendant les flush et invalidés à la validation de la transaction.
+
+def _pending(session):
+    # Les autres processus le verront par la version partagée
+    cache_versions.track(session, {SHARED_VERSION})
+    return session.info.setdefault('user_cache_pending', set())
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_flush_changes(session, flush_context, instances):
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User):
+            if obj in session.dirty and not session.is_modified(obj):
+                continue
+            _pending(session).add(obj.id)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _collect_bulk_changes(orm_execute_state):
+    """Query.update / Query.delete ne passent pas par le flush : tout invalider"""
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and mapper.class_ is User:
+            _pending(orm_execute_state.session).add(None)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    pending = session.info.pop('user_cache_pending', None)
+    if not pending:
+        return
+    invalidate(None if None in pending else pending)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_after_rollback(session):
+    session.info.pop('user_cache_pending', None)
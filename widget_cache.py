@@ -0,0 +1,231 @@
+"""
+Cache des données des widgets du tableau de bord.
+
+Les résultats sont conservés en mémoire, par clé (utilisateur, type de widget,
+paramètres), pendant une durée limitée (WIDGET_CACHE_TTL, 300 s par défaut).
+Chaque type de widget déclare les modèles dont il dépend : une écriture validée
+sur l'un de ces modèles (via la session SQLAlchemy, y compris les
+Query.update/Query.delete) invalide uniquement les widgets concernés.
+
+Le cache est propre à chaque processus ; avec plusieurs workers Gunicorn, les
+modifications faites dans un autre worker sont détectées par la version
+partagée de chaque type de widget (cache_versions.py, lue une fois par requête).
+
+Les compteurs de succès/échecs sont exposés par get_stats().
+"""
+import os
+import time
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import cache_versions
+from models import Payment, Expense, Property, Company, UserDashboardPreference
+
+# Durée de vie par défaut d'une entrée (secondes)
+DEFAULT_TTL = int(os.environ.get("WIDGET_CACHE_TTL", "300"))
+
+# Durées de vie spécifiques par type de widget (les retards dépendent aussi de la date du jour)
+WIDGET_TTLS = {
+    'monthly_income': DEFAULT_TTL * 3,
+    'yearly_summary': DEFAULT_TTL * 3,
+}
+
+# Configuration des widgets d'un utilisateur (clé réservée, invalidée par utilisateur)
+LAYOUT = 'layout'
+
+# Modèles dont dépend chaque type de widget
+WIDGET_DEPENDENCIES = {
+    'late_payments': (Payment, Property),
+    'upcoming_expenses': (Expense, Property, Company),
+    'late_expenses': (Expense, Property, Company),
+    'monthly_income': (Payment, Expense),
+    'yearly_summary': (Payment, Expense),
+    'property_status': (Property, Payment, Expense),
+}
+
+# Nombre maximal d'entrées conservées (les plus anciennes sont évincées)
+MAX_ENTRIES = 5000
+
+_lock = threading.Lock()
+_entries = {}       # (user_id, widget_type, params) -> (expire_at, generation, valeur)
+# Une génération est le couple (compteur local, version partagée)
+_generations = {}   # widget_type ou (LAYOUT, user_id) -> compteur d'invalidations
+_stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'evictions': 0}
+_widget_stats = {}  # widget_type -> {'hits': ..., 'misses': ...}
+
+
+def _widgets_for_model(model):
+    """Types de widgets dépendant d'un modèle"""
+    return [widget_type for widget_type, models in WIDGET_DEPENDENCIES.items() if model in models]
+
+
+def _generation_key(user_id, widget_type):
+    return (LAYOUT, user_id) if widget_type == LAYOUT else widget_type
+
+
+def _count(widget_type, outcome):
+    _stats[outcome] += 1
+    counters = _widget_stats.setdefault(widget_type, {'hits': 0, 'misses': 0})
+    counters[outcome] += 1
+
+
+def _shared_name(widget_type):
+    return f'widget:{widget_type}'
+
+
+def _key(user_id, widget_type, params):
+    return (user_id, widget_type, tuple(sorted((params or {}).items())))
+
+
+def lookup(user_id, widget_type, params=None):
+    """
+    Cherche un widget dans le cache. Retourne (trouvé, valeur, génération) ;
+    la génération est à repasser à store() après calcul.
+    """
+    generation_key = _generation_key(user_id, widget_type)
+    shared = cache_versions.get_version(_shared_name(widget_type))
+    with _lock:
+        generation = (_generations.get(generation_key, 0), shared)
+        entry = _entries.get(_key(user_id, widget_type, params))
+        # Version partagée illisible : seul le TTL s'applique
+        if (entry and entry[0] > time.time() and entry[1][0] == generation[0]
+                and (shared is None or entry[1][1] == shared)):
+            _count(widget_type, 'hits')
+            return True, entry[2], generation
+        _count(widget_type, 'misses')
+    return False, None, generation
+
+
+def store(user_id, widget_type, params, value, generation):
+    """Conserve un résultat calculé, sauf si une invalidation a eu lieu depuis lookup()"""
+    now = time.time()
+    with _lock:
+        if _generations.get(_generation_key(user_id, widget_type), 0) != generation[0]:
+            return
+        if len(_entries) >= MAX_ENTRIES:
+            _evict(now)
+        ttl = WIDGET_TTLS.get(widget_type, DEFAULT_TTL)
+        _entries[_key(user_id, widget_type, params)] = (now + ttl, generation, value)
+
+
+def get_or_compute(user_id, widget_type, compute, params=None):
+    """
+    Retourne les données en cache d'un widget, ou les calcule avec compute()
+    et les conserve jusqu'à expiration ou invalidation.
+    """
+    found, value, generation = lookup(user_id, widget_type, params)
+    if not found:
+        value = compute()
+        store(user_id, widget_type, params, value, generation)
+    return value
+
+
+def _evict(now):
+    """Supprime les entrées expirées, puis les plus proches de l'expiration si besoin"""
+    expired = [key for key, entry in _entries.items() if entry[0] <= now]
+    if len(expired) < MAX_ENTRIES // 10:
+        expired += sorted(_entries, key=lambda key: _entries[key][0])[:MAX_ENTRIES // 10]
+    for key in expired:
+        _entries.pop(key, None)
+    _stats['evictions'] += len(expired)
+
+
+def invalidate(widget_types=None, user_id=None):
+    """
+    Invalide des types de widgets (tous si None). Avec user_id, invalide la
+    configuration des widgets de cet utilisateur.
+    """
+    with _lock:
+        if user_id is not None:
+            generation_keys = [(LAYOUT, user_id)]
+        elif widget_types is None:
+            generation_keys = list(WIDGET_DEPENDENCIES)
+            generation_keys += [key for key in _generations if isinstance(key, tuple)]
+        else:
+            generation_keys = list(widget_types)
+        for generation_key in generation_keys:
+            _generations[generation_key] = _generations.get(generation_key, 0) + 1
+        _stats['invalidations'] += len(generation_keys)
+
+
+def clear():
+    """Vide entièrement le cache"""
+    with _lock:
+        _entries.clear()
+        _generations.clear()
+
+
+def get_stats():
+    """Retourne les compteurs du cache (globaux et par type de widget)"""
+    with _lock:
+        lookups = _stats['hits'] + _stats['misses']
+        return {
+            **_stats,
+            'hit_rate': round(_stats['hits'] / lookups, 3) if lookups else 0,
+            'entries': len(_entries),
+            'widgets': {widget_type: dict(counters) for widget_type, counters in _widget_stats.items()},
+        }
+
+
+# Invalidation par les événements de session : les modifications sont
+# collectées pendant les flush et appliquées à la validation de la transaction.
+
+_TRACKED_MODELS = tuple({model for models in WIDGET_DEPENDENCIES.values() for model in models})
+
+
+def _pending(session):
+    return session.info.setdefault('widget_cache_pending', {'widgets': set(), 'layouts': set()})
+
+
+def _track(session, model, user_id=None):
+    pending = _pending(session)
+    if model is UserDashboardPreference:
+        pending['layouts'].add(user_id)
+        widget_types = [LAYOUT]
+    elif issubclass(model, _TRACKED_MODELS):
+        widget_types = _widgets_for_model(model)
+        pending['widgets'].update(widget_types)
+    else:
+        return
+    # Les autres processus le verront par la version partagée
+    cache_versions.track(session, {_shared_name(widget_type) for widget_type in widget_types})
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_flush_changes(session, flush_context, instances):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, _TRACKED_MODELS + (UserDashboardPreference,)):
+            if obj in session.dirty and not session.is_modified(obj):
+                continue
+            _track(session, type(obj), getattr(obj, 'user_id', None))
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _collect_bulk_changes(orm_execute_state):
+    """Query.update / Query.delete et les insertions en masse ne passent pas par le flush"""
+    if orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None:
+            _track(orm_execute_state.session, mapper.class_)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    pending = session.info.pop('widget_cache_pending', None)
+    if not pending:
+        return
+    if pending['widgets']:
+        invalidate(pending['widgets'])
+    for user_id in pending['layouts']:
+        # Utilisateur inconnu (suppression en masse) : invalider toutes les configurations
+        if user_id is None:
+            invalidate()
+        else:
+            invalidate(user_id=user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_after_rollback(session):
+    session.info.pop('widget_cache_pending', None)
@@ -0,0 +1,147 @@
+"""
+Exécution groupée des widgets du tableau de bord.
+
+Chaque type de widget déclare les sources de données dont il dépend. Pour un
+affichage, les widgets absents du cache (widget_cache) sont regroupés : chaque
+source partagée n'est chargée qu'une fois, puis les widgets indépendants sont
+calculés en parallèle dans un pool de threads, chacun dans son propre contexte
+d'application (et donc sa propre session SQLAlchemy).
+
+Les résultats sont produits au fur et à mesure de leur achèvement, ce qui permet
+de les diffuser en flux au navigateur.
+"""
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from flask import current_app
+
+import widget_cache
+
+logger = logging.getLogger(__name__)
+
+# Nombre de threads de calcul des widgets par processus (1 = calcul séquentiel)
+WORKER_COUNT = int(os.environ.get("DASHBOARD_WIDGET_WORKERS", "4"))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """Pool de threads créé au premier usage (donc après le fork des workers Gunicorn)"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WORKER_COUNT, thread_name_prefix="dashboard-widget")
+        return _executor
+
+
+def _run_in_app_context(app, function, *args, **kwargs):
+    with app.app_context():
+        return function(*args, **kwargs)
+
+
+def iter_widgets(user_id, widgets, functions, sources, loaders):
+    """
+    Calcule les widgets demandés et produit (widget_id, données) dans l'ordre
+    où ils sont prêts (les résultats en cache d'abord).
+
+    - widgets : [(widget_id, widget_type, paramètres)]
+    - functions : {widget_type: fonction(user_id, **paramètres, **sources)}
+    - sources : {widget_type: (noms des sources utilisées)}
+    - loaders : {nom de source: fonction de chargement}
+
+    Une source en échec n'est pas transmise : le widget la charge alors lui-même.
+    """
+    # Regrouper les widgets identiques (même type et mêmes paramètres)
+    jobs = {}
+    for widget_id, widget_type, params in widgets:
+        key = (widget_type, tuple(sorted(params.items())))
+        if key in jobs:
+            jobs[key]['ids'].append(widget_id)
+            continue
+        found, value, generation = widget_cache.lookup(user_id, widget_type, params)
+        jobs[key] = {'type': widget_type, 'params': params, 'generation': generation,
+                     'ids': [widget_id], 'found': found, 'value': value}
+
+    pending = []
+    for job in jobs.values():
+        if job['found']:
+            for widget_id in job['ids']:
+                yield widget_id, job['value']
+        else:
+            pending.append(job)
+    if not pending:
+        return
+
+    def finish(job, function):
+        try:
+            value = function()
+        except Exception as e:
+            logger.error(f"Erreur lors du calcul du widget {job['type']}: {str(e)}")
+            return {}
+        widget_cache.store(user_id, job['type'], job['params'], value, job['generation'])
+        return value
+
+    if WORKER_COUNT <= 1:
+        # Calcul séquentiel : les sources partagées restent chargées une seule fois
+        loaded = {}
+        for job in pending:
+            kwargs = dict(job['params'])
+            for name in sources.get(job['type'], ()):
+                if name not in loaded:
+                    try:
+                        loaded[name] = loaders[name]()
+                    except Exception as e:
+                        logger.error(f"Erreur lors du chargement de la source de widgets {name}: {str(e)}")
+                        loaded[name] = None
+                if loaded[name] is not None:
+                    kwargs[name] = loaded[name]
+            value = finish(job, lambda: functions[job['type']](user_id, **kwargs))
+            for widget_id in job['ids']:
+                yield widget_id, value
+        return
+
+    app = current_app._get_current_object()
+    executor = _get_executor()
+
+    needed = {name for job in pending for name in sources.get(job['type'], ())}
+    source_futures = {
+        executor.submit(_run_in_app_context, app, loaders[name]): name for name in needed
+    }
+    loaded = {}
+    failed = set()
+    widget_futures = {}
+
+    def submit_ready():
+        """Lance les widgets dont toutes les sources sont disponibles"""
+        submitted = set()
+        for job in list(pending):
+            names = sources.get(job['type'], ())
+            if all(name in loaded or name in failed for name in names):
+                pending.remove(job)
+                kwargs = dict(job['params'])
+                kwargs.update({name: loaded[name] for name in names if name in loaded})
+                future = executor.submit(_run_in_app_context, app, functions[job['type']], user_id, **kwargs)
+                widget_futures[future] = job
+                submitted.add(future)
+        return submitted
+
+    running = set(source_futures) | submit_ready()
+    while running:
+        done, running = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future in source_futures:
+                name = source_futures[future]
+                try:
+                    loaded[name] = future.result()
+                except Exception as e:
+                    logger.error(f"Erreur lors du chargement de la source de widgets {name}: {str(e)}")
+                    failed.add(name)
+            else:
+                job = widget_futures[future]
+                value = finish(job, future.result)
+                for widget_id in job['ids']:
+                    yield widget_id, value
+        running |= submit_ready()